@@ -0,0 +1,207 @@
+"""
+Round-trip accounting for the bot's commands.
+
+Each scenario seeds the in-memory backend, starts from cold caches, invokes one Cog command with a fake
+context, and flushes buffered writes. It then reports the database round trips, rows transferred and wall
+time the command cost. A scenario fails if it makes more round trips than its budget in
+bench/roundtrip_budgets.json, which catches N+1 regressions before they ship.
+
+    python -m bench.command_roundtrips            # check against budgets
+    python -m bench.command_roundtrips --update   # rewrite budgets from the current numbers
+
+DB_MEMORY_LATENCY (seconds per call, default 0.002 here) makes the wall-time column meaningful.
+"""
+import os
+
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("DB_MEMORY_LATENCY", "0.002")
+
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from db.client import supabase
+from db.user_cache import clear_user_cache, close_user_cache
+from db.gold_ledger import clear_gold_ledger, close_gold_ledger
+from db.faction_db import clear_faction_upgrades, clear_known_users, warm_known_users
+from db.cooldowns import clear_cooldowns
+from db.leaderboard import seed_leaderboard
+from db.raid_db import create_raid, invite_to_raid, add_raid_participant, ready_participant
+from core.confirm import ConfirmView
+from commands.user_commands import UserCommands
+from commands.battle_commands import BattleCommands
+from commands.co_op_commands import CoOpCommands
+from commands.shop_commands import ShopCommands
+from commands.faction_commands import FactionCommands
+
+BUDGETS_PATH = Path(__file__).with_name("roundtrip_budgets.json")
+
+CLASSES = ["Gym Bro", "Valorant Player", "CS Major", "Child", "Art Major", "Redditor", "Real Life Woman", "Genshin Impact Player"]
+
+
+class FakeMember:
+    def __init__(self, user_id):
+        self.id = int(user_id)
+        self.display_name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.bot = False
+
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def get_member(self, member_id):
+        return FakeMember(member_id)
+
+
+class FakeContext:
+    """Records replies and accepts every confirmation prompt immediately."""
+
+    def __init__(self, author_id):
+        self.author = FakeMember(author_id)
+        self.guild = FakeGuild()
+        self.channel = SimpleNamespace(id=1)
+        self.replies = []
+
+    async def reply(self, content=None, view=None, **kwargs):
+        if isinstance(view, ConfirmView):
+            view.resolve(True)
+        self.replies.append(content if content is not None else kwargs)
+
+    async def send(self, content=None, **kwargs):
+        self.replies.append(content if content is not None else kwargs)
+
+    async def defer(self):
+        pass
+
+
+def seed_world(players=8):
+    supabase.clear()
+    supabase.seed("factions", [{"name": "Alpha", "leader_id": "1", "resources": 10_000, "power_bonus": 2, "attack_bonus": 1}])
+    supabase.seed(
+        "users",
+        [
+            {"id": str(i), "class": CLASSES[(i - 1) % len(CLASSES)], "faction": "Alpha" if i % 2 else None, "gold": 5_000}
+            for i in range(1, players + 1)
+        ],
+    )
+
+
+async def prepare_raid(party_size, power=0):
+    """
+    User 1 leads a raid with the next odd-numbered users (all in Alpha), everyone ready.
+    With no power the party always loses to the Slime King; enough power makes it win and settle the loot.
+    """
+    await create_raid("1", "Alpha", "Slime King")
+    members = [str(uid) for uid in range(3, party_size * 2, 2)]
+    if power:
+        supabase.table("users").update({"power": power}).in_("id", ["1"] + members).execute()
+    for member in members:
+        await invite_to_raid("1", member)
+        await add_raid_participant(member)
+    for uid in ["1"] + members:
+        await ready_participant(uid)
+
+
+def scenarios():
+    bot = SimpleNamespace()
+    user_cog = UserCommands(bot)
+    battle_cog = BattleCommands(bot)
+    co_op_cog = CoOpCommands(bot)
+    shop_cog = ShopCommands(bot)
+    faction_cog = FactionCommands(bot)
+
+    def team_line(size):
+        team1 = " ".join(f"<@{i}>" for i in range(1, size + 1))
+        team2 = " ".join(f"<@{i}>" for i in range(size + 1, 2 * size + 1))
+        return f"{team1} vs {team2}"
+
+    # name -> (setup coroutine or None, command coroutine factory)
+    return {
+        "stats": (None, lambda ctx: user_cog.stats.callback(user_cog, ctx)),
+        "balance": (None, lambda ctx: user_cog.balance.callback(user_cog, ctx)),
+        "claim": (None, lambda ctx: user_cog.claim.callback(user_cog, ctx)),
+        "coinflip": (None, lambda ctx: user_cog.coinflip_command.callback(user_cog, ctx, FakeMember(2), 100)),
+        "duel": (None, lambda ctx: battle_cog.duel_command.callback(battle_cog, ctx, FakeMember(2), 0)),
+        "duel_bet": (None, lambda ctx: battle_cog.duel_command.callback(battle_cog, ctx, FakeMember(2), 100)),
+        "team_battle_1v1": (None, lambda ctx: battle_cog.team_battle.callback(battle_cog, ctx, input_line=team_line(1))),
+        "team_battle_4v4": (None, lambda ctx: battle_cog.team_battle.callback(battle_cog, ctx, input_line=team_line(4))),
+        "begin_raid_2": (lambda: prepare_raid(2), lambda ctx: co_op_cog.begin_raid.callback(co_op_cog, ctx)),
+        "begin_raid_4": (lambda: prepare_raid(4), lambda ctx: co_op_cog.begin_raid.callback(co_op_cog, ctx)),
+        "begin_raid_won_2": (lambda: prepare_raid(2, power=1_000), lambda ctx: co_op_cog.begin_raid.callback(co_op_cog, ctx)),
+        "begin_raid_won_4": (lambda: prepare_raid(4, power=1_000), lambda ctx: co_op_cog.begin_raid.callback(co_op_cog, ctx)),
+        "buy": (None, lambda ctx: shop_cog.buy.callback(shop_cog, ctx, "power", 2)),
+        "deposit": (None, lambda ctx: faction_cog.deposit.callback(faction_cog, ctx, 100)),
+        "leaderboard": (seed_leaderboard, lambda ctx: faction_cog.leaderboard.callback(faction_cog, ctx)),
+    }
+
+
+async def measure(name, setup, command):
+    seed_world()
+    clear_gold_ledger()
+    clear_cooldowns()
+    clear_known_users()
+    # As at startup in main.py
+    with contextlib.redirect_stdout(io.StringIO()):
+        await warm_known_users()
+    if setup is not None:
+        await setup()
+        await close_gold_ledger()
+        await close_user_cache()
+    clear_user_cache()
+    clear_faction_upgrades()
+    clear_cooldowns()
+    supabase.reset_stats()
+
+    ctx = FakeContext(1)
+    start = time.perf_counter()
+    await command(ctx)
+    # Buffered writes are part of what the command costs.
+    await close_gold_ledger()
+    await close_user_cache()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    stats = supabase.stats()
+    return {
+        "round_trips": stats["calls"],
+        "rows": stats["rows_read"] + stats["rows_written"],
+        "wall_ms": elapsed_ms,
+        "by_table": stats["calls_by_table"],
+    }
+
+
+async def run(update=False):
+    budgets = json.loads(BUDGETS_PATH.read_text()) if BUDGETS_PATH.exists() else {}
+    results = {}
+    for name, (setup, command) in scenarios().items():
+        results[name] = await measure(name, setup, command)
+
+    failures = []
+    print(f"{'command':<18}{'round trips':>12}{'budget':>8}{'rows':>7}{'wall ms':>10}  by table")
+    for name, result in results.items():
+        budget = budgets.get(name)
+        print(
+            f"{name:<18}{result['round_trips']:>12}{budget if budget is not None else '-':>8}{result['rows']:>7}"
+            f"{result['wall_ms']:>10.1f}  {result['by_table']}"
+        )
+        if budget is not None and result["round_trips"] > budget:
+            failures.append(f"{name}: {result['round_trips']} round trips, budget {budget}")
+
+    if update:
+        BUDGETS_PATH.write_text(json.dumps({name: r["round_trips"] for name, r in results.items()}, indent=4) + "\n")
+        print(f"Budgets written to {BUDGETS_PATH}")
+    elif failures:
+        print("\nOver budget:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(update="--update" in sys.argv))
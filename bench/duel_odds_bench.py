@@ -0,0 +1,81 @@
+"""
+Compares the vectorized duel simulator in data/duel_sim.py with a plain Python loop over the same formula.
+
+    python -m bench.duel_odds_bench [rounds]
+"""
+import random
+import sys
+import time
+from data.classes import ATTACK_ROLL, DEFENSE_ROLL
+from data.duel_sim import simulate_duel, DEFAULT_ROUNDS
+
+# A representative matchup: equal stats, the user hits a class that is vulnerable to it.
+MATCHUP = dict(
+    user_attack=15,
+    user_defense=6,
+    user_health=40,
+    user_mod=1.5,
+    opponent_attack=16,
+    opponent_defense=7,
+    opponent_health=45,
+    opponent_mod=1.0,
+)
+TARGET_MS = 50
+
+
+def simulate_duel_naive(
+    user_attack, user_defense, user_health, user_mod, opponent_attack, opponent_defense, opponent_health, opponent_mod, rounds
+):
+    wins = draws = losses = 0
+    dealt = taken = 0.0
+    for _ in range(rounds):
+        user_damage = max(0, (user_attack + random.randint(*ATTACK_ROLL)) * user_mod - (opponent_defense + random.randint(*DEFENSE_ROLL)))
+        opponent_damage = max(
+            0, (opponent_attack + random.randint(*ATTACK_ROLL)) * opponent_mod - (user_defense + random.randint(*DEFENSE_ROLL))
+        )
+        user_down = user_health - opponent_damage <= 0
+        opponent_down = opponent_health - user_damage <= 0
+        if opponent_down and not user_down:
+            wins += 1
+        elif user_down and not opponent_down:
+            losses += 1
+        elif user_down and opponent_down:
+            draws += 1
+        elif user_damage > opponent_damage:
+            wins += 1
+        elif opponent_damage > user_damage:
+            losses += 1
+        else:
+            draws += 1
+        dealt += user_damage
+        taken += opponent_damage
+    return {"win": wins / rounds, "draw": draws / rounds, "loss": losses / rounds, "expected_damage_dealt": dealt / rounds, "expected_damage_taken": taken / rounds}
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ROUNDS
+    numpy_ms, numpy_odds = best_of(lambda: simulate_duel(**MATCHUP, rounds=rounds))
+    naive_ms, naive_odds = best_of(lambda: simulate_duel_naive(**MATCHUP, rounds=rounds), repeat=3)
+
+    print(f"{rounds:,} rounds")
+    print(f"  numpy: {numpy_ms:8.2f} ms  win={numpy_odds['win']:.3f} draw={numpy_odds['draw']:.3f} loss={numpy_odds['loss']:.3f}")
+    print(f"  naive: {naive_ms:8.2f} ms  win={naive_odds['win']:.3f} draw={naive_odds['draw']:.3f} loss={naive_odds['loss']:.3f}")
+    print(f"  speedup: {naive_ms / numpy_ms:.1f}x")
+
+    if numpy_ms > TARGET_MS:
+        print(f"FAIL: vectorized simulation took {numpy_ms:.1f} ms, budget is {TARGET_MS} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
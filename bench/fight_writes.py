@@ -0,0 +1,66 @@
+"""
+Users write requests issued by a busy channel of concurrent duels, for several batch windows.
+
+Each window runs the same stream of duels through db.user_db.duel against the in-memory backend and
+counts the upserts the users batch writer sends, next to every request to the users table. Window 0 still merges updates queued in the same event
+loop tick, which is the closest thing to writing each combatant's health as it happens.
+
+    python -m bench.fight_writes [--windows 0,0.01,0.05] [--duels 400]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("DB_MEMORY_LATENCY", "0.005")
+
+from db.client import supabase  # noqa: E402
+from db.user_db import duel  # noqa: E402
+from db.user_cache import _writer, clear_user_cache, close_user_cache  # noqa: E402
+
+CLASSES = ["Gym Bro", "Valorant Player", "CS Major", "Child", "Art Major", "Redditor", "Real Life Woman", "Genshin Impact Player"]
+USERS = [str(i) for i in range(50)]
+IN_FLIGHT = 16
+
+
+async def measure(window, duels):
+    supabase.clear()
+    supabase.seed("users", [{"id": uid, "class": random.choice(CLASSES), "health": 100_000, "max_health": 100_000} for uid in USERS])
+    clear_user_cache()
+    _writer.window = window
+    semaphore = asyncio.Semaphore(IN_FLIGHT)
+
+    async def fight():
+        async with semaphore:
+            await duel(*random.sample(USERS, 2))
+
+    supabase.reset_stats()
+    flushes = _writer.flushes
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(fight() for _ in range(duels)))
+        await close_user_cache()
+    return _writer.flushes - flushes, supabase.stats()["calls_by_table"].get("users", 0)
+
+
+async def run(windows, duels):
+    random.seed(0)
+    print(f"{duels} duels, {IN_FLIGHT} in flight")
+    print(f"{'window s':>9}{'upserts':>9}{'users requests':>16}")
+    for window in windows:
+        upserts, requests = await measure(window, duels)
+        print(f"{window:>9}{upserts:>9}{requests:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", default="0,0.01,0.05")
+    parser.add_argument("--duels", type=int, default=400)
+    args = parser.parse_args()
+    asyncio.run(run([float(w) for w in args.windows.split(",")], args.duels))
+
+
+if __name__ == "__main__":
+    main()
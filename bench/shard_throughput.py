@@ -0,0 +1,189 @@
+"""
+Command throughput as shards are split across processes, against one shared database.
+
+Each simulated shard is its own process, as with SHARD_IDS deployments, with its own DB_MAX_CONCURRENCY
+connection pool and its own user cache. All of them talk to a single in-memory backend served by this
+process (db.memory_backend.serve_memory_backend, DB_MEMORY_LATENCY per call), and they all play on the
+same pool of users, so every shard keeps writing rows the others have cached. Caches are kept coherent
+with CACHE_COHERENCE=table: each shard publishes the users it changed to the cache_invalidations table
+and polls it every COHERENCE_POLL_INTERVAL seconds.
+
+Each shard runs a stream of concurrent duel + gold-transfer commands through the db/ layer. The report
+shows aggregate commands per second and round trips for each shard count; both include the coherence
+traffic (publishes and polls), which is what the shared database actually serves.
+
+Once every shard has stored its writes, sent the invalidations for them and the ledger is compacted, each
+shard waits a few poll intervals and compares every users row it still has cached with the stored gold and health. With table coherence a
+stale value is a bug and the run fails. --coherence local turns the bus off to show what the check catches.
+
+Shards inside one AutoShardedBot process share an event loop and a connection pool, so splitting shards
+across processes is what adds capacity. On a single core the gain is limited to the time spent waiting
+on the database.
+
+    python -m bench.shard_throughput [--shards 1,2,4] [--commands 2000] [--coherence table|local]
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import time
+
+CLASSES = ["Gym Bro", "Valorant Player", "CS Major", "Child", "Art Major", "Redditor", "Real Life Woman", "Genshin Impact Player"]
+USERS = 200  # shared by every shard
+IN_FLIGHT = 32  # concurrent commands per shard, like a busy gateway
+POLL_INTERVAL = 0.05
+# Poll intervals to wait, once every shard has sent its last invalidations, for the poll loops to read them.
+SETTLE_INTERVALS = 3
+
+
+def run_shard(shard_id, commands_to_run, address, coherence, barrier, results):
+    os.environ["DB_BACKEND"] = "memory"
+    os.environ["DB_MEMORY_ADDRESS"] = address
+    os.environ.setdefault("DB_MEMORY_LATENCY", "0.005")
+    os.environ.setdefault("DB_MAX_CONCURRENCY", "4")
+    os.environ["CACHE_COHERENCE"] = coherence
+    os.environ["COHERENCE_POLL_INTERVAL"] = str(POLL_INTERVAL)
+    os.environ["NODE_ID"] = f"shard-{shard_id}"
+    # Compaction is driven by hand below, once every shard has finished.
+    os.environ["LEDGER_COMPACT_INTERVAL"] = "0"
+
+    import asyncio
+    import random
+    from db.client import supabase, execute
+    from db.coherence import start_coherence, close_coherence, flush_coherence, coherence_stats
+    from db.gold_ledger import close_gold_ledger, compact_gold_ledger
+    from db.user_db import duel, transfer_gold
+    from db.user_cache import close_user_cache, get_cached_user_row
+
+    users = [f"user-{i}" for i in range(USERS)]
+
+    async def command():
+        challenger, opponent = random.sample(users, 2)
+        await duel(challenger, opponent)
+        await transfer_gold(debits={challenger: 1}, credits={opponent: 1})
+
+    async def wait_for_peers():
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+
+    async def stale_rows():
+        """Cached users whose gold or health differs from what is stored."""
+        cached = {user_id: row for user_id in users if (row := get_cached_user_row(user_id)) is not None}
+        if not cached:
+            return 0, 0
+        response = await execute(supabase.table("users").select("id, gold, health").in_("id", list(cached)))
+        stored = {row["id"]: row for row in response.data}
+        stale = sum(
+            cached[user_id]["gold"] != row["gold"] or cached[user_id]["health"] != row["health"]
+            for user_id, row in stored.items()
+        )
+        return len(cached), stale
+
+    async def main():
+        await start_coherence()
+        await wait_for_peers()
+        semaphore = asyncio.Semaphore(IN_FLIGHT)
+
+        async def limited():
+            async with semaphore:
+                await command()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(commands_to_run)))
+        await close_user_cache()
+        await close_gold_ledger()
+        elapsed = time.perf_counter() - start
+
+        # Send the last invalidations now; on a busy core the next tick can come well after the barrier.
+        await flush_coherence()
+        await wait_for_peers()
+        if shard_id == 0:
+            await compact_gold_ledger()
+            await flush_coherence()
+        await wait_for_peers()
+        await asyncio.sleep(POLL_INTERVAL * SETTLE_INTERVALS)
+        checked, stale = await stale_rows()
+        received = coherence_stats().get("received", 0)
+        await close_coherence()
+        return {"seconds": elapsed, "checked": checked, "stale": stale, "received": received}
+
+    results.put((shard_id, asyncio.run(main())))
+
+
+def measure(shards, total_commands, coherence):
+    from db.memory_backend import serve_memory_backend
+
+    per_shard = total_commands // shards
+    address, backend = serve_memory_backend()
+    backend.seed(
+        "users",
+        [{"id": f"user-{i}", "class": CLASSES[i % len(CLASSES)], "gold": 1_000_000, "health": 10_000, "max_health": 10_000} for i in range(USERS)],
+    )
+    backend.reset_stats()
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(shards)
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_shard, args=(shard_id, per_shard, address, coherence, barrier, results))
+        for shard_id in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = []
+    while len(outcomes) < shards:
+        try:
+            outcomes.append(results.get(timeout=1)[1])
+        except queue.Empty:
+            # The others would wait at the barrier forever.
+            if any(process.exitcode for process in processes):
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError("a shard crashed")
+    for process in processes:
+        process.join()
+
+    slowest = max(outcome["seconds"] for outcome in outcomes)
+    stats = backend.stats()
+    return {
+        "shards": shards,
+        "commands": per_shard * shards,
+        "round_trips": stats["calls"],
+        "coherence_round_trips": stats["calls_by_table"].get("cache_invalidations", 0),
+        "seconds": slowest,
+        "commands_per_second": per_shard * shards / slowest,
+        "cached_rows_checked": sum(outcome["checked"] for outcome in outcomes),
+        "stale_rows": sum(outcome["stale"] for outcome in outcomes),
+        "invalidations_received": sum(outcome["received"] for outcome in outcomes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--coherence", choices=["table", "local"], default="table")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPU(s), {args.commands} commands per run, {USERS} shared users, CACHE_COHERENCE={args.coherence}")
+    print(f"{'shards':>6}{'commands/s':>12}{'seconds':>9}{'round trips':>13}{'coherence':>11}{'scaling':>9}{'checked':>9}{'stale':>7}")
+    baseline = None
+    failed = False
+    for shards in (int(s) for s in args.shards.split(",")):
+        result = measure(shards, args.commands, args.coherence)
+        baseline = baseline or result["commands_per_second"]
+        print(
+            f"{result['shards']:>6}{result['commands_per_second']:>12.0f}{result['seconds']:>9.2f}"
+            f"{result['round_trips']:>13}{result['coherence_round_trips']:>11}{result['commands_per_second'] / baseline:>8.2f}x"
+            f"{result['cached_rows_checked']:>9}{result['stale_rows']:>7}"
+        )
+        failed = failed or result["stale_rows"] > 0
+
+    if args.coherence == "table":
+        # Without a cached row to compare the check proves nothing, so that counts as a failure too.
+        assert result["cached_rows_checked"], "no shard had a cached row left to check"
+        assert not failed, "a shard read a stale gold or health value after the coherence window"
+        print("No stale gold or health in any shard's cache.")
+
+
+if __name__ == "__main__":
+    main()
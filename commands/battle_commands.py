@@ -1,16 +1,19 @@
 from discord.ext import commands
 import discord
-import asyncio
 import re
+import time
 from db.user_db import (
     get_user_class,
     set_user_class,
     duel,
-    update_user_gold,
     get_user_balance,
+    transfer_gold,
 )
+from db.gold_ledger import add_user_gold, REASON_DUEL_BET, REASON_DUEL_PAYOUT, REASON_DUEL_REFUND
 from db.battle_db import multi_duel
+from db.odds_db import get_duel_odds
 from data.classes import classes
+from core.confirm import confirm, is_pending
 
 
 class BattleCommands(commands.Cog):
@@ -70,44 +73,59 @@ class BattleCommands(commands.Cog):
                 await ctx.reply("Opponent doesn't have enough gold to match that bet.")
                 return
 
-        def check(m):
-            return m.author == opponent and m.channel == ctx.channel and m.content.lower() in ["yes", "no"]
+        challenge_id = f"duel:{challenger_id}:{opponent_id}"
+        if is_pending(challenge_id):
+            await ctx.reply("You already have a pending duel challenge against this user.")
+            return
 
         bet_msg = f" with a bet of {bet} gold each" if bet > 0 else ""
-        await ctx.reply(f"{opponent.mention}, do you accept the duel challenge{bet_msg}? (yes/no)")
+        accepted = await confirm(ctx.reply, opponent, f"{opponent.mention}, do you accept the duel challenge{bet_msg}?", challenge_id)
 
-        try:
-            confirmation = await self.bot.wait_for("message", check=check, timeout=30.0)
-        except asyncio.TimeoutError:
+        if accepted is None:
             await ctx.reply("Duel challenge timed out.")
             return
 
-        if confirmation.content.lower() == "no":
+        if not accepted:
             await ctx.reply("Duel challenge declined.")
             return
 
         if bet > 0:
-            challenger_balance = await get_user_balance(challenger_id)
-            opponent_balance = await get_user_balance(opponent_id)
-            await update_user_gold(challenger_id, challenger_balance - bet)
-            await update_user_gold(opponent_id, opponent_balance - bet)
+            # Escrow both stakes atomically; this fails if either balance dropped while waiting for the answer.
+            if not await transfer_gold(debits={challenger_id: bet, opponent_id: bet}, reason=REASON_DUEL_BET):
+                await ctx.reply("One of you no longer has enough gold to cover the bet.")
+                return
 
         result, winner_id, loser_id = await duel(challenger_id, opponent_id)
 
         if bet > 0:
             if winner_id is None:
-                challenger_balance = await get_user_balance(challenger_id)
-                opponent_balance = await get_user_balance(opponent_id)
-                await update_user_gold(challenger_id, challenger_balance + bet)
-                await update_user_gold(opponent_id, opponent_balance + bet)
+                add_user_gold(challenger_id, bet, REASON_DUEL_REFUND)
+                add_user_gold(opponent_id, bet, REASON_DUEL_REFUND)
                 result += "\nThe duel was inconclusive. Bets have been refunded."
             else:
-                winner_balance = await get_user_balance(winner_id)
-                await update_user_gold(winner_id, winner_balance + (bet * 2))
+                add_user_gold(winner_id, bet * 2, REASON_DUEL_PAYOUT)
                 result += f"\n<@{winner_id}> wins the bet and takes home {bet*2} gold!"
 
         await ctx.reply(result)
 
+    @commands.hybrid_command(name="duel_odds", description="Preview your odds in a duel against another user.")
+    async def duel_odds(self, ctx, opponent: discord.Member):
+        start = time.perf_counter()
+        odds, error = await get_duel_odds(str(ctx.author.id), str(opponent.id))
+        if error:
+            await ctx.reply(error)
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        embed = discord.Embed(title=f"Duel odds vs {opponent.display_name}", color=discord.Color.orange())
+        embed.add_field(name="Win", value=f"{odds['win']:.1%}", inline=True)
+        embed.add_field(name="Draw", value=f"{odds['draw']:.1%}", inline=True)
+        embed.add_field(name="Loss", value=f"{odds['loss']:.1%}", inline=True)
+        embed.add_field(name="Expected damage dealt", value=f"{odds['expected_damage_dealt']:.1f}", inline=True)
+        embed.add_field(name="Expected damage taken", value=f"{odds['expected_damage_taken']:.1f}", inline=True)
+        embed.set_footer(text=f"{odds['rounds']:,} simulated rounds in {elapsed_ms:.1f} ms")
+        await ctx.reply(embed=embed)
+
     @commands.hybrid_command(name="team_battle", description="Start a team battle. Format: /team_battle @user1 @user2 vs @user3 @user4")
     async def team_battle(self, ctx, *, input_line: str):
         # Parse input_line for something like "@user1 @user2 vs @user3 @user4"
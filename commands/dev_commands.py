@@ -1,4 +1,13 @@
 from discord.ext import commands
+from db.user_cache import user_cache_stats
+from db.faction_db import faction_cache_stats
+from core.perf import perf_report
+from core.ratelimit import ratelimit_report
+from db.client import singleflight_stats
+from db.coherence import coherence_stats
+from db.gold_ledger import gold_ledger_stats
+from db.locks import lock_stats
+from db.cas import cas_stats
 
 
 class DevCommands(commands.Cog):
@@ -17,6 +26,46 @@ class DevCommands(commands.Cog):
         except commands.ExtensionFailed:
             await ctx.send(f"{cog} failed to reload.")
 
+    @commands.hybrid_command(name="cache_stats", description="Show cache, write batching and lock counters.")
+    async def cache_stats(self, ctx):
+        stats = user_cache_stats()
+        faction_stats = faction_cache_stats()
+        flight_stats = singleflight_stats()
+        bus_stats = coherence_stats()
+        ledger_stats = gold_ledger_stats()
+        locks = lock_stats()
+        cas = cas_stats()
+        await ctx.send(
+            f"Users cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), "
+            f"{stats['size']} cached, {stats['evictions']} evicted, {stats['pending_writes']} pending writes, "
+            f"{stats['rows_flushed']} rows flushed in {stats['flushes']} batches, {stats['merged']} updates merged.\n"
+            f"Faction upgrades cache: {faction_stats['hits']} hits, {faction_stats['misses']} misses "
+            f"({faction_stats['hit_rate']:.1%} hit rate), {faction_stats['size']} cached.\n"
+            f"Read coalescing: {flight_stats['coalesced']} of {flight_stats['reads']} reads shared an in-flight query "
+            f"({flight_stats['coalesce_rate']:.1%}), {flight_stats['in_flight']} in flight.\n"
+            f"Coherence ({bus_stats['bus']}, node {bus_stats['node']}): {bus_stats['published']} published, "
+            f"{bus_stats['received']} received.\n"
+            f"Gold ledger: {ledger_stats['rows_inserted']} deltas in {ledger_stats['batches']} batches, "
+            f"{ledger_stats['buffered']} buffered, {ledger_stats['uncompacted']} awaiting compaction, "
+            f"{ledger_stats['compactions']} compactions.\n"
+            f"User locks: {locks['contended']} of {locks['acquisitions']} acquisitions waited "
+            f"({locks['contention_rate']:.1%}), {locks['wait_ms']:.0f}ms total, {locks['max_wait_ms']:.0f}ms max, "
+            f"{locks['held']} held.\n"
+            + "\n".join(
+                f"Compare-and-set on {table}: {c['updates']} writes, {c['retries']} retries, "
+                f"{c['declined']} declined, {c['exhausted']} gave up."
+                for table, c in cas.items()
+            )
+        )
+
+    @commands.hybrid_command(name="perf", description="Show the slowest commands and queries, and rate limiter counters.")
+    async def perf(self, ctx):
+        report = perf_report() + "\n" + ratelimit_report()
+        # Discord caps messages at 2000 characters.
+        if len(report) > 1990:
+            report = report[:1980] + "\n..."
+        await ctx.send(f"```\n{report}\n```")
+
 
 async def setup(bot):
     await bot.add_cog(DevCommands(bot))
@@ -1,6 +1,6 @@
-import asyncio
 import discord
 from discord.ext import commands
+from core.confirm import confirm, is_pending
 from db.faction_db import (
     create_faction,
     add_member_to_faction,
@@ -22,7 +22,7 @@ class FactionManagement(commands.Cog):
         """
         Creates a new faction with the given name.
         """
-        user_id = ctx.author.id
+        user_id = str(ctx.author.id)
 
         current_faction = await get_user_faction(user_id)
         if current_faction:
@@ -42,41 +42,44 @@ class FactionManagement(commands.Cog):
         """
         Invites another user to your faction.
         """
-        inviter_id = ctx.author.id
+        inviter_id = str(ctx.author.id)
         inviter_faction = await get_user_faction(inviter_id)
 
         if not inviter_faction:
             await ctx.send("You are not part of a faction. Create one with `/create_faction`.")
             return
 
-        target_faction = await get_user_faction(target.id)
+        target_faction = await get_user_faction(str(target.id))
         if target_faction:
             await ctx.send(f"{target.display_name} is already a member of `{target_faction}`.")
             return
 
+        challenge_id = f"invite:{target.id}"
+        if is_pending(challenge_id):
+            await ctx.send(f"{target.display_name} already has a pending faction invite.")
+            return
+
+        await ctx.defer()
+
         try:
-            await target.send(
+            accepted = await confirm(
+                target.send,
+                target,
                 f"🚨 **Faction Invite** 🚨\n"
                 f"{ctx.author.display_name} has invited you to join their faction `{inviter_faction}`.\n"
-                "Do you accept? Reply with 'yes' or 'no'."
+                "Do you accept?",
+                challenge_id,
             )
         except discord.Forbidden:
             await ctx.send(f"Could not DM {target.display_name}. They may have DMs disabled.")
             return
 
-        await ctx.defer()
-
-        def check(m):
-            return m.author == target and m.content.lower() in ["yes", "no"]
-
-        try:
-            response = await self.bot.wait_for("message", check=check, timeout=30.0)
-        except asyncio.TimeoutError:
+        if accepted is None:
             await ctx.send(f"{target.display_name} did not respond to the invite in time.")
             return
 
-        if response.content.lower() == "yes":
-            await add_member_to_faction(target.id, inviter_faction)
+        if accepted:
+            await add_member_to_faction(str(target.id), inviter_faction)
             await ctx.send(f"{target.display_name} has joined your faction `{inviter_faction}`!")
             await target.send(f"You are now a member of `{inviter_faction}`!")
         else:
@@ -87,7 +90,7 @@ class FactionManagement(commands.Cog):
         """
         Allows a user to leave their faction.
         """
-        user_id = ctx.author.id
+        user_id = str(ctx.author.id)
         current_faction = await get_user_faction(user_id)
 
         if await is_leader(user_id):
@@ -106,7 +109,7 @@ class FactionManagement(commands.Cog):
         """
         Disbands the user's faction.
         """
-        user_id = ctx.author.id
+        user_id = str(ctx.author.id)
         current_faction = await get_user_faction(user_id)
 
         if not current_faction:
@@ -125,7 +128,7 @@ class FactionManagement(commands.Cog):
         """
         Lists all members of the user's faction.
         """
-        user_id = ctx.author.id
+        user_id = str(ctx.author.id)
         current_faction = await get_user_faction(user_id)
 
         if not current_faction:
@@ -3,13 +3,11 @@ from discord.ext import commands
 from db.user_db import (
     ensure_user_exists,
     get_user_balance,
-    update_user_gold,
-    get_user_power,
-    update_user_power,
-    get_user_max_health,
-    update_user_max_health,
+    spend_gold,
+    increment_user_fields,
 )
-from db.client import supabase
+from db.gold_ledger import add_user_gold, REASON_SHOP, REASON_SHOP_REFUND
+from db.locks import lock_users
 
 
 class ShopCommands(commands.Cog):
@@ -40,28 +38,31 @@ class ShopCommands(commands.Cog):
             await ctx.reply("Please specify a positive amount.")
             return
 
-        current_gold = await get_user_balance(user_id)
+        # The upgrade is read and written back after the spend; a second purchase at once must not lose it.
+        # Replies are sent after the lock is released.
+        async with lock_users(user_id):
+            current_gold = await get_user_balance(user_id)
 
-        if item.lower() == "power":
-            cost = 100 * amount
-            if current_gold < cost:
-                await ctx.reply("You don't have enough gold for that purchase.")
-                return
-            user_power = await get_user_power(user_id)
-            await update_user_power(user_id, user_power + amount)
-            await update_user_gold(user_id, current_gold - cost)
-            await ctx.reply(f"You have increased your power by {amount}!")
-        elif item.lower() == "health":
-            cost = 200 * amount
-            if current_gold < cost:
-                await ctx.reply("You don't have enough gold for that purchase.")
-                return
-            user_max_health = await get_user_max_health(user_id)
-            await update_user_max_health(user_id, user_max_health + (amount * 10))
-            await update_user_gold(user_id, current_gold - cost)
-            await ctx.reply(f"You have increased your max health by {amount * 10}!")
-        else:
-            await ctx.reply("Invalid item. Available items: power, health.")
+            if item.lower() == "power":
+                cost, increments = 100 * amount, {"power": amount}
+                success = f"You have increased your power by {amount}!"
+            elif item.lower() == "health":
+                cost, increments = 200 * amount, {"max_health": amount * 10}
+                success = f"You have increased your max health by {amount * 10}!"
+            else:
+                cost = None
+
+            if cost is None:
+                message = "Invalid item. Available items: power, health."
+            elif current_gold < cost or not await spend_gold(user_id, cost, REASON_SHOP):
+                message = "You don't have enough gold for that purchase."
+            elif await increment_user_fields(user_id, increments) is None:
+                # The gold is already spent; give it back rather than charge for nothing.
+                add_user_gold(user_id, cost, REASON_SHOP_REFUND)
+                message = "An error occurred while applying your upgrade. Your gold has been refunded."
+            else:
+                message = success
+        await ctx.reply(message)
 
     @commands.hybrid_command(name="buy_hourly_upgrade", description="Increase your hourly claim multiplier.")
     async def buy_hourly_upgrade(self, ctx, amount: int = 1):
@@ -71,16 +72,21 @@ class ShopCommands(commands.Cog):
             return
         cost_per = 500
         total_cost = cost_per * amount
-        current_gold = await get_user_balance(user_id)
-        if current_gold < total_cost:
+        async with lock_users(user_id):
+            current_gold = await get_user_balance(user_id)
+            spent = current_gold >= total_cost and await spend_gold(user_id, total_cost, REASON_SHOP)
+            if spent:
+                updated = await increment_user_fields(user_id, {"hourly_multiplier": 0.1 * amount})
+                if updated is None:
+                    # The gold is already spent; give it back rather than charge for nothing.
+                    add_user_gold(user_id, total_cost, REASON_SHOP_REFUND)
+        if not spent:
             await ctx.reply("You don't have enough gold.")
             return
-        resp = supabase.table("users").select("hourly_multiplier").eq("id", user_id).execute()
-        current_multi = resp.data[0]["hourly_multiplier"]
-        new_multi = current_multi + (0.1 * amount)
-        await update_user_gold(user_id, current_gold - total_cost)
-        supabase.table("users").update({"hourly_multiplier": new_multi}).eq("id", user_id).execute()
-        await ctx.reply(f"Your hourly gold claim multiplier is now {new_multi:.2f}!")
+        if updated is None:
+            await ctx.reply("An error occurred while applying your upgrade. Your gold has been refunded.")
+            return
+        await ctx.reply(f"Your hourly gold claim multiplier is now {updated['hourly_multiplier']:.2f}!")
 
 
 async def setup(bot):
@@ -1,12 +1,14 @@
 import discord
 from discord.ext import commands
 import random
+from core.startup import sync_tree_if_changed
 
 
 class StupidCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.messages_until_false = 5
+        # guild id -> messages left before the next "false"; guilds start at 5
+        self.messages_until_false = {}
         self.stupid_words = [
             "skibidi toilet",
             "sigma",
@@ -45,21 +47,34 @@ class StupidCommands(commands.Cog):
         try:
             activity = discord.Streaming(name="Minecraft", url="https://youtube.com/watch?v=QMXBGUeX_c4")
             await self.bot.change_presence(activity=activity)
-            synced = await self.bot.tree.sync()
-            print(f"Synced {len(synced)} commands.")
+            # Runs on every reconnect too; only the first call per process can hit the API, and only if the tree changed.
+            synced = await sync_tree_if_changed(self.bot)
+            if synced is not None:
+                print(f"Synced {synced} commands.")
         except Exception as e:
             print(e)
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.author.bot:
-            return
+    async def cog_load(self):
+        self.bot.message_dispatcher.register("false_counter", self.reply_false, guild_only=True, predicate=self.count_message)
+
+    async def cog_unload(self):
+        self.bot.message_dispatcher.unregister("false_counter")
+
+    def count_message(self, message):
+        """
+        Dispatcher predicate, called for every guild message from a user; core.dispatch has already skipped
+        bots and DMs. Counts down and returns True when it's time to reply.
+        """
+        guild_id = message.guild.id
+        remaining = self.messages_until_false.get(guild_id, 5)
+        if remaining == 0:
+            self.messages_until_false[guild_id] = random.randint(15, 30)
+            return True
+        self.messages_until_false[guild_id] = remaining - 1
+        return False
 
-        if self.messages_until_false == 0:
-            await message.reply("false")
-            self.messages_until_false = random.randint(15, 30)
-        else:
-            self.messages_until_false -= 1
+    async def reply_false(self, message):
+        await message.reply("false")
 
     @commands.hybrid_command(name="spam")
     async def spam_ping(self, ctx, user: discord.Member):
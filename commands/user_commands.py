@@ -1,22 +1,16 @@
 import discord
-import asyncio
 from discord.ext import commands
+from core.confirm import confirm, is_pending
 from db.user_db import (
     claim_hourly,
     coinflip,
     get_user_balance,
     heal_user,
     ensure_user_exists,
-    get_user_class,
-    get_user_faction,
-    get_user_health,
-    get_user_max_health,
-    get_user_power,
-    get_user_raid_wins,
-    get_user_hourly_multiplier,
-    get_user_final_attack,
-    get_user_final_defense,
-    get_faction_upgrades,
+    get_user_snapshot,
+    calc_hourly_multiplier,
+    calc_final_attack,
+    calc_final_defense,
 )
 from data.classes import classes
 
@@ -45,18 +39,18 @@ class UserCommands(commands.Cog):
         challenger_id = str(ctx.author.id)
         opponent_id = str(opponent.id)
 
-        def check(m):
-            return m.author == opponent and m.channel == ctx.channel and m.content.lower() in ["yes", "no"]
+        challenge_id = f"coinflip:{challenger_id}:{opponent_id}"
+        if is_pending(challenge_id):
+            await ctx.reply("You already have a pending coinflip bet against this user.")
+            return
 
-        await ctx.reply(f"{opponent.mention}, do you accept the coinflip bet of {amount} gold? (yes/no)")
+        accepted = await confirm(ctx.reply, opponent, f"{opponent.mention}, do you accept the coinflip bet of {amount} gold?", challenge_id)
 
-        try:
-            confirmation = await self.bot.wait_for("message", check=check, timeout=30.0)
-        except asyncio.TimeoutError:
+        if accepted is None:
             await ctx.reply("Coinflip bet timed out.")
             return
 
-        if confirmation.content.lower() == "no":
+        if not accepted:
             await ctx.reply("Coinflip bet declined.")
             return
 
@@ -74,16 +68,18 @@ class UserCommands(commands.Cog):
         user_id = str(ctx.author.id)
         await ensure_user_exists(user_id)
 
-        user_class = await get_user_class(user_id) or "None"
-        user_faction = await get_user_faction(user_id) or "None"
-        user_gold = await get_user_balance(user_id)
-        user_health = await get_user_health(user_id)
-        user_max_health = await get_user_max_health(user_id)
-        user_power = await get_user_power(user_id)
-        user_raid_wins = await get_user_raid_wins(user_id)
-        user_hourly_multi = await get_user_hourly_multiplier(user_id)
-        user_final_attack = await get_user_final_attack(user_id)
-        user_final_defense = await get_user_final_defense(user_id)
+        user = await get_user_snapshot(user_id)
+
+        user_class = user.user_class or "None"
+        user_faction = user.faction or "None"
+        user_gold = user.gold
+        user_health = user.health
+        user_max_health = user.max_health
+        user_power = user.power
+        user_raid_wins = user.raid_wins
+        user_hourly_multi = calc_hourly_multiplier(user)
+        user_final_attack = calc_final_attack(user)
+        user_final_defense = calc_final_defense(user)
 
         synergy_info = "None"
         if user_class != "None":
@@ -94,7 +90,7 @@ class UserCommands(commands.Cog):
 
         faction_upgrades_str = "None"
         if user_faction != "None":
-            ups = await get_faction_upgrades(user_faction)
+            ups = user.upgrades
             upgrade_list = []
             if ups["power_bonus"] > 0:
                 upgrade_list.append(f"Power +{ups['power_bonus']}")
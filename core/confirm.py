@@ -0,0 +1,85 @@
+"""
+Yes/no confirmations (duel and coinflip challenges, faction invites) as Accept/Decline buttons.
+
+These replace bot.wait_for("message", check=...), which ran every pending check against every incoming
+message and needed the message-content intent. Buttons arrive as component interactions, and discord.py
+routes each one straight to its view by custom_id. Each pending confirmation is registered under a
+challenge id, so the same challenge can't be issued twice while one is still open.
+"""
+import os
+import discord
+
+CONFIRM_TIMEOUT = float(os.environ.get("CONFIRM_TIMEOUT", "30"))
+
+# challenge id -> ConfirmView still waiting for an answer
+_pending = {}
+
+
+class ConfirmView(discord.ui.View):
+    def __init__(self, target_id, challenge_id, timeout=CONFIRM_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.target_id = int(target_id)
+        self.challenge_id = challenge_id
+        self.accepted = None  # None until answered, so a timeout reads as None
+        self.accept.custom_id = f"confirm:{challenge_id}:accept"
+        self.decline.custom_id = f"confirm:{challenge_id}:decline"
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self.target_id:
+            await interaction.response.send_message("This isn't your challenge to answer.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label="Accept", style=discord.ButtonStyle.success)
+    async def accept(self, interaction, button):
+        await self._answer(interaction, True)
+
+    @discord.ui.button(label="Decline", style=discord.ButtonStyle.danger)
+    async def decline(self, interaction, button):
+        await self._answer(interaction, False)
+
+    async def _answer(self, interaction, accepted):
+        self.resolve(accepted)
+        await interaction.response.edit_message(view=self)
+
+    def resolve(self, accepted):
+        """Records the answer, greys out the buttons and wakes up the waiting command."""
+        if self.is_finished():
+            return
+        self.accepted = accepted
+        for child in self.children:
+            child.disabled = True
+        self.stop()
+
+
+def is_pending(challenge_id):
+    return challenge_id in _pending
+
+
+def pending_count():
+    return len(_pending)
+
+
+async def confirm(send, target, content, challenge_id, timeout=CONFIRM_TIMEOUT):
+    """
+    Sends content with Accept/Decline buttons that only target can press, using send
+    (ctx.reply, target.send, ...), and waits for the answer.
+    Returns True if accepted, False if declined, None on timeout or if challenge_id is already pending.
+    """
+    if challenge_id in _pending:
+        return None
+    view = ConfirmView(target.id, challenge_id, timeout)
+    _pending[challenge_id] = view
+    try:
+        message = await send(content, view=view)
+        timed_out = await view.wait()
+        if timed_out:
+            for child in view.children:
+                child.disabled = True
+            try:
+                await message.edit(view=view)
+            except (discord.HTTPException, AttributeError):
+                pass
+        return view.accepted
+    finally:
+        _pending.pop(challenge_id, None)
@@ -0,0 +1,79 @@
+"""
+The bot's single on_message handler.
+
+Each message gets its cheap checks done once, here: bot author, command prefix or mention, guild or DM.
+Only messages that can be commands go through process_commands. The rest go to the handlers features have
+registered, which skips discord.py's prefix parsing and any per-cog listener chain. Registering takes a
+name, so a cog can drop its handler in cog_unload and re-add it on reload without duplicates.
+
+A handler can come with a trigger (message text to match, ignoring case and surrounding whitespace) or a
+plain synchronous predicate. These are checked first, so a message that doesn't match costs a set lookup
+or a function call instead of creating and awaiting a coroutine.
+"""
+
+
+class MessageDispatcher:
+    def __init__(self, bot, prefix):
+        self.bot = bot
+        self.prefix = prefix
+        # name -> (handler, guild_only, predicate or None); handlers are awaited in registration order
+        self._handlers = {}
+        self._guild_handlers = ()
+        self._dm_handlers = ()
+
+    def register(self, name, handler, guild_only=False, trigger=None, predicate=None):
+        """
+        handler is an async callable taking the message. It only runs for messages whose text is trigger
+        (a string or a collection of them) and for which predicate(message), a sync callable, is true.
+        """
+        if trigger is not None:
+            triggers = frozenset(t.strip().lower() for t in ([trigger] if isinstance(trigger, str) else trigger))
+            check = predicate
+
+            def predicate(message, triggers=triggers, check=check):
+                return message.content.strip().lower() in triggers and (check is None or check(message))
+
+        self._handlers[name] = (handler, guild_only, predicate)
+        self._rebuild()
+
+    def unregister(self, name):
+        if self._handlers.pop(name, None) is not None:
+            self._rebuild()
+
+    def _rebuild(self):
+        # Precomputed so the hot path is a tuple iteration, not a filter over every handler.
+        self._guild_handlers = tuple((handler, predicate) for handler, _, predicate in self._handlers.values())
+        self._dm_handlers = tuple((handler, predicate) for handler, guild_only, predicate in self._handlers.values() if not guild_only)
+
+    def _is_command(self, message):
+        if message.content.startswith(self.prefix):
+            return True
+        me = self.bot.user
+        return me is not None and any(user.id == me.id for user in message.mentions)
+
+    async def on_message(self, message):
+        if message.author.bot:
+            return
+
+        if self._is_command(message):
+            await self.bot.process_commands(message)
+
+        handlers = self._guild_handlers if message.guild is not None else self._dm_handlers
+        for handler, predicate in handlers:
+            try:
+                if predicate is None or predicate(message):
+                    await handler(message)
+            except Exception as e:
+                print(f"Error in message handler {handler}: {e}")
+
+
+def install(bot, prefix):
+    """Replaces the bot's default on_message with a MessageDispatcher, available as bot.message_dispatcher."""
+    dispatcher = MessageDispatcher(bot, prefix)
+    bot.message_dispatcher = dispatcher
+
+    @bot.event
+    async def on_message(message):
+        await dispatcher.on_message(message)
+
+    return dispatcher
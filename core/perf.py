@@ -0,0 +1,186 @@
+"""
+Command latency histograms and per-command database traces.
+
+install(bot) hooks every command invocation. While a command runs, db.client.execute reports each query
+here, recording its table, method, filter shape (column=operator, values left out) and duration.
+Latencies go into fixed-bucket histograms per command name and per query shape. The slowest invocations
+are kept with their full trace. perf_report() renders all of it for /perf and the periodic log dump.
+"""
+import asyncio
+import bisect
+import contextvars
+import heapq
+import itertools
+import os
+import time
+
+# Upper bounds in milliseconds; the last bucket catches everything slower.
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float("inf"))
+
+PERF_LOG_INTERVAL = float(os.environ.get("PERF_LOG_INTERVAL", "600"))
+PERF_SLOWEST_KEPT = int(os.environ.get("PERF_SLOWEST_KEPT", "10"))
+
+# Query-string keys that shape the response rather than filter rows.
+_MODIFIER_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (capped at the slowest sample seen)."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+        }
+
+
+class Trace:
+    def __init__(self, command):
+        self.command = command
+        self.started = time.perf_counter()
+        self.queries = []  # (shape, duration_ms)
+        self.open = True
+
+
+_command_latency = {}
+_query_latency = {}
+# Min-heap of (duration_ms, seq, command, queries) holding the slowest invocations.
+_slowest = []
+_seq = itertools.count()
+_current_trace = contextvars.ContextVar("perf_trace", default=None)
+_logger_task = None
+
+
+def describe_query(query):
+    """
+    "GET users id=eq" style shape of a query builder, without the filter values.
+    Works with postgrest builders (details under .request) and the memory backend alike.
+    """
+    request = getattr(query, "request", query)
+    method = getattr(request, "http_method", "?")
+    method = getattr(method, "value", method)
+    table = str(getattr(request, "path", "?")).rstrip("/").split("/rest/v1/")[-1]
+    params = getattr(request, "params", None) or []
+    items = params.multi_items() if hasattr(params, "multi_items") else params
+    filters = []
+    for key, value in items:
+        if key in _MODIFIER_PARAMS:
+            continue
+        operator = str(value).split(".", 1)[0]
+        filters.append(f"{key}={operator}")
+    return " ".join([str(method), table] + sorted(filters))
+
+
+def record_query(query, duration_ms, coalesced=False):
+    """
+    Called by db.client.execute after every query.
+    Coalesced reads (served by another caller's identical in-flight query) show up in the command's
+    trace but not in the query histograms, which count real round trips only.
+    """
+    shape = describe_query(query)
+    if coalesced:
+        shape += " [coalesced]"
+    else:
+        _query_latency.setdefault(shape, Histogram()).record(duration_ms)
+    trace = _current_trace.get()
+    # Background tasks started by a command inherit its context; only count queries until it finishes.
+    if trace is not None and trace.open:
+        trace.queries.append((shape, duration_ms))
+
+
+async def before_invoke(ctx):
+    ctx.perf_trace = Trace(ctx.command.qualified_name if ctx.command else "unknown")
+    _current_trace.set(ctx.perf_trace)
+
+
+async def after_invoke(ctx):
+    trace = getattr(ctx, "perf_trace", None)
+    if trace is None:
+        return
+    trace.open = False
+    duration_ms = (time.perf_counter() - trace.started) * 1000
+    _command_latency.setdefault(trace.command, Histogram()).record(duration_ms)
+    entry = (duration_ms, next(_seq), trace.command, trace.queries)
+    if len(_slowest) < PERF_SLOWEST_KEPT:
+        heapq.heappush(_slowest, entry)
+    elif duration_ms > _slowest[0][0]:
+        heapq.heapreplace(_slowest, entry)
+
+
+def install(bot):
+    bot.before_invoke(before_invoke)
+    bot.after_invoke(after_invoke)
+
+
+def command_stats():
+    return {name: hist.summary() for name, hist in _command_latency.items()}
+
+
+def query_stats():
+    return {shape: hist.summary() for shape, hist in _query_latency.items()}
+
+
+def slowest_invocations():
+    return [(command, duration_ms, queries) for duration_ms, _, command, queries in sorted(_slowest, reverse=True)]
+
+
+def reset_perf():
+    _command_latency.clear()
+    _query_latency.clear()
+    _slowest.clear()
+
+
+def perf_report(limit=5):
+    def table(stats):
+        rows = sorted(stats.items(), key=lambda item: item[1]["p95_ms"], reverse=True)[:limit]
+        return [
+            f"  {name}: n={s['count']} p50={s['p50_ms']:.0f}ms p95={s['p95_ms']:.0f}ms p99={s['p99_ms']:.0f}ms max={s['max_ms']:.0f}ms"
+            for name, s in rows
+        ] or ["  (none yet)"]
+
+    lines = ["Slowest commands (by p95):"] + table(command_stats())
+    lines += ["Slowest queries (by p95):"] + table(query_stats())
+    lines.append("Slowest invocations:")
+    for command, duration_ms, queries in slowest_invocations()[:limit]:
+        lines.append(f"  {command}: {duration_ms:.0f}ms, {len(queries)} queries")
+        lines += [f"    {shape} ({ms:.0f}ms)" for shape, ms in queries]
+    return "\n".join(lines)
+
+
+async def _log_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(perf_report())
+
+
+def start_perf_logger(interval=PERF_LOG_INTERVAL):
+    """Prints perf_report() every interval seconds. Must be called from inside the running loop."""
+    global _logger_task
+    if interval > 0 and (_logger_task is None or _logger_task.done()):
+        _logger_task = asyncio.get_running_loop().create_task(_log_loop(interval))
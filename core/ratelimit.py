@@ -0,0 +1,186 @@
+"""
+Per-user token buckets in front of every command.
+
+install(bot) adds a global check. Before a command parses its arguments or touches the database, the
+check takes a token from the bucket for (user, command class). An empty bucket fails the check with
+RateLimited. The user is told once per spam burst, and nothing else runs. Buckets refill continuously,
+so a user who keeps to the configured rate never notices the limiter.
+
+Each class is configured as "capacity/seconds": a burst of `capacity` calls, refilled at capacity per
+`seconds`. Override a class with RATE_LIMIT_<CLASS>, e.g. RATE_LIMIT_ECONOMY=3/10, or "off" to disable it.
+"""
+import os
+import sys
+import time
+import traceback
+from discord.ext import commands
+
+# Command name -> class. Commands not listed are "default".
+COMMAND_CLASSES = {
+    "balance": "read",
+    "stats": "read",
+    "class": "read",
+    "leaderboard": "read",
+    "faction_info": "read",
+    "faction_members": "read",
+    "raid_info": "read",
+    "duel_odds": "read",
+    "claim": "economy",
+    "heal": "economy",
+    "buy": "economy",
+    "buy_hourly_upgrade": "economy",
+    "deposit": "economy",
+    "faction_income": "economy",
+    "purchase_faction_upgrade": "economy",
+    "coinflip": "battle",
+    "duel": "battle",
+    "team_battle": "battle",
+    "start_raid": "battle",
+    "begin_raid": "battle",
+}
+
+DEFAULT_LIMITS = {
+    "read": "5/10",
+    "economy": "3/10",
+    "battle": "3/15",
+    "default": "5/10",
+}
+
+# Above this many buckets, full ones (which are equivalent to no bucket at all) are dropped.
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "10000"))
+
+
+def _parse_limit(spec):
+    if spec.strip().lower() == "off":
+        return None
+    capacity, seconds = spec.split("/")
+    capacity = float(capacity)
+    return capacity, capacity / float(seconds)
+
+
+LIMITS = {
+    name: _parse_limit(os.environ.get(f"RATE_LIMIT_{name.upper()}", spec))
+    for name, spec in DEFAULT_LIMITS.items()
+}
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, command_class, retry_after):
+        self.command_class = command_class
+        self.retry_after = retry_after
+        super().__init__(f"Rate limited ({command_class}), retry in {retry_after:.1f}s")
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated", "warned")
+
+    def __init__(self, capacity, rate, now):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = now
+        # Set once the user has been told they are limited, so a burst gets one reply, not one per call.
+        self.warned = False
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Takes a token. Returns 0 if one was available, otherwise the seconds until one is."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+_buckets = {}  # (user_id, command class) -> TokenBucket
+_admitted = {}  # command class -> count
+_rejected = {}  # command class -> count
+_rejected_by_command = {}  # command name -> count
+
+
+def command_class(command_name):
+    return COMMAND_CLASSES.get(command_name, "default")
+
+
+def _prune(now):
+    for key in [key for key, bucket in _buckets.items() if bucket.is_full(now)]:
+        del _buckets[key]
+
+
+def acquire(user_id, command_name, now=None):
+    """Takes a token for user_id's use of command_name. Raises RateLimited if there is none."""
+    name = command_class(command_name)
+    limit = LIMITS.get(name)
+    if limit is None:
+        return
+    now = time.monotonic() if now is None else now
+    key = (user_id, name)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        if len(_buckets) >= RATE_LIMIT_MAX_BUCKETS:
+            _prune(now)
+        bucket = _buckets[key] = TokenBucket(*limit, now)
+    retry_after = bucket.take(now)
+    if retry_after:
+        _rejected[name] = _rejected.get(name, 0) + 1
+        _rejected_by_command[command_name] = _rejected_by_command.get(command_name, 0) + 1
+        raise RateLimited(name, retry_after)
+    _admitted[name] = _admitted.get(name, 0) + 1
+
+
+async def check(ctx):
+    if ctx.command is not None:
+        acquire(ctx.author.id, ctx.command.qualified_name)
+    return True
+
+
+async def on_command_error(ctx, error):
+    if isinstance(error, RateLimited):
+        bucket = _buckets.get((ctx.author.id, error.command_class))
+        if bucket is not None and not bucket.warned:
+            bucket.warned = True
+            await ctx.reply(f"Slow down! Try again in {error.retry_after:.0f}s.", ephemeral=True)
+        return
+    # Registering a listener turns off discord.py's default handler, so do what it did for everything else.
+    if ctx.command is not None and ctx.command.has_error_handler():
+        return
+    if ctx.cog is not None and ctx.cog.has_error_handler():
+        return
+    print(f"Ignoring exception in command {ctx.command}:", file=sys.stderr)
+    traceback.print_exception(type(error), error, error.__traceback__, file=sys.stderr)
+
+
+def install(bot):
+    bot.add_check(check)
+    bot.add_listener(on_command_error, "on_command_error")
+
+
+def ratelimit_stats():
+    return {
+        "admitted": dict(_admitted),
+        "rejected": dict(_rejected),
+        "rejected_by_command": dict(_rejected_by_command),
+        "buckets": len(_buckets),
+    }
+
+
+def ratelimit_report(limit=5):
+    stats = ratelimit_stats()
+    lines = ["Rate limiter:"]
+    for name in DEFAULT_LIMITS:
+        admitted = stats["admitted"].get(name, 0)
+        rejected = stats["rejected"].get(name, 0)
+        lines.append(f"  {name}: {admitted} admitted, {rejected} rejected")
+    top = sorted(stats["rejected_by_command"].items(), key=lambda item: item[1], reverse=True)[:limit]
+    if top:
+        lines.append("  most rejected: " + ", ".join(f"{name} ({n})" for name, n in top))
+    lines.append(f"  {stats['buckets']} buckets")
+    return "\n".join(lines)
+
@@ -0,0 +1,100 @@
+"""
+Startup helpers: timed phases, concurrent extension loading, and syncing the command tree only when it changed.
+
+tree.sync() is a rate-limited global API call. It used to run on every on_ready, reconnects included.
+Now the tree's payload is hashed, and the hash of the last successful sync is kept in a local file.
+A sync happens only when the two differ, and at most once per process; a failed one is retried on the next on_ready.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+
+TREE_HASH_PATH = os.environ.get("TREE_HASH_PATH", ".tree_hash")
+
+_tree_checked = False
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        print(f"[startup] {name} took {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+async def timed(name, awaitable):
+    with phase(name):
+        return await awaitable
+
+
+async def load_extensions(bot, names):
+    """Loads every extension concurrently, timing each one."""
+
+    async def load(name):
+        with phase(f"load {name}"):
+            await bot.load_extension(name)
+
+    await asyncio.gather(*(load(name) for name in names))
+
+
+def tree_hash(tree):
+    """Stable hash of the payload tree.sync() would upload."""
+    payloads = []
+    for command in tree.get_commands():
+        try:
+            payloads.append(command.to_dict(tree))
+        except TypeError:
+            # discord.py < 2.4 takes no tree argument
+            payloads.append(command.to_dict())
+    payloads.sort(key=lambda payload: (payload.get("type", 1), payload["name"]))
+    return hashlib.sha256(json.dumps(payloads, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _read_saved_hash():
+    try:
+        with open(TREE_HASH_PATH) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _save_hash(digest):
+    try:
+        with open(TREE_HASH_PATH, "w") as f:
+            f.write(digest)
+    except OSError as e:
+        print(f"Error saving command tree hash: {e}")
+
+
+async def sync_tree_if_changed(bot):
+    """
+    Syncs the global command tree if it differs from the last synced one.
+    Returns the number of commands synced, or None if nothing was sent.
+    """
+    global _tree_checked
+    if _tree_checked:
+        return None
+    _tree_checked = True
+
+    # With shards split across processes, the process running shard 0 owns the (global) tree sync.
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_ids is not None and 0 not in shard_ids:
+        return None
+
+    with phase("command tree check"):
+        digest = tree_hash(bot.tree)
+        if digest == _read_saved_hash():
+            print("Command tree unchanged, skipping sync.")
+            return None
+        try:
+            synced = await bot.tree.sync()
+        except Exception:
+            # A rate limit or transient HTTP error; on_ready runs again after the next reconnect, let it retry.
+            _tree_checked = False
+            raise
+        _save_hash(digest)
+    return len(synced)
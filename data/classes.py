@@ -1,3 +1,5 @@
+import numpy as np
+
 classes = {
     "Valorant Player": {
         "name": "Valorant Player",
@@ -80,3 +82,67 @@ classes = {
         "defense": 5,
     },
 }
+
+# Everything below is derived from `classes` once at import time, so combat code looks modifiers up
+# by index instead of scanning the vulnerability/resistance/synergy lists on every attack.
+
+# Inclusive ranges of the random rolls added to attack and defense in duels and team battles.
+ATTACK_ROLL = (1, 10)
+DEFENSE_ROLL = (1, 5)
+
+CLASS_NAMES = list(classes)
+CLASS_INDEX = {name: i for i, name in enumerate(CLASS_NAMES)}
+
+
+def _build_attack_mod(attacker, defender):
+    mod = 1.0
+    if attacker in classes[defender].get("resistances", []):
+        mod *= 0.5
+    if attacker in classes[defender].get("vulnerabilities", []):
+        mod *= 1.5
+    return mod
+
+
+# ATTACK_MOD[a][d] is the multiplier applied to class a's attack when it hits class d.
+ATTACK_MOD = [[_build_attack_mod(a, d) for d in CLASS_NAMES] for a in CLASS_NAMES]
+# The same as an array, for looking up a whole team against a whole team at once.
+ATTACK_MOD_MATRIX = np.array(ATTACK_MOD)
+
+# Bit j of SYNERGY_MASK[i] is set when class i gets a synergy bonus from class j being in its party.
+# A class never synergizes with itself.
+SYNERGY_MASK = [
+    sum(1 << CLASS_INDEX[s] for s in set(classes[name].get("synergies", [])) if s != name and s in CLASS_INDEX) for name in CLASS_NAMES
+]
+
+
+def attack_mod(attacker, defender):
+    return ATTACK_MOD[CLASS_INDEX[attacker]][CLASS_INDEX[defender]]
+
+
+def class_indices(class_names):
+    return np.fromiter((CLASS_INDEX[name] for name in class_names), dtype=np.intp)
+
+
+def team_attack_mods(attacker_classes, enemy_classes):
+    """
+    Stacked modifier for each attacker against a whole enemy team (each enemy applies its factor).
+    One indexed lookup takes the attackers x enemies block of ATTACK_MOD_MATRIX; each row's product is that attacker's modifier.
+    """
+    block = ATTACK_MOD_MATRIX[np.ix_(class_indices(attacker_classes), class_indices(enemy_classes))]
+    return block.prod(axis=1).tolist()
+
+
+def team_attack_mod(attacker, enemy_classes):
+    """team_attack_mods for a single attacker."""
+    return team_attack_mods([attacker], enemy_classes)[0]
+
+
+def party_mask(class_names):
+    mask = 0
+    for name in class_names:
+        mask |= 1 << CLASS_INDEX[name]
+    return mask
+
+
+def has_synergy(class_name, mask):
+    return bool(SYNERGY_MASK[CLASS_INDEX[class_name]] & mask)
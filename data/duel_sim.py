@@ -0,0 +1,54 @@
+"""
+Duel odds simulation. Pure NumPy with no database imports, so benchmarks and tools can use it on their own.
+"""
+import numpy as np
+from data.classes import ATTACK_ROLL, DEFENSE_ROLL
+
+DEFAULT_ROUNDS = 50_000
+
+_rng = np.random.default_rng()
+
+
+def simulate_duel(
+    user_attack,
+    user_defense,
+    user_health,
+    user_mod,
+    opponent_attack,
+    opponent_defense,
+    opponent_health,
+    opponent_mod,
+    rounds=DEFAULT_ROUNDS,
+    rng=None,
+):
+    """
+    Monte Carlo estimate of one duel round, using the same formula and outcome rules as db.user_db.duel.
+    All rounds are rolled and resolved as one batch of NumPy arrays.
+    Returns win/draw/loss probabilities from the user's side and the expected damage each way.
+    """
+    rng = rng or _rng
+    user_attack_roll = rng.integers(ATTACK_ROLL[0], ATTACK_ROLL[1] + 1, rounds)
+    opponent_attack_roll = rng.integers(ATTACK_ROLL[0], ATTACK_ROLL[1] + 1, rounds)
+    user_defense_roll = rng.integers(DEFENSE_ROLL[0], DEFENSE_ROLL[1] + 1, rounds)
+    opponent_defense_roll = rng.integers(DEFENSE_ROLL[0], DEFENSE_ROLL[1] + 1, rounds)
+
+    user_damage = np.maximum(0, (user_attack + user_attack_roll) * user_mod - (opponent_defense + opponent_defense_roll))
+    opponent_damage = np.maximum(0, (opponent_attack + opponent_attack_roll) * opponent_mod - (user_defense + user_defense_roll))
+
+    user_down = (user_health - opponent_damage) <= 0
+    opponent_down = (opponent_health - user_damage) <= 0
+    both_standing = ~user_down & ~opponent_down
+
+    win = (opponent_down & ~user_down) | (both_standing & (user_damage > opponent_damage))
+    loss = (user_down & ~opponent_down) | (both_standing & (opponent_damage > user_damage))
+
+    win_rate = float(win.mean())
+    loss_rate = float(loss.mean())
+    return {
+        "win": win_rate,
+        "draw": 1.0 - win_rate - loss_rate,
+        "loss": loss_rate,
+        "expected_damage_dealt": float(user_damage.mean()),
+        "expected_damage_taken": float(opponent_damage.mean()),
+        "rounds": rounds,
+    }
@@ -0,0 +1,222 @@
+"""
+Coalescing write-behind for per-row column updates.
+
+A BatchWriter collects {column: value} updates keyed by primary key. The first write after a quiet period
+opens a window of `window` seconds. Every write that lands in the window is merged per row, later values
+winning, and the whole window goes out as one bulk upsert per distinct column set. A fight that touches
+eight users, or eight fights in a busy channel, costs one request instead of one per combatant.
+
+Writes are fire-and-forget. Callers that need read-your-writes against Supabase itself (an RPC, a query
+that filters on the column) await writer.durable(keys), which flushes those rows now and returns once
+they are stored, or raises if the upsert failed.
+
+A row is never sent while an earlier upsert of it is still in flight: two requests for the same row can be
+answered in either order, and the older values could land last. It waits and goes out once that one returns.
+
+Failed rows stay queued and are retried after an exponential backoff (BATCH_RETRY_DELAY doubling up to
+BATCH_MAX_BACKOFF). Rows that failed before are sent one per upsert, so a row the database rejects can't
+keep failing the rows batched with it. A row that fails BATCH_MAX_RETRIES times in a row is dropped and
+logged. While a row is backing off, durable() for it raises the last error instead of waiting for a retry.
+"""
+import asyncio
+import os
+from db.client import supabase, execute
+
+BATCH_MAX_RETRIES = int(os.environ.get("BATCH_MAX_RETRIES", "8"))
+BATCH_RETRY_DELAY = float(os.environ.get("BATCH_RETRY_DELAY", "0.1"))
+BATCH_MAX_BACKOFF = float(os.environ.get("BATCH_MAX_BACKOFF", "30"))
+
+
+class BatchWriter:
+    def __init__(self, table, key="id", window=0.05, on_flushed=None):
+        self.table = table
+        self.key = key
+        self.window = window
+        # Called with the keys of every batch that was stored, e.g. to publish cache invalidations.
+        self.on_flushed = on_flushed
+        # key -> {column: value} not yet sent. Kept apart from any cache so an eviction never drops a write.
+        self._pending = {}
+        # key -> [future] resolved once that key's pending fields are stored
+        self._waiters = {}
+        # key -> [[future]], one list per batch holding the key that was sent but not yet acknowledged
+        self._in_flight = {}
+        # key -> (failed attempts in a row, loop time of the next attempt, last error) for rows backing off
+        self._retrying = {}
+        self._timer = None
+        self._timer_due = 0.0
+        self.writes = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.merged = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def write(self, key, fields):
+        """Queues fields for key, merged with anything already pending. Must be called from inside the running loop."""
+        if key in self._pending:
+            self.merged += 1
+        self._pending.setdefault(key, {}).update(fields)
+        self.writes += 1
+        self._schedule()
+
+    def pending(self, key):
+        """Fields queued for key that have not been sent yet."""
+        return self._pending.get(key, {})
+
+    def has_pending(self):
+        return bool(self._pending)
+
+    async def flush(self, keys=None):
+        """
+        Sends pending rows now, one upsert per distinct set of columns. With keys, only those rows are sent.
+        Rows still in flight or backing off after a failure are left for later.
+        """
+        now = asyncio.get_running_loop().time()
+        batch = {}
+        for key in list(self._pending) if keys is None else keys:
+            if key in self._pending and key not in self._in_flight and self._retrying.get(key, (0, now))[1] <= now:
+                batch[key] = self._pending.pop(key)
+        if not batch:
+            return
+
+        groups = {}
+        for key, fields in batch.items():
+            row = {self.key: key, **fields}
+            if key in self._retrying:
+                groups[(key,)] = [row]
+            else:
+                groups.setdefault(frozenset(fields), []).append(row)
+
+        for rows in groups.values():
+            await self._send(rows)
+
+    async def _send(self, rows):
+        keys_sent = [row[self.key] for row in rows]
+        waiters = {}
+        for key in keys_sent:
+            waiters[key] = self._waiters.pop(key, [])
+            self._in_flight.setdefault(key, []).append(waiters[key])
+        try:
+            await execute(supabase.table(self.table).upsert(rows))
+            error = None
+        except Exception as e:
+            print(f"Error in BatchWriter.flush ({self.table}): {e}")
+            error = e
+
+        for key in keys_sent:
+            batches = [batch for batch in self._in_flight.pop(key) if batch is not waiters[key]]
+            if batches:
+                self._in_flight[key] = batches
+            for future in waiters[key]:
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+        if error is not None:
+            self.failures += 1
+            now = asyncio.get_running_loop().time()
+            for row in rows:
+                key = row.pop(self.key)
+                attempts = self._retrying.get(key, (0,))[0] + 1
+                if attempts >= BATCH_MAX_RETRIES:
+                    self._retrying.pop(key, None)
+                    self.dropped += 1
+                    print(f"BatchWriter ({self.table}) dropped {self.key}={key} after {attempts} failed attempts: {row}")
+                    continue
+                delay = min(BATCH_RETRY_DELAY * 2 ** (attempts - 1), BATCH_MAX_BACKOFF)
+                self._retrying[key] = (attempts, now + delay, error)
+                # Writes queued while this batch was in flight are newer and win.
+                self._pending[key] = {**row, **self._pending.get(key, {})}
+                # They are now tied to the retry, so anyone waiting on them gets this error too.
+                for future in self._waiters.pop(key, []):
+                    if not future.done():
+                        future.set_exception(error)
+            self._schedule()
+            return
+
+        for key in keys_sent:
+            self._retrying.pop(key, None)
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        if self.on_flushed is not None:
+            self.on_flushed(keys_sent)
+        # Rows written while this batch was in flight were held back; durable() callers waiting on them go now.
+        held = [key for key in keys_sent if key in self._waiters]
+        if held:
+            await self.flush(held)
+
+    async def durable(self, keys=None):
+        """
+        Returns once every write queued so far for keys (default: every key) is stored,
+        flushing them right away. Raises at once if one of them is backing off after a failed upsert.
+        """
+        if keys is None:
+            keys = list(self._pending) + [key for key in self._in_flight if key not in self._pending]
+        loop = asyncio.get_running_loop()
+        for key in keys:
+            if key in self._pending and self._retrying.get(key, (0, 0))[1] > loop.time():
+                raise self._retrying[key][2]
+        futures = []
+        for key in keys:
+            if key in self._pending:
+                future = loop.create_future()
+                self._waiters.setdefault(key, []).append(future)
+                futures.append(future)
+            elif key in self._in_flight:
+                future = loop.create_future()
+                self._in_flight[key][-1].append(future)
+                futures.append(future)
+        if not futures:
+            return
+        await self.flush(keys)
+        for result in await asyncio.gather(*futures, return_exceptions=True):
+            if isinstance(result, Exception):
+                raise result
+
+    async def close(self):
+        """Stops the window timer and writes out everything still pending. Call on shutdown."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # There is no later: rows backing off get one last try now.
+        self._retrying = {key: (attempts, 0, error) for key, (attempts, _, error) in self._retrying.items()}
+        await self.flush()
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        delay = self.window
+        if self._pending and all(key in self._retrying for key in self._pending):
+            # Nothing to send before the first retry is due.
+            delay = max(delay, min(self._retrying[key][1] for key in self._pending) - loop.time())
+        if self._timer is not None and not self._timer.done():
+            if self._timer_due <= loop.time() + delay:
+                return
+            # Waiting out a backoff; a fresh write shouldn't wait with it.
+            self._timer.cancel()
+        self._timer_due = loop.time() + delay
+        self._timer = loop.create_task(self._flush_after_window(delay))
+
+    async def _flush_after_window(self, delay):
+        await asyncio.sleep(delay)
+        # From here on close() can't cancel this task, so a batch is never dropped half-sent.
+        self._timer = None
+        await self.flush()
+        # Rows held back (in flight or backing off) go in a later window.
+        if self._pending:
+            self._schedule()
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "pending_writes": len(self._pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            # Updates folded into a row that was already pending, i.e. rows that cost nothing extra
+            "merged": self.merged,
+            "failures": self.failures,
+            "retrying": len(self._retrying),
+            "dropped": self.dropped,
+        }
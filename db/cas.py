@@ -0,0 +1,81 @@
+"""
+Optimistic concurrency for read-modify-write on users and factions rows.
+
+Both tables have a version column (db/sql/row_versions.sql) that goes up on every update. cas_update reads
+a row, computes the new values from it, and writes them with `where version = <version it read>`. If
+another writer got in between, from any process or shard, no row matches. The row is then read again and
+the computation redone, up to CAS_MAX_RETRIES times with a short jittered pause, before CasConflict is
+raised. Per-process locks (db/locks.py) can't give that guarantee across shards.
+"""
+import asyncio
+import os
+import random
+from dataclasses import dataclass
+from db.client import supabase, execute
+
+CAS_MAX_RETRIES = int(os.environ.get("CAS_MAX_RETRIES", "5"))
+CAS_RETRY_DELAY = float(os.environ.get("CAS_RETRY_DELAY", "0.01"))
+
+# table -> counters
+_stats = {}
+
+
+class CasConflict(Exception):
+    """The row kept changing under us for every attempt."""
+
+
+@dataclass
+class CasResult:
+    row: dict  # the row as read by the attempt that decided the outcome
+    fields: dict = None  # what was written, or None if compute declined
+
+    @property
+    def applied(self):
+        return self.fields is not None
+
+    @property
+    def new_row(self):
+        return {**self.row, **(self.fields or {})}
+
+
+def _counters(table):
+    return _stats.setdefault(table, {"updates": 0, "retries": 0, "declined": 0, "exhausted": 0})
+
+
+async def cas_update(table, key_column, key, compute, columns="*"):
+    """
+    compute(row) returns the fields to write, or None to leave the row alone (e.g. not enough resources).
+    It may run more than once, so it must not have side effects.
+    Returns a CasResult, or None if the row does not exist. Raises CasConflict after CAS_MAX_RETRIES retries.
+    """
+    if columns != "*":
+        columns = f"{columns}, version"
+    counters = _counters(table)
+    for attempt in range(CAS_MAX_RETRIES + 1):
+        if attempt:
+            counters["retries"] += 1
+            await asyncio.sleep(random.uniform(0, CAS_RETRY_DELAY * attempt))
+
+        response = await execute(supabase.table(table).select(columns).eq(key_column, key))
+        if not response.data:
+            return None
+        row = response.data[0]
+        fields = compute(row)
+        if fields is None:
+            counters["declined"] += 1
+            return CasResult(row)
+
+        version = row["version"]
+        written = await execute(
+            supabase.table(table).update({**fields, "version": version + 1}).eq(key_column, key).eq("version", version)
+        )
+        if written.data:
+            counters["updates"] += 1
+            return CasResult(row, {**fields, "version": version + 1})
+
+    counters["exhausted"] += 1
+    raise CasConflict(f"{table} {key_column}={key} changed on every one of {CAS_MAX_RETRIES + 1} attempts")
+
+
+def cas_stats():
+    return {table: dict(counters) for table, counters in _stats.items()}
@@ -1,11 +1,134 @@
-from supabase import create_client
-from env import supabase_url, supabase_key
+import asyncio
+import copy
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from core.perf import record_query
 
-if not supabase_url or not supabase_key:
-    raise ValueError("Supabase URL and API Key must be set as environment variables.")
+# "supabase" (default) talks to the real project configured in env.py.
+# "memory" uses the in-process stand-in from db/memory_backend.py: no network, no credentials,
+# with an optional simulated per-call latency in seconds (DB_MEMORY_LATENCY). With DB_MEMORY_ADDRESS set,
+# the tables are the ones served by another process (db.memory_backend.serve_memory_backend), so several
+# processes share one database.
+DB_BACKEND = os.environ.get("DB_BACKEND", "supabase")
 
-print("Connecting to Supabase...")
-supabase = create_client(supabase_url, supabase_key)
+if DB_BACKEND == "memory":
+    from db.memory_backend import MemoryClient, RemoteMemoryClient
 
-if not supabase:
-    raise ValueError("Failed to connect to Supabase. Check your credentials.")
+    if os.environ.get("DB_MEMORY_ADDRESS"):
+        supabase = RemoteMemoryClient(os.environ["DB_MEMORY_ADDRESS"], latency=float(os.environ.get("DB_MEMORY_LATENCY", "0")))
+    else:
+        supabase = MemoryClient(latency=float(os.environ.get("DB_MEMORY_LATENCY", "0")))
+else:
+    from supabase import create_client
+    from env import supabase_url, supabase_key
+
+    if not supabase_url or not supabase_key:
+        raise ValueError("Supabase URL and API Key must be set as environment variables.")
+
+    print("Connecting to Supabase...")
+    supabase = create_client(supabase_url, supabase_key)
+
+    if not supabase:
+        raise ValueError("Failed to connect to Supabase. Check your credentials.")
+
+# Both clients are synchronous, so every query runs on this pool instead of the event loop.
+# The worker count caps how many requests are in flight at once; extra queries queue here.
+DB_MAX_CONCURRENCY = int(os.environ.get("DB_MAX_CONCURRENCY", "8"))
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="supabase")
+
+
+# Singleflight: concurrent identical reads share one in-flight request.
+# table -> {request key -> [future, number of callers that joined]}. Writes to a table drop its entries (and RPCs drop everything), so a read
+# issued after a write never joins a request that started before it; coalescing adds no staleness.
+_inflight = {}
+_singleflight = {"reads": 0, "coalesced": 0}
+
+
+def _request_parts(query):
+    request = getattr(query, "request", query)
+    method = getattr(request, "http_method", "GET")
+    method = str(getattr(method, "value", method))
+    path = str(getattr(request, "path", ""))
+    return request, method, path.rstrip("/").split("/rest/v1/")[-1]
+
+
+def _read_key(request, path):
+    params = getattr(request, "params", None) or []
+    items = params.multi_items() if hasattr(params, "multi_items") else params
+    headers = getattr(request, "headers", None) or {}
+    # Headers carry things like count=exact and single-object Accept, which change the response.
+    return (path, tuple((str(k), str(v)) for k, v in items), tuple(sorted((str(k), str(v)) for k, v in dict(headers).items())))
+
+
+def _drop_inflight(table):
+    if table.startswith("rpc/"):
+        _inflight.clear()
+    else:
+        _inflight.pop(table, None)
+
+
+def drop_inflight_reads(table):
+    """
+    For changes made by another process: reads of table issued from now on won't join a request that
+    started before the change. Local writes do this themselves.
+    """
+    _drop_inflight(table)
+
+
+def singleflight_stats():
+    reads = _singleflight["reads"]
+    coalesced = _singleflight["coalesced"]
+    return {
+        "reads": reads,
+        "executed": reads - coalesced,
+        "coalesced": coalesced,
+        "coalesce_rate": coalesced / reads if reads else 0.0,
+        "in_flight": sum(len(requests) for requests in _inflight.values()),
+    }
+
+
+async def execute(query):
+    """
+    Awaitable replacement for query.execute().
+    Build the query as usual and pass it in without calling .execute() on it.
+    Every call is timed and reported to core.perf. Identical reads already in flight are shared, and each
+    caller gets its own copy of the response.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    request, method, table = _request_parts(query)
+
+    if method != "GET":
+        _drop_inflight(table)
+        try:
+            return await loop.run_in_executor(_executor, query.execute)
+        finally:
+            _drop_inflight(table)
+            record_query(query, (time.perf_counter() - start) * 1000)
+
+    _singleflight["reads"] += 1
+    key = _read_key(request, table)
+    requests = _inflight.setdefault(table, {})
+    entry = requests.get(key)
+    coalesced = entry is not None
+    if coalesced:
+        entry[1] += 1
+        _singleflight["coalesced"] += 1
+    else:
+        entry = [loop.run_in_executor(_executor, query.execute), 0]
+        requests[key] = entry
+
+        def done(_, requests=requests, key=key, entry=entry):
+            if requests.get(key) is entry:
+                del requests[key]
+
+        entry[0].add_done_callback(done)
+
+    try:
+        # shield: one caller being cancelled must not cancel the request for everyone else
+        response = await asyncio.shield(entry[0])
+        # Callers mutate rows they get back (the caches store them), so a shared response is never handed out as is.
+        return copy.deepcopy(response) if entry[1] else response
+    finally:
+        record_query(query, (time.perf_counter() - start) * 1000, coalesced=coalesced)
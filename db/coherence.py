@@ -0,0 +1,204 @@
+"""
+Cache coherence between bot processes.
+
+The user, faction upgrade, leaderboard and cooldown caches are per process. One process (a single Bot,
+or an AutoShardedBot running every shard) is coherent by construction. Once shards are split across
+processes, each cache publishes the keys it changes on an invalidation bus, and every other process
+drops or overwrites its copy.
+
+    CACHE_COHERENCE=local  (default) LocalBus: in-process only; peers are other LocalBus objects on the same hub
+    CACHE_COHERENCE=table  TablePollBus: messages go through the cache_invalidations table (db/sql/cache_invalidations.sql)
+
+Messages are (channel, key, value). The value is optional and must be JSON-serializable. Each process
+ignores its own messages.
+"""
+import asyncio
+import os
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from db.client import supabase, execute
+
+CACHE_COHERENCE = os.environ.get("CACHE_COHERENCE", "local")
+COHERENCE_POLL_INTERVAL = float(os.environ.get("COHERENCE_POLL_INTERVAL", "1.0"))
+# Seconds of already-seen messages each poll reads again, for rows that committed after a later row was read.
+COHERENCE_POLL_OVERLAP = float(os.environ.get("COHERENCE_POLL_OVERLAP", "5.0"))
+NODE_ID = os.environ.get("NODE_ID") or uuid.uuid4().hex[:12]
+
+
+class InvalidationBus(ABC):
+    """Base class for buses. Subscribers are plain callables taking (key, value)."""
+
+    def __init__(self, node_id=NODE_ID):
+        self.node_id = node_id
+        self._subscribers = {}  # channel -> [callback]
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, channel, callback):
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    @abstractmethod
+    def publish(self, channel, key, value=None):
+        """Sends (channel, key, value) to every other node."""
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def flush(self):
+        """Exchanges pending messages with the other nodes now instead of on the next tick."""
+
+    def _deliver(self, channel, key, value):
+        self.received += 1
+        for callback in self._subscribers.get(channel, ()):
+            try:
+                callback(key, value)
+            except Exception as e:
+                print(f"Error in coherence callback for {channel}: {e}")
+
+    def stats(self):
+        return {"node": self.node_id, "bus": type(self).__name__, "published": self.published, "received": self.received}
+
+
+class LocalBus(InvalidationBus):
+    """
+    Delivers to the other buses on the same hub (a plain list), e.g. several simulated nodes in one test process.
+    A bus alone on its hub has no peers, which is right for a single process.
+    """
+
+    def __init__(self, hub=None):
+        super().__init__()
+        self.hub = hub if hub is not None else []
+        self.hub.append(self)
+
+    def publish(self, channel, key, value=None):
+        self.published += 1
+        for bus in self.hub:
+            if bus is not self:
+                bus._deliver(channel, key, value)
+
+
+class TablePollBus(InvalidationBus):
+    """
+    Uses a Supabase table as the channel. Messages published between ticks are inserted in one batch,
+    and each tick reads the recent messages from other nodes, so a tick costs at most two round trips.
+    Other processes see a change up to COHERENCE_POLL_INTERVAL seconds late.
+
+    Ids are handed out at insert but rows become visible at commit, so a row can show up after a row with a
+    higher id was already read. Polling "id > last id seen" would skip it for good. Instead each tick reads
+    everything created since COHERENCE_POLL_OVERLAP seconds before the newest message seen, and skips ids
+    it has already delivered.
+    """
+
+    def __init__(self, node_id=NODE_ID, interval=COHERENCE_POLL_INTERVAL, overlap=COHERENCE_POLL_OVERLAP):
+        super().__init__(node_id)
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self._outbox = []
+        # Database time of the newest message seen; None until start()
+        self._newest = None
+        # id -> created_at of messages already handled, kept for the overlap window
+        self._seen = {}
+        self._task = None
+
+    def publish(self, channel, key, value=None):
+        self.published += 1
+        self._outbox.append({"channel": channel, "key": str(key), "value": value, "origin": self.node_id})
+
+    async def start(self):
+        # Only messages published from now on matter; older ones describe state we'll read fresh anyway.
+        response = await execute(supabase.table("cache_invalidations").select("created_at").order("id", desc=True).limit(1))
+        if response.data:
+            self._newest = _parse_time(response.data[0]["created_at"])
+            await self._receive(deliver=False)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._poll_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._send()
+
+    async def flush(self):
+        await self._send()
+        await self._receive()
+
+    async def _send(self):
+        outbox, self._outbox = self._outbox, []
+        if not outbox:
+            return
+        try:
+            await execute(supabase.table("cache_invalidations").insert(outbox))
+        except Exception as e:
+            print(f"Error in TablePollBus._send: {e}")
+            self._outbox = outbox + self._outbox
+
+    async def _receive(self, deliver=True):
+        query = supabase.table("cache_invalidations").select("id, channel, key, value, origin, created_at").order("id")
+        since = None
+        if self._newest is not None:
+            since = self._newest - self.overlap
+            query = query.gte("created_at", since.isoformat())
+        response = await execute(query)
+        for message in response.data or []:
+            if message["id"] in self._seen:
+                continue
+            created_at = _parse_time(message["created_at"])
+            self._seen[message["id"]] = created_at
+            if self._newest is None or created_at > self._newest:
+                self._newest = created_at
+            if deliver and message["origin"] != self.node_id:
+                self._deliver(message["channel"], message["key"], message["value"])
+        if since is not None:
+            for message_id in [message_id for message_id, created_at in self._seen.items() if created_at < since]:
+                del self._seen[message_id]
+
+    async def _poll_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._send()
+                await self._receive()
+            except Exception as e:
+                print(f"Error in TablePollBus._poll_loop: {e}")
+
+
+def _parse_time(timestamp):
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def _make_bus():
+    if CACHE_COHERENCE == "table":
+        return TablePollBus()
+    return LocalBus()
+
+
+bus = _make_bus()
+
+
+def publish(channel, key, value=None):
+    bus.publish(channel, key, value)
+
+
+def subscribe(channel, callback):
+    bus.subscribe(channel, callback)
+
+
+async def start_coherence():
+    await bus.start()
+
+
+async def close_coherence():
+    await bus.close()
+
+
+async def flush_coherence():
+    await bus.flush()
+
+
+def coherence_stats():
+    return bus.stats()
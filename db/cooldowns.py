@@ -0,0 +1,93 @@
+"""
+One place for every "you must wait" check: hourly claims, heals, faction income and boss attempts.
+
+Each Cooldown keeps expiry times as epoch seconds in memory, keyed by user id, faction name, etc.
+A key is loaded once from the timestamp column that persists it. After that, calls still on cooldown
+are rejected without touching the database. The timestamp is only written back when a cooldown starts.
+"""
+import time
+from datetime import datetime, timezone
+from data.bosses import bosses
+from db.coherence import publish, subscribe
+
+
+def to_epoch(timestamp):
+    """ISO timestamp from Supabase (or None) -> epoch seconds. None means never used."""
+    if not timestamp:
+        return 0
+    return int(datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp())
+
+
+def to_timestamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+
+def split_remaining(seconds):
+    """seconds -> (hours, minutes, seconds), for the "please wait" messages."""
+    hours, remainder = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return hours, minutes, seconds
+
+
+class Cooldown:
+    def __init__(self, name, seconds):
+        self.name = name
+        self.seconds = seconds
+        self._expires = {}  # key -> epoch seconds when the cooldown ends
+        # Other processes send the new expiry itself, so there is no window where a reload would
+        # still see the old (not yet flushed) timestamp.
+        subscribe(f"cooldown:{name}", self._on_remote_change)
+
+    def remaining(self, key, now=None):
+        """Seconds left, 0 if ready, or None if the key hasn't been loaded yet."""
+        expires = self._expires.get(key)
+        if expires is None:
+            return None
+        return max(0, expires - int(now or time.time()))
+
+    def is_loaded(self, key):
+        return key in self._expires
+
+    def load(self, key, last_used, now=None):
+        """
+        Records when the key was last used, from its persisted timestamp, and returns the seconds left.
+        A key that is already loaded keeps the later of the two expiries: memory is ahead of the database while
+        a start is still being written, but an expired entry is behind a start made by another process.
+        """
+        self._expires[key] = max(self._expires.get(key, 0), to_epoch(last_used) + self.seconds)
+        return self.remaining(key, now)
+
+    def start(self, key, now=None):
+        """Starts the cooldown and returns the timestamp to persist."""
+        now = int(now or time.time())
+        self._expires[key] = now + self.seconds
+        publish(f"cooldown:{self.name}", key, self._expires[key])
+        return to_timestamp(now)
+
+    def forget(self, key):
+        self._expires.pop(key, None)
+        publish(f"cooldown:{self.name}", key)
+
+    def _on_remote_change(self, key, expires):
+        if expires is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = int(expires)
+
+    def clear(self):
+        self._expires.clear()
+
+    def __len__(self):
+        return len(self._expires)
+
+
+HOURLY_CLAIM = Cooldown("hourly_claim", 60 * 60)
+HEAL = Cooldown("heal", 30 * 60)
+FACTION_INCOME = Cooldown("faction_income", 24 * 60 * 60)
+BOSS = {name: Cooldown(f"boss:{name}", boss["cooldown"]) for name, boss in bosses.items()}
+
+
+def clear_cooldowns():
+    """Forgets every loaded cooldown; they are reloaded from the database on next use."""
+    for cooldown in (HOURLY_CLAIM, HEAL, FACTION_INCOME, *BOSS.values()):
+        cooldown.clear()
@@ -1,26 +1,79 @@
-from db.client import supabase
-from datetime import datetime, timedelta, timezone
+import os
+import time
+from db.client import supabase, execute, drop_inflight_reads
+from db.cas import cas_update
+from db.cache import TTLCache
+from db.user_cache import get_user_row, get_cached_user_row, update_user_row, flush_user_writes
+from db.leaderboard import get_top_factions, update_leaderboard, remove_from_leaderboard
+from db.cooldowns import FACTION_INCOME, split_remaining, to_epoch, to_timestamp
+from db.coherence import publish, subscribe
+
+FACTION_UPGRADE_COLUMNS = "power_bonus, hourly_bonus, attack_bonus, defense_bonus"
+FACTION_CACHE_TTL = float(os.environ.get("FACTION_CACHE_TTL", "600"))
+USER_SCAN_PAGE_SIZE = int(os.environ.get("USER_SCAN_PAGE_SIZE", "1000"))
+
+# Upgrades only change through update_faction_upgrade, which invalidates its entry here.
+_faction_upgrades = TTLCache(1000, FACTION_CACHE_TTL)
+
+# Ids of users known to have a row. Users are never deleted, so this only grows and can't go stale.
+_known_users = set()
+
+
+def default_faction_upgrades():
+    return {"power_bonus": 0, "hourly_bonus": 0.0, "attack_bonus": 0, "defense_bonus": 0}
 
 
 async def get_user_faction(user_id):
     try:
-        response = supabase.table("users").select("faction").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["faction"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["faction"]
         return None
     except Exception as e:
         print(f"Error in get_user_faction: {e}")
         return None
 
 
+async def warm_known_users():
+    """Loads every user id with one paged scan, so ensure_user_exists is free for existing users."""
+    try:
+        start = 0
+        while True:
+            response = await execute(supabase.table("users").select("id").order("id").range(start, start + USER_SCAN_PAGE_SIZE - 1))
+            rows = response.data or []
+            _known_users.update(str(row["id"]) for row in rows)
+            if len(rows) < USER_SCAN_PAGE_SIZE:
+                break
+            start += USER_SCAN_PAGE_SIZE
+        print(f"Loaded {len(_known_users)} known users.")
+    except Exception as e:
+        print(f"Error in warm_known_users: {e}")
+
+
+def clear_known_users():
+    _known_users.clear()
+
+
+def _is_known_user(user_id):
+    return str(user_id) in _known_users or get_cached_user_row(user_id) is not None
+
+
 async def ensure_user_exists(user_id):
+    await ensure_users_exist([user_id])
+
+
+async def ensure_users_exist(user_ids):
+    """
+    Makes sure every user has a row. Known users cost nothing; the rest get one
+    insert ... on conflict do nothing, so a row created elsewhere in the meantime is left alone.
+    """
     try:
-        response = supabase.table("users").select("*").eq("id", user_id).execute()
-        if response.data and len(response.data) > 0:
-            return
-        supabase.table("users").insert({"id": user_id}).execute()
+        missing = [user_id for user_id in dict.fromkeys(str(user_id) for user_id in user_ids) if not _is_known_user(user_id)]
+        if missing:
+            await execute(supabase.table("users").upsert([{"id": user_id} for user_id in missing], on_conflict="id", ignore_duplicates=True))
+            _known_users.update(missing)
     except Exception as e:
-        print(f"Error in ensure_user_exists: {e}")
+        print(f"Error in ensure_users_exist: {e}")
 
 
 async def create_faction(faction_name, leader_id):
@@ -29,7 +82,8 @@ async def create_faction(faction_name, leader_id):
         await ensure_user_exists(leader_id)
         print("User exists.")
 
-        response = supabase.table("factions").insert({"name": faction_name, "leader_id": leader_id}).execute()
+        response = await execute(supabase.table("factions").insert({"name": faction_name, "leader_id": leader_id}))
+        update_leaderboard(faction_name, resources=0, **default_faction_upgrades())
 
         print(f"Faction `{faction_name}` created with leader {leader_id}.")
     except Exception as e:
@@ -38,7 +92,7 @@ async def create_faction(faction_name, leader_id):
 
 async def is_faction_name_taken(faction_name):
     try:
-        response = supabase.table("factions").select("*").eq("name", faction_name).execute()
+        response = await execute(supabase.table("factions").select("*").eq("name", faction_name))
         if response.data:
             return True
         return False
@@ -51,9 +105,9 @@ async def add_member_to_faction(user_id, faction_name, role="member"):
     try:
         await ensure_user_exists(user_id)
 
-        response = supabase.table("users").update({"faction": faction_name}).eq("id", user_id).execute()
+        update_user_row(user_id, {"faction": faction_name})
 
-        response = supabase.table("faction_members").insert({"user_id": user_id, "faction": faction_name, "role": role}).execute()
+        response = await execute(supabase.table("faction_members").insert({"user_id": user_id, "faction": faction_name, "role": role}))
 
         print(f"User {user_id} added to faction `{faction_name}`.")
     except Exception as e:
@@ -64,7 +118,7 @@ async def remove_member_from_faction(user_id):
     try:
         await ensure_user_exists(user_id)
 
-        response = supabase.table("users").update({"faction": None}).eq("id", user_id).execute()
+        update_user_row(user_id, {"faction": None})
 
         print(f"User {user_id} removed from their faction.")
     except Exception as e:
@@ -73,7 +127,9 @@ async def remove_member_from_faction(user_id):
 
 async def get_faction_members(faction_name):
     try:
-        response = supabase.table("users").select("id").eq("faction", faction_name).execute()
+        # Membership changes are written behind; push them out before filtering on the column.
+        await flush_user_writes()
+        response = await execute(supabase.table("users").select("id").eq("faction", faction_name))
 
         if response.data:
             return [member["id"] for member in response.data]
@@ -85,7 +141,7 @@ async def get_faction_members(faction_name):
 
 async def get_faction_leader(faction_name):
     try:
-        response = supabase.table("factions").select("leader_id").eq("name", faction_name).execute()
+        response = await execute(supabase.table("factions").select("leader_id").eq("name", faction_name))
 
         return response.data[0]["leader_id"]
     except Exception as e:
@@ -95,7 +151,9 @@ async def get_faction_leader(faction_name):
 
 async def update_faction_resources(faction_name, resources):
     try:
-        response = supabase.table("factions").update({"resources": resources}).eq("name", faction_name).execute()
+        response = await execute(supabase.table("factions").update({"resources": resources}).eq("name", faction_name))
+        if response.data:
+            update_leaderboard(faction_name, resources=resources, version=response.data[0]["version"])
 
         print(f"Resources of faction `{faction_name}` updated.")
     except Exception as e:
@@ -104,7 +162,7 @@ async def update_faction_resources(faction_name, resources):
 
 async def has_enough_resources(faction_name, amount):
     try:
-        response = supabase.table("factions").select("resources").eq("name", faction_name).execute()
+        response = await execute(supabase.table("factions").select("resources").eq("name", faction_name))
 
         if response.data:
             return response.data[0]["resources"] >= amount
@@ -116,7 +174,7 @@ async def has_enough_resources(faction_name, amount):
 
 async def is_leader(user_id):
     try:
-        response = supabase.table("factions").select("leader_id").eq("leader_id", user_id).execute()
+        response = await execute(supabase.table("factions").select("leader_id").eq("leader_id", user_id))
 
         return bool(response.data)
     except Exception as e:
@@ -126,54 +184,101 @@ async def is_leader(user_id):
 
 async def remove_faction(faction_name):
     try:
-        response = supabase.table("factions").delete().eq("name", faction_name).execute()
+        response = await execute(supabase.table("factions").delete().eq("name", faction_name))
+        invalidate_faction_upgrades(faction_name)
+        FACTION_INCOME.forget(faction_name)
+        remove_from_leaderboard(faction_name)
         print(f"Faction `{faction_name}` removed.")
     except Exception as e:
         print(f"Error in remove_faction: {e}")
 
 
 async def get_top_factions_by_score():
-    resp = supabase.table("factions").select("name, resources, power_bonus, hourly_bonus, attack_bonus, defense_bonus").execute()
-    if not resp.data:
-        return []
+    # Served from the in-memory index in db/leaderboard.py, which the writers below keep current.
+    return await get_top_factions(10)
+
+
+def put_faction_upgrades(faction_name, upgrades):
+    """Caches upgrades that were fetched alongside some other query."""
+    _faction_upgrades.set(faction_name, upgrades)
+
+
+def invalidate_faction_upgrades(faction_name):
+    _faction_upgrades.invalidate(faction_name)
+    publish("faction_upgrades", faction_name)
+
 
-    factions_data = resp.data
-    for f in factions_data:
-        resources = f.get("resources", 0)
-        p_bonus = f.get("power_bonus", 0)
-        h_bonus = f.get("hourly_bonus", 0.0)
-        a_bonus = f.get("attack_bonus", 0)
-        d_bonus = f.get("defense_bonus", 0)
-        score = resources + (p_bonus * 1000) + (h_bonus * 2000) + (a_bonus * 500) + (d_bonus * 500)
-        f["score"] = score
+def _on_remote_upgrade_change(faction_name, _):
+    drop_inflight_reads("factions")
+    _faction_upgrades.invalidate(faction_name)
 
-    factions_data.sort(key=lambda x: x["score"], reverse=True)
-    return factions_data[:10]
+
+subscribe("faction_upgrades", _on_remote_upgrade_change)
+
+
+def clear_faction_upgrades():
+    _faction_upgrades.clear()
+
+
+def faction_cache_stats():
+    return _faction_upgrades.stats()
 
 
 async def get_faction_upgrades(faction_name):
+    ups = _faction_upgrades.get(faction_name)
+    if ups is not None:
+        return ups
     try:
-        resp = supabase.table("factions").select("power_bonus, hourly_bonus, attack_bonus, defense_bonus").eq("name", faction_name).execute()
+        resp = await execute(supabase.table("factions").select(FACTION_UPGRADE_COLUMNS).eq("name", faction_name))
         if resp.data and len(resp.data) > 0:
+            _faction_upgrades.set(faction_name, resp.data[0])
             return resp.data[0]
-        return {"power_bonus": 0, "hourly_bonus": 0.0, "attack_bonus": 0, "defense_bonus": 0}
+        return default_faction_upgrades()
     except Exception as e:
         print(f"Error in get_faction_upgrades: {e}")
-        return {"power_bonus": 0, "hourly_bonus": 0.0, "attack_bonus": 0, "defense_bonus": 0}
+        return default_faction_upgrades()
+
+
+async def get_many_faction_upgrades(faction_names):
+    """Returns {faction_name: upgrades}, fetching every uncached faction with a single in_() query."""
+    upgrades = {}
+    missing = []
+    for name in dict.fromkeys(faction_names):
+        ups = _faction_upgrades.get(name)
+        if ups is not None:
+            upgrades[name] = ups
+        else:
+            missing.append(name)
+    if missing:
+        try:
+            resp = await execute(supabase.table("factions").select(f"name, {FACTION_UPGRADE_COLUMNS}").in_("name", missing))
+            for row in resp.data or []:
+                name = row.pop("name")
+                _faction_upgrades.set(name, row)
+                upgrades[name] = row
+        except Exception as e:
+            print(f"Error in get_many_faction_upgrades: {e}")
+    for name in missing:
+        upgrades.setdefault(name, default_faction_upgrades())
+    return upgrades
 
 
 async def update_faction_upgrade(faction_name, upgrade_type, amount):
     try:
-        ups = await get_faction_upgrades(faction_name)
-        new_val = ups[upgrade_type] + amount
-        supabase.table("factions").update({upgrade_type: new_val}).eq("name", faction_name).execute()
+        # Compare-and-set against the row's version (db/cas.py), so concurrent upgrades all count.
+        result = await cas_update(
+            "factions", "name", faction_name, lambda row: {upgrade_type: row[upgrade_type] + amount}, upgrade_type
+        )
+        invalidate_faction_upgrades(faction_name)
+        if result is not None:
+            update_leaderboard(faction_name, **result.fields)
     except Exception as e:
         print(f"Error in update_faction_upgrade: {e}")
 
 
 async def get_faction_resources(faction_name):
     try:
-        resp = supabase.table("factions").select("resources").eq("name", faction_name).execute()
+        resp = await execute(supabase.table("factions").select("resources").eq("name", faction_name))
         if resp.data:
             return resp.data[0]["resources"]
         return 0
@@ -187,13 +292,28 @@ async def faction_has_enough_resources(faction_name, amount):
     return resources >= amount
 
 
-async def spend_faction_resources(faction_name, amount):
+async def spend_faction_resources(faction_name, amount, upgrade_type=None, upgrade_amount=0):
+    """
+    Takes amount from the faction's resources if it has enough, and optionally adds upgrade_amount to the
+    upgrade_type column in the same write. Returns False, with nothing changed, if it can't afford it.
+    """
+
+    def compute(row):
+        if row["resources"] < amount:
+            return None
+        fields = {"resources": row["resources"] - amount}
+        if upgrade_type is not None:
+            fields[upgrade_type] = row[upgrade_type] + upgrade_amount
+        return fields
+
     try:
-        current = await get_faction_resources(faction_name)
-        if current < amount:
+        columns = "resources" if upgrade_type is None else f"resources, {upgrade_type}"
+        result = await cas_update("factions", "name", faction_name, compute, columns)
+        if result is None or not result.applied:
             return False
-        new_amount = current - amount
-        supabase.table("factions").update({"resources": new_amount}).eq("name", faction_name).execute()
+        if upgrade_type is not None:
+            invalidate_faction_upgrades(faction_name)
+        update_leaderboard(faction_name, **result.fields)
         return True
     except Exception as e:
         print(f"Error in spend_faction_resources: {e}")
@@ -206,24 +326,28 @@ async def faction_income(user_id):
         if not faction_name:
             return "You are not in a faction."
 
-        resp = supabase.table("factions").select("resources, last_income_trigger").eq("name", faction_name).execute()
-        if not resp.data:
-            return "Faction not found?"
-        f_data = resp.data[0]
-        last_trigger = f_data.get("last_income_trigger")
-        now = datetime.now(timezone.utc)
-        if last_trigger:
-            lt = datetime.fromisoformat(last_trigger)
-            if (now - lt) < timedelta(days=1):
-                remaining = timedelta(days=1) - (now - lt)
-                hours = remaining.seconds // 3600
-                minutes = (remaining.seconds % 3600) // 60
-                return f"Wait {hours}h {minutes}m before using this again."
-
-        resources = f_data["resources"]
-        new_resources = int(resources * 1.05)
-        supabase.table("factions").update({"resources": new_resources, "last_income_trigger": now.isoformat()}).eq("name", faction_name).execute()
-        return f"Your faction's resources increased from {resources} to {new_resources}!"
+        remaining = FACTION_INCOME.remaining(faction_name)
+        if not remaining:
+            now = int(time.time())
+
+            # The cooldown is checked against the row being written, so two members can't both collect.
+            def compute(row):
+                if to_epoch(row.get("last_income_trigger")) + FACTION_INCOME.seconds > now:
+                    return None
+                return {"resources": int(row["resources"] * 1.05), "last_income_trigger": to_timestamp(now)}
+
+            result = await cas_update("factions", "name", faction_name, compute, "resources, last_income_trigger")
+            if result is None:
+                return "Faction not found?"
+            if result.applied:
+                FACTION_INCOME.start(faction_name, now)
+                resources, new_resources = result.row["resources"], result.fields["resources"]
+                update_leaderboard(faction_name, resources=new_resources, version=result.fields["version"])
+                return f"Your faction's resources increased from {resources} to {new_resources}!"
+            # Declined by the row: someone else collected since our in-memory expiry ran out. Take theirs.
+            remaining = FACTION_INCOME.load(faction_name, result.row.get("last_income_trigger"), now)
+        hours, minutes, _ = split_remaining(remaining)
+        return f"Wait {hours}h {minutes}m before using this again."
     except Exception as e:
         print(f"Error in faction_income: {e}")
         return "An error occured"
@@ -1,4 +1,8 @@
-from db.faction_db import faction_has_enough_resources, spend_faction_resources, update_faction_upgrade, is_leader
+from db.faction_db import (
+    faction_has_enough_resources,
+    spend_faction_resources,
+    is_leader,
+)
 from db.user_db import get_user_faction
 
 
@@ -24,9 +28,8 @@ async def purchase_faction_upgrade(user_id, upgrade: str):
     # Check and spend faction resources
     if not await faction_has_enough_resources(faction_name, cost):
         return "Your faction doesn't have enough resources."
-    success = await spend_faction_resources(faction_name, cost)
+    # One compare-and-set write pays for the upgrade and applies it.
+    success = await spend_faction_resources(faction_name, cost, col, increment)
     if not success:
         return "Failed to purchase upgrade due to resource error."
-
-    await update_faction_upgrade(faction_name, col, increment)
     return f"Successfully purchased {upgrade} upgrade for your faction!"
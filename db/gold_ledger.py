@@ -0,0 +1,252 @@
+"""
+Append-only gold ledger (db/sql/gold_ledger.sql).
+
+Every gold change is a signed delta with a reason code. A user's balance is the sum of their ledger,
+which is how rebuild_gold_balance recomputes it. users.gold is a materialized snapshot of that sum.
+
+There are two ways in:
+    add_user_gold(user_id, delta, reason)
+        For changes that need no balance check: hourly claims, raid loot, defeat resets. It is an append
+        to an in-process buffer, so there is no read and no round trip. Buffered deltas are inserted in one
+        batch every LEDGER_FLUSH_INTERVAL seconds. compact_gold_ledger, a background job, folds them into
+        users.gold every LEDGER_COMPACT_INTERVAL seconds.
+    db.user_db.transfer_gold(..., reason=...)
+        For changes that spend gold. The transfer_gold function checks the balance, including deltas that
+        are not compacted yet, and settles immediately.
+
+Until a delta is compacted, the user cache adds it to the users.gold it reads, so balances shown by this
+process are always current. Deltas from other processes show up after the next compaction.
+
+Failed inserts follow the BatchWriter policy (db/batch_writer.py): the rows are retried after an exponential
+backoff, one row per insert so a row the database rejects can't hold back everyone else's, and dropped
+after BATCH_MAX_RETRIES failures in a row. A dropped delta is taken out of the cached balance too.
+"""
+import asyncio
+import os
+from db.batch_writer import BATCH_MAX_RETRIES, BATCH_RETRY_DELAY, BATCH_MAX_BACKOFF
+from db.client import supabase, execute
+from db.coherence import publish, subscribe
+from db.user_cache import add_pending_gold, settle_pending_gold, clear_pending_gold, publish_user_change
+
+LEDGER_FLUSH_INTERVAL = float(os.environ.get("LEDGER_FLUSH_INTERVAL", "0.5"))
+LEDGER_COMPACT_INTERVAL = float(os.environ.get("LEDGER_COMPACT_INTERVAL", "60"))
+
+# Reason codes
+REASON_HOURLY_CLAIM = "hourly_claim"
+REASON_RAID_LOOT = "raid_loot"
+REASON_DEFEATED = "defeated"
+REASON_TRANSFER = "transfer"
+REASON_COINFLIP = "coinflip"
+REASON_DUEL_BET = "duel_bet"
+REASON_DUEL_PAYOUT = "duel_payout"
+REASON_DUEL_REFUND = "duel_refund"
+REASON_SHOP = "shop"
+REASON_SHOP_REFUND = "shop_refund"
+REASON_FACTION_DEPOSIT = "faction_deposit"
+
+# Deltas not yet inserted: {"user_id", "delta", "reason"}
+_buffer = []
+# (row, failed attempts in a row, loop time of the next attempt, last error) for deltas whose insert failed
+_retrying = []
+# user_id -> [future], one per insert in flight holding the user's deltas; each resolves to None or the error
+_in_flight = {}
+# ledger id -> (user_id, delta) for rows this process inserted that are not compacted yet
+_uncompacted = {}
+# Highest ledger id known to be folded into users.gold
+_compacted_through = 0
+_flush_task = None
+_compact_task = None
+_stats = {"appended": 0, "rows_inserted": 0, "batches": 0, "failures": 0, "dropped": 0, "compactions": 0, "rows_compacted": 0}
+
+
+def add_user_gold(user_id, delta, reason):
+    """
+    Credits (or, with a negative delta, debits) gold without checking the balance.
+    Sync, and must be called from inside the running loop.
+    """
+    delta = int(delta)
+    if not delta:
+        return
+    _buffer.append({"user_id": str(user_id), "delta": delta, "reason": reason})
+    add_pending_gold(user_id, delta)
+    _stats["appended"] += 1
+    _ensure_tasks()
+
+
+async def flush_gold_ledger(user_ids=None):
+    """
+    Inserts buffered deltas in one batch, plus any failed deltas whose backoff is over, one per insert.
+    With user_ids, only those users' deltas are sent, and it returns once every delta appended for them so
+    far is stored, including ones another flush already has in flight. It raises if one of them is not:
+    a balance check run now would miss it.
+    """
+    global _buffer, _retrying
+    if user_ids is None:
+        pending, _buffer = _buffer, []
+    else:
+        user_ids = {str(user_id) for user_id in user_ids}
+        pending = [row for row in _buffer if row["user_id"] in user_ids]
+        _buffer = [row for row in _buffer if row["user_id"] not in user_ids]
+    now = asyncio.get_running_loop().time()
+    due, backing_off = [], []
+    for entry in _retrying:
+        row, _, retry_at, _ = entry
+        (due if retry_at <= now and (user_ids is None or row["user_id"] in user_ids) else backing_off).append(entry)
+    _retrying = backing_off
+
+    waiting = [] if user_ids is None else [future for user_id in user_ids for future in _in_flight.get(user_id, [])]
+    batches = [[(row, attempts)] for row, attempts, _, _ in due]
+    if pending:
+        batches.append([(row, 0) for row in pending])
+    # Marked in flight before anything is awaited, so a concurrent flush for the same users waits for them.
+    waiting += [_insert(entries, _track(entries)) for entries in batches]
+    errors = await asyncio.gather(*waiting)
+    if user_ids is None:
+        return
+    for error in errors:
+        if error is not None:
+            raise error
+    for row, _, _, error in _retrying:
+        if row["user_id"] in user_ids:
+            raise error
+
+
+def _track(entries):
+    future = asyncio.get_running_loop().create_future()
+    for user_id in {row["user_id"] for row, _ in entries}:
+        _in_flight.setdefault(user_id, []).append(future)
+    return future
+
+
+async def _insert(entries, future):
+    """Inserts [(row, failed attempts so far)]. Returns None, or the error after queueing the rows for a retry."""
+    try:
+        response = await execute(supabase.table("gold_ledger").insert([row for row, _ in entries]))
+        error = None
+    except Exception as e:
+        print(f"Error in flush_gold_ledger: {e}")
+        error = e
+    for user_id in {row["user_id"] for row, _ in entries}:
+        futures = _in_flight.get(user_id, [])
+        if future in futures:
+            futures.remove(future)
+        if not futures:
+            _in_flight.pop(user_id, None)
+    future.set_result(error)
+
+    if error is not None:
+        _stats["failures"] += 1
+        now = asyncio.get_running_loop().time()
+        for row, attempts in entries:
+            attempts += 1
+            if attempts >= BATCH_MAX_RETRIES:
+                _stats["dropped"] += 1
+                # It will never be compacted, so the cached balance must stop counting it.
+                settle_pending_gold(row["user_id"], row["delta"])
+                print(f"gold_ledger dropped {row} after {attempts} failed attempts")
+                continue
+            delay = min(BATCH_RETRY_DELAY * 2 ** (attempts - 1), BATCH_MAX_BACKOFF)
+            _retrying.append((row, attempts, now + delay, error))
+        return error
+
+    _stats["batches"] += 1
+    _stats["rows_inserted"] += len(entries)
+    for row in response.data or []:
+        if row["id"] <= _compacted_through:
+            # Compacted while the insert response was on its way back.
+            settle_pending_gold(row["user_id"], row["delta"])
+        else:
+            _uncompacted[row["id"]] = (row["user_id"], row["delta"])
+    return None
+
+
+def _apply_compaction(cutoff):
+    global _compacted_through
+    _compacted_through = max(_compacted_through, cutoff)
+    for ledger_id in [ledger_id for ledger_id in _uncompacted if ledger_id <= cutoff]:
+        user_id, delta = _uncompacted.pop(ledger_id)
+        settle_pending_gold(user_id, delta)
+
+
+async def compact_gold_ledger():
+    """Folds every uncompacted ledger row into users.gold (one RPC) and tells other processes."""
+    try:
+        response = await execute(supabase.rpc("compact_gold_ledger", {}))
+        result = response.data or {}
+        cutoff = result.get("cutoff", 0)
+        user_ids = result.get("users", [])
+        _apply_compaction(cutoff)
+        _stats["compactions"] += 1
+        _stats["rows_compacted"] += result.get("rows", 0)
+        publish("gold_ledger", "compacted", cutoff)
+        publish_user_change(user_ids)
+    except Exception as e:
+        print(f"Error in compact_gold_ledger: {e}")
+
+
+subscribe("gold_ledger", lambda _, cutoff: _apply_compaction(int(cutoff)))
+
+
+async def rebuild_gold_balance(user_id):
+    """
+    Recomputes a balance from history alone: the sum of every ledger delta for the user,
+    compacted or not, including the opening_balance row written by the migration.
+    Raises if one of this process's deltas for the user could not be stored.
+    """
+    await flush_gold_ledger([user_id])
+    response = await execute(supabase.table("gold_ledger").select("delta").eq("user_id", user_id))
+    return sum(row["delta"] for row in response.data or [])
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+        await flush_gold_ledger()
+
+
+async def _compact_loop():
+    while True:
+        await asyncio.sleep(LEDGER_COMPACT_INTERVAL)
+        await flush_gold_ledger()
+        await compact_gold_ledger()
+
+
+def _ensure_tasks():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.get_running_loop().create_task(_flush_loop())
+
+
+def start_ledger_compaction():
+    """Starts the periodic compaction job. One process is enough; main.py runs it on the shard 0 process."""
+    global _compact_task
+    if LEDGER_COMPACT_INTERVAL > 0 and (_compact_task is None or _compact_task.done()):
+        _compact_task = asyncio.get_running_loop().create_task(_compact_loop())
+
+
+async def close_gold_ledger():
+    """Stops the background tasks and inserts everything still buffered. Call on shutdown."""
+    global _flush_task, _compact_task, _retrying
+    for task in (_flush_task, _compact_task):
+        if task is not None:
+            task.cancel()
+    _flush_task = _compact_task = None
+    # There is no later: deltas backing off get one last try now.
+    _retrying = [(row, attempts, 0, error) for row, attempts, _, error in _retrying]
+    await flush_gold_ledger()
+    await asyncio.gather(*{future for futures in _in_flight.values() for future in futures})
+
+
+def clear_gold_ledger():
+    """Forgets every buffered and uncompacted delta, e.g. after the backing store was reset."""
+    global _compacted_through
+    _buffer.clear()
+    _retrying.clear()
+    _in_flight.clear()
+    _uncompacted.clear()
+    _compacted_through = 0
+    clear_pending_gold()
+
+
+def gold_ledger_stats():
+    return {**_stats, "buffered": len(_buffer), "retrying": len(_retrying), "uncompacted": len(_uncompacted)}
@@ -0,0 +1,111 @@
+import bisect
+from db.client import supabase, execute
+from db.coherence import publish, subscribe
+
+LEADERBOARD_COLUMNS = "name, resources, power_bonus, hourly_bonus, attack_bonus, defense_bonus"
+
+# name -> faction row (the LEADERBOARD_COLUMNS only)
+_factions = {}
+# (-score, name) kept sorted, so the top K is always the first K entries
+_ranking = []
+# name -> {column: factions.version its value was read at}. Updates from different processes can arrive out
+# of order; a value older than the one shown for its column is ignored instead of rolling it back.
+_column_versions = {}
+_seeded = False
+
+
+def faction_score(faction):
+    """The one place the leaderboard score is defined."""
+    resources = faction.get("resources", 0) or 0
+    p_bonus = faction.get("power_bonus", 0) or 0
+    h_bonus = faction.get("hourly_bonus", 0.0) or 0.0
+    a_bonus = faction.get("attack_bonus", 0) or 0
+    d_bonus = faction.get("defense_bonus", 0) or 0
+    return resources + (p_bonus * 1000) + (h_bonus * 2000) + (a_bonus * 500) + (d_bonus * 500)
+
+
+def _rank_key(faction):
+    return (-faction_score(faction), faction["name"])
+
+
+def _insert(faction):
+    _factions[faction["name"]] = faction
+    bisect.insort(_ranking, _rank_key(faction))
+
+
+def _remove(name):
+    faction = _factions.pop(name, None)
+    if faction is None:
+        return None
+    key = _rank_key(faction)
+    index = bisect.bisect_left(_ranking, key)
+    if index < len(_ranking) and _ranking[index] == key:
+        del _ranking[index]
+    return faction
+
+
+async def seed_leaderboard():
+    """Loads every faction once. After this the index is kept current by the update_* hooks below."""
+    global _seeded
+    try:
+        resp = await execute(supabase.table("factions").select(f"{LEADERBOARD_COLUMNS}, version"))
+        _factions.clear()
+        _ranking.clear()
+        _column_versions.clear()
+        for row in resp.data or []:
+            row = dict(row)
+            version = row.pop("version")
+            _column_versions[row["name"]] = {column: version for column in row}
+            _insert(row)
+        _seeded = True
+    except Exception as e:
+        print(f"Error in seed_leaderboard: {e}")
+
+
+def _apply_update(faction_name, fields):
+    if not _seeded:
+        return
+    fields = dict(fields)
+    version = fields.pop("version", None)
+    if version is not None:
+        seen = _column_versions.setdefault(faction_name, {})
+        fields = {column: value for column, value in fields.items() if seen.get(column, -1) < version}
+        seen.update(dict.fromkeys(fields, version))
+    faction = _remove(faction_name) or {"name": faction_name}
+    faction.update(fields)
+    _insert(faction)
+
+
+def update_leaderboard(faction_name, **fields):
+    """
+    Records new absolute values for some of a faction's scored columns, as stored in the database.
+    Pass version (the row's version they were read at) whenever the write returned one.
+    """
+    _apply_update(faction_name, fields)
+    publish("leaderboard", faction_name, fields)
+
+
+def remove_from_leaderboard(faction_name):
+    if _seeded:
+        _remove(faction_name)
+        _column_versions.pop(faction_name, None)
+    publish("leaderboard", faction_name)
+
+
+def _on_remote_change(faction_name, fields):
+    # fields is None for a removed faction
+    if fields is None:
+        if _seeded:
+            _remove(faction_name)
+            _column_versions.pop(faction_name, None)
+    else:
+        _apply_update(faction_name, fields)
+
+
+subscribe("leaderboard", _on_remote_change)
+
+
+async def get_top_factions(limit=10):
+    if not _seeded:
+        await seed_leaderboard()
+    return [{**_factions[name], "score": -neg_score} for neg_score, name in _ranking[:limit]]
@@ -0,0 +1,80 @@
+"""
+Per-user asyncio locks for read-modify-write sequences on users rows.
+
+A command that reads a row, awaits something, then writes a value computed from what it read can lose an
+update to another command on the same user that ran in between: two /buy power calls both read power 10
+and both write 11. Holding lock_users(user_id) across the sequence serializes them, without a global lock
+that would serialize every command in the process.
+
+Locks are striped: a key maps to one of USER_LOCK_STRIPES locks by hash, so memory stays fixed however many
+users there are. Two users can share a stripe, which only costs a little unneeded waiting. Multi-user
+acquisitions take their stripes in ascending index order, so two commands locking the same users in any
+order cannot deadlock. The locks are not reentrant: functions that take them must not call each other.
+
+These only order commands inside one process. Gold moves are atomic in Postgres (transfer_gold), and
+processes split across shards still need database-side checks for anything else they share.
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+USER_LOCK_STRIPES = int(os.environ.get("USER_LOCK_STRIPES", "1024"))
+
+
+class StripedLocks:
+    def __init__(self, stripes):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def _stripes(self, keys):
+        return sorted({hash(key) % len(self._locks) for key in keys})
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        """Holds the locks for every key, acquired in a fixed order."""
+        held = []
+        try:
+            for index in self._stripes(keys):
+                lock = self._locks[index]
+                self.acquisitions += 1
+                if lock.locked():
+                    self.contended += 1
+                    start = time.perf_counter()
+                    await lock.acquire()
+                    waited = (time.perf_counter() - start) * 1000
+                    self.wait_ms += waited
+                    self.max_wait_ms = max(self.max_wait_ms, waited)
+                else:
+                    await lock.acquire()
+                held.append(lock)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    def stats(self):
+        return {
+            "stripes": len(self._locks),
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "contention_rate": self.contended / self.acquisitions if self.acquisitions else 0.0,
+            "wait_ms": self.wait_ms,
+            "max_wait_ms": self.max_wait_ms,
+            "held": sum(lock.locked() for lock in self._locks),
+        }
+
+
+_user_locks = StripedLocks(USER_LOCK_STRIPES)
+
+
+def lock_users(*user_ids):
+    """async with lock_users(a, b): ... holds both users' locks."""
+    return _user_locks.hold(*(str(user_id) for user_id in user_ids))
+
+
+def lock_stats():
+    return _user_locks.stats()
@@ -0,0 +1,590 @@
+"""
+In-memory stand-in for the supabase client, for running the db/ layer offline (benchmarks, load tests, local runs).
+
+It implements the subset of the query-builder API this repo uses:
+    client.table(name).select/insert/update/upsert/delete
+        .eq/.neq/.gt/.gte/.lt/.lte/.in_/.is_/.order/.limit/.range
+        .execute()
+    client.rpc(name, params).execute()
+including the one embedded relation we select (users -> factions), plus Python versions of the
+Postgres functions in db/sql/. Every execute() sleeps for the configured latency to mimic a round trip,
+and round trips and row counts are tallied per table so callers can see what a code path costs.
+
+Select it with DB_BACKEND=memory (see db/client.py). To give several processes one database, as shards
+split across processes have in production, one process calls serve_memory_backend() and the others set
+DB_MEMORY_ADDRESS to the address it returns; their queries then run against the serving process's tables.
+"""
+import copy
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from multiprocessing.managers import BaseManager
+from types import SimpleNamespace
+
+# Column defaults applied on insert, mirroring the Postgres schema. Callables are evaluated per row, like now().
+TABLE_DEFAULTS = {
+    "users": {
+        "class": None,
+        "faction": None,
+        "gold": 0,
+        "health": 100,
+        "max_health": 100,
+        "power": 0,
+        "raid_wins": 0,
+        "hourly_multiplier": 1.0,
+        "last_hourly_claim": "1970-01-01T00:00:00+00:00",
+        "last_heal": None,
+        "version": 0,
+    },
+    "factions": {
+        "leader_id": None,
+        "resources": 0,
+        "power_bonus": 0,
+        "hourly_bonus": 0.0,
+        "attack_bonus": 0,
+        "defense_bonus": 0,
+        "last_income_trigger": None,
+        "version": 0,
+    },
+    "faction_members": {"role": "member"},
+    "raids": {"active": True},
+    "raid_participants": {"ready": False, "damage_dealt": 0},
+    "raid_invitations": {},
+    "boss_cooldowns": {},
+    "cache_invalidations": {"value": None, "created_at": lambda: datetime.now(timezone.utc).isoformat()},
+    "gold_ledger": {"compacted": False},
+}
+
+# Primary keys, used as the default upsert conflict target.
+PRIMARY_KEYS = {
+    "users": ("id",),
+    "factions": ("name",),
+    "raid_participants": ("raid_id", "user_id"),
+    "boss_cooldowns": ("user_id", "boss"),
+}
+
+# Tables whose "id" is a generated serial.
+SERIAL_TABLES = {"raids", "raid_invitations", "faction_members", "cache_invalidations", "gold_ledger"}
+
+# Tables whose "version" goes up on every update (the trigger in db/sql/row_versions.sql).
+VERSIONED_TABLES = {"users", "factions"}
+
+# Text columns holding Discord user ids. Postgres casts a value to its column's type, so an int id written
+# or filtered on means the same user as its str form; the same cast is applied here.
+USER_ID_COLUMNS = {
+    "users": {"id"},
+    "factions": {"leader_id"},
+    "faction_members": {"user_id"},
+    "raids": {"leader_id"},
+    "raid_participants": {"user_id"},
+    "raid_invitations": {"user_id"},
+    "boss_cooldowns": {"user_id"},
+    "gold_ledger": {"user_id"},
+}
+
+# (table, embedded table) -> (local column, remote column) for many-to-one embeds like "factions(...)".
+FOREIGN_KEYS = {
+    ("users", "factions"): ("faction", "name"),
+}
+
+
+def _cast(table, column, value):
+    if value is None or column not in USER_ID_COLUMNS.get(table, ()):
+        return value
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return str(value)
+
+
+def _cast_row(table, row):
+    return {column: _cast(table, column, value) for column, value in row.items()}
+
+
+class MemoryResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _split_columns(columns):
+    """Splits a PostgREST select list on top-level commas, keeping "rel(a, b)" together."""
+    parts, depth, current = [], 0, ""
+    for ch in columns:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "in": lambda a, b: a in b,
+    "is": lambda a, b: a is b,
+}
+
+
+class MemoryQuery:
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._method = "GET"
+        self._columns = "*"
+        self._payload = None
+        self._upsert = False
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._params = []
+        # Same shape as postgrest's RequestConfig so tooling can introspect either backend.
+        self.request = SimpleNamespace(path=f"/rest/v1/{table}", http_method="GET", params=self._params)
+
+    def _set_method(self, method):
+        self._method = method
+        self.request.http_method = method
+
+    # Verbs
+
+    def select(self, columns="*", count=None):
+        self._columns = columns
+        self._params.append(("select", columns))
+        return self
+
+    def insert(self, rows):
+        self._set_method("POST")
+        self._payload = rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self._set_method("POST")
+        self._payload = rows
+        self._upsert = True
+        self._on_conflict = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else None
+        self._ignore_duplicates = ignore_duplicates
+        self._params.append(("on_conflict", on_conflict or ""))
+        return self
+
+    def update(self, fields):
+        self._set_method("PATCH")
+        self._payload = fields
+        return self
+
+    def delete(self):
+        self._set_method("DELETE")
+        return self
+
+    # Filters and modifiers
+
+    def _filter(self, op, column, value, rendered):
+        self._filters.append((op, column, value))
+        self._params.append((column, f"{op}.{rendered}"))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value, value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self._filter("in", column, values, "(" + ",".join(str(v) for v in values) + ")")
+
+    def is_(self, column, value):
+        return self._filter("is", column, None if value in (None, "null") else value, value)
+
+    def order(self, column, desc=False):
+        self._order.append((column, desc))
+        self._params.append(("order", f"{column}.{'desc' if desc else 'asc'}"))
+        return self
+
+    def limit(self, size):
+        self._limit = size
+        self._params.append(("limit", size))
+        return self
+
+    def range(self, start, end):
+        self._offset = start
+        self._limit = end - start + 1
+        self._params.append(("offset", start))
+        self._params.append(("limit", self._limit))
+        return self
+
+    def execute(self):
+        return self._client._run(self)
+
+    # Evaluation, called by MemoryClient under its lock
+
+    def _matches(self, row):
+        return all(_OPERATORS[op](row.get(column), value) for op, column, value in self._filters)
+
+    def _project(self, row):
+        out = {}
+        for part in _split_columns(self._columns):
+            if part == "*":
+                out.update(row)
+            elif "(" in part:
+                embed, inner = part[:-1].split("(", 1)
+                embed = embed.strip()
+                local, remote = FOREIGN_KEYS[(self._table, embed)]
+                match = next((r for r in self._client._tables.get(embed, []) if r.get(remote) == row.get(local)), None)
+                if match is None:
+                    out[embed] = None
+                else:
+                    sub = MemoryQuery(self._client, embed)
+                    sub._columns = inner
+                    out[embed] = sub._project(match)
+            else:
+                out[part] = row.get(part)
+        return out
+
+
+class MemoryRpc:
+    def __init__(self, client, name, params):
+        self._client = client
+        self._name = name
+        self._params = params or {}
+        self.request = SimpleNamespace(path=f"/rest/v1/rpc/{name}", http_method="POST", params=[])
+
+    def execute(self):
+        return self._client._run_rpc(self)
+
+
+class MemoryClient:
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self._tables = {}
+        self._serials = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    # Client API
+
+    def table(self, name):
+        return MemoryQuery(self, name)
+
+    def rpc(self, name, params=None):
+        return MemoryRpc(self, name, params)
+
+    # Helpers for tests and benchmarks
+
+    def seed(self, table, rows):
+        with self._lock:
+            for row in rows:
+                self._insert_row(table, row)
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._serials.clear()
+
+    def rows(self, table):
+        with self._lock:
+            return copy.deepcopy(self._tables.get(table, []))
+
+    def reset_stats(self):
+        self.calls = 0
+        self.rows_read = 0
+        self.rows_written = 0
+        self.calls_by_table = {}
+
+    def stats(self):
+        return {"calls": self.calls, "rows_read": self.rows_read, "rows_written": self.rows_written, "calls_by_table": dict(self.calls_by_table)}
+
+    # Internals
+
+    def _sleep(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def _count(self, table, read=0, written=0):
+        self.calls += 1
+        self.rows_read += read
+        self.rows_written += written
+        self.calls_by_table[table] = self.calls_by_table.get(table, 0) + 1
+
+    def _insert_row(self, table, row):
+        defaults = {column: value() if callable(value) else value for column, value in TABLE_DEFAULTS.get(table, {}).items()}
+        row = {**defaults, **_cast_row(table, copy.deepcopy(row))}
+        if table in SERIAL_TABLES and row.get("id") is None:
+            counter = self._serials.setdefault(table, itertools.count(1))
+            row["id"] = next(counter)
+        self._tables.setdefault(table, []).append(row)
+        return row
+
+    def _run(self, query):
+        self._sleep()
+        with self._lock:
+            table = query._table
+            rows = self._tables.setdefault(table, [])
+            query._filters = [(op, column, _cast(table, column, value)) for op, column, value in query._filters]
+
+            if query._method == "GET":
+                result = [r for r in rows if query._matches(r)]
+                for column, desc in reversed(query._order):
+                    result.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+                end = None if query._limit is None else query._offset + query._limit
+                result = [query._project(r) for r in result[query._offset : end]]
+                self._count(table, read=len(result))
+                return MemoryResponse(copy.deepcopy(result), len(result))
+
+            if query._method == "PATCH":
+                changes = _cast_row(table, query._payload)
+                result = []
+                for r in rows:
+                    if query._matches(r):
+                        _update_row(table, r, changes)
+                        result.append(r)
+                self._count(table, written=len(result))
+                return MemoryResponse(copy.deepcopy(result))
+
+            if query._method == "DELETE":
+                result = [r for r in rows if query._matches(r)]
+                self._tables[table] = [r for r in rows if not query._matches(r)]
+                self._count(table, written=len(result))
+                return MemoryResponse(copy.deepcopy(result))
+
+            # POST: insert or upsert
+            payload = query._payload if isinstance(query._payload, list) else [query._payload]
+            payload = [_cast_row(table, new) for new in payload]
+            result = []
+            for new in payload:
+                if query._upsert:
+                    key = query._on_conflict or PRIMARY_KEYS.get(table, ("id",))
+                    existing = next((r for r in rows if all(r.get(k) == new.get(k) for k in key)), None)
+                    if existing is not None:
+                        if not query._ignore_duplicates:
+                            _update_row(table, existing, new)
+                            result.append(existing)
+                        continue
+                else:
+                    key = PRIMARY_KEYS.get(table, ("id",))
+                    if all(new.get(k) is not None for k in key) and any(all(r.get(k) == new.get(k) for k in key) for r in rows):
+                        raise ValueError(f"duplicate key value violates unique constraint on {table} {key}")
+                result.append(self._insert_row(table, new))
+            self._count(table, written=len(result))
+            return MemoryResponse(copy.deepcopy(result))
+
+    def _run_rpc(self, rpc):
+        self._sleep()
+        with self._lock:
+            fn = RPCS.get(rpc._name)
+            if fn is None:
+                raise ValueError(f"unknown function {rpc._name}")
+            self._count(f"rpc/{rpc._name}")
+            # Parameters go over the wire as JSON, as with PostgREST: jsonb object keys arrive as text.
+            return MemoryResponse(fn(self, **json.loads(json.dumps(rpc._params))))
+
+
+class SharedMemoryBackend:
+    """Runs queries built in another process against one MemoryClient. Served by serve_memory_backend()."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def run_query(self, state):
+        query = MemoryQuery.__new__(MemoryQuery)
+        query.__dict__.update(state)
+        query._client = self.client
+        return self.client._run(query)
+
+    def run_rpc(self, name, params):
+        return self.client._run_rpc(MemoryRpc(self.client, name, params))
+
+    def seed(self, table, rows):
+        self.client.seed(table, rows)
+
+    def clear(self):
+        self.client.clear()
+
+    def rows(self, table):
+        return self.client.rows(table)
+
+    def reset_stats(self):
+        self.client.reset_stats()
+
+    def stats(self):
+        return self.client.stats()
+
+
+class _BackendManager(BaseManager):
+    pass
+
+
+_BackendManager.register("backend")
+
+# Only processes started by the same program talk to the server; this just keeps strays off the port.
+MEMORY_AUTHKEY = b"dyne-bot-memory"
+
+
+def serve_memory_backend(client=None, address=("127.0.0.1", 0)):
+    """
+    Serves client (a new MemoryClient by default) to other processes from a background thread of this one.
+    Returns (address as "host:port", client). Each connecting thread gets its own server thread, and the
+    client's lock orders their queries, as row locks would in Postgres.
+    """
+    client = client or MemoryClient()
+    backend = SharedMemoryBackend(client)
+
+    class Manager(BaseManager):
+        pass
+
+    Manager.register("backend", callable=lambda: backend)
+    server = Manager(address=address, authkey=MEMORY_AUTHKEY).get_server()
+    threading.Thread(target=server.serve_forever, name="memory-backend", daemon=True).start()
+    host, port = server.address
+    return f"{host}:{port}", client
+
+
+class RemoteMemoryClient(MemoryClient):
+    """
+    A MemoryClient whose tables live in the process serving address (see serve_memory_backend).
+    Queries are built locally and shipped whole; the simulated latency is spent here, not on the server.
+    """
+
+    def __init__(self, address, latency=0.0, jitter=0.0):
+        super().__init__(latency, jitter)
+        host, port = address.rsplit(":", 1)
+        manager = _BackendManager(address=(host, int(port)), authkey=MEMORY_AUTHKEY)
+        manager.connect()
+        self._backend = manager.backend()
+
+    def seed(self, table, rows):
+        self._backend.seed(table, rows)
+
+    def clear(self):
+        self._backend.clear()
+
+    def rows(self, table):
+        return self._backend.rows(table)
+
+    def reset_stats(self):
+        if hasattr(self, "_backend"):
+            self._backend.reset_stats()
+
+    def stats(self):
+        return self._backend.stats()
+
+    def _run(self, query):
+        self._sleep()
+        return self._backend.run_query({name: value for name, value in vars(query).items() if name != "_client"})
+
+    def _run_rpc(self, rpc):
+        self._sleep()
+        return self._backend.run_rpc(rpc._name, rpc._params)
+
+
+def _update_row(table, row, changes):
+    """row.update(changes), plus the version bump the Postgres trigger does."""
+    version = row.get("version")
+    row.update(copy.deepcopy(changes))
+    if table in VERSIONED_TABLES and row.get("version") == version:
+        row["version"] = (version or 0) + 1
+
+
+def _uncompacted_gold(client):
+    pending = {}
+    for row in client._tables.get("gold_ledger", []):
+        if not row["compacted"]:
+            pending[row["user_id"]] = pending.get(row["user_id"], 0) + row["delta"]
+    return pending
+
+
+def _transfer_gold(client, p_debits=None, p_credits=None, p_faction=None, p_faction_credit=0, p_reason="transfer"):
+    """Python twin of db/sql/transfer_gold.sql."""
+    debits = p_debits or {}
+    credits = p_credits or {}
+    if any(v < 0 for v in debits.values()) or any(v < 0 for v in credits.values()) or p_faction_credit < 0:
+        return None
+    users = {r["id"]: r for r in client._tables.get("users", [])}
+    pending = _uncompacted_gold(client)
+    if any(user_id not in users or users[user_id]["gold"] + pending.get(user_id, 0) < amount for user_id, amount in debits.items()):
+        return None
+    faction_result = None
+    if p_faction is not None:
+        faction = next((r for r in client._tables.get("factions", []) if r["name"] == p_faction), None)
+        if faction is None:
+            return None
+        _update_row("factions", faction, {"resources": faction["resources"] + p_faction_credit})
+        faction_result = {"resources": faction["resources"], "version": faction["version"]}
+    touched = set(debits) | set(credits)
+    for user_id in sorted(touched):
+        delta = credits.get(user_id, 0) - debits.get(user_id, 0)
+        if user_id in users:
+            _update_row("users", users[user_id], {"gold": users[user_id]["gold"] + delta})
+            if delta:
+                client._insert_row("gold_ledger", {"user_id": user_id, "delta": delta, "reason": p_reason, "compacted": True})
+    return {
+        "users": {
+            user_id: {"gold": users[user_id]["gold"] + pending.get(user_id, 0), "version": users[user_id]["version"]}
+            for user_id in touched
+            if user_id in users
+        },
+        "faction": faction_result,
+    }
+
+
+def _increment_raid_wins(client, p_ids):
+    """Python twin of db/sql/increment_raid_wins.sql."""
+    ids = set(p_ids)
+    result = {}
+    for row in client._tables.get("users", []):
+        if row["id"] in ids:
+            _update_row("users", row, {"raid_wins": row["raid_wins"] + 1})
+            result[row["id"]] = {"raid_wins": row["raid_wins"], "version": row["version"]}
+    return result
+
+
+def _compact_gold_ledger(client):
+    """Python twin of compact_gold_ledger() in db/sql/gold_ledger.sql."""
+    ledger = client._tables.get("gold_ledger", [])
+    rows = [row for row in ledger if not row["compacted"]]
+    if not rows:
+        return {"cutoff": max((row["id"] for row in ledger), default=0), "users": [], "rows": 0}
+    users = {r["id"]: r for r in client._tables.get("users", [])}
+    touched = set()
+    for row in rows:
+        row["compacted"] = True
+        if row["user_id"] in users:
+            _update_row("users", users[row["user_id"]], {"gold": users[row["user_id"]]["gold"] + row["delta"]})
+            touched.add(row["user_id"])
+    return {"cutoff": max(row["id"] for row in rows), "users": sorted(touched), "rows": len(rows)}
+
+
+RPCS = {
+    "transfer_gold": _transfer_gold,
+    "compact_gold_ledger": _compact_gold_ledger,
+    "increment_raid_wins": _increment_raid_wins,
+}
@@ -0,0 +1,33 @@
+from data.classes import classes, attack_mod
+from data.duel_sim import simulate_duel, DEFAULT_ROUNDS
+from db.user_db import get_user_snapshots, calc_final_attack, calc_final_defense
+
+
+async def get_duel_odds(user_id, opponent_id, rounds=DEFAULT_ROUNDS):
+    """
+    Loads both fighters (one batch, usually served from cache) and simulates the duel.
+    Returns (odds_dict, None) or (None, error_message).
+    """
+    players = await get_user_snapshots([user_id, opponent_id])
+    user = players[user_id]
+    opponent = players[opponent_id]
+
+    if user.user_class not in classes or opponent.user_class not in classes:
+        return None, "One or both users do not have a class. Set a class using /select_class."
+    if user.health <= 0:
+        return None, f"<@{user_id}> is too weak to fight! Heal up before dueling again."
+    if opponent.health <= 0:
+        return None, f"<@{opponent_id}> is too weak to fight! They're out of commission."
+
+    odds = simulate_duel(
+        calc_final_attack(user),
+        calc_final_defense(user),
+        user.health,
+        attack_mod(user.user_class, opponent.user_class),
+        calc_final_attack(opponent),
+        calc_final_defense(opponent),
+        opponent.health,
+        attack_mod(opponent.user_class, user.user_class),
+        rounds=rounds,
+    )
+    return odds, None
@@ -1,8 +1,14 @@
-from db.user_db import get_user_balance, update_user_gold, get_user_power, update_user_max_health
-from db.client import supabase
+from db.user_db import get_user_balance, spend_gold, increment_user_fields
+from db.gold_ledger import add_user_gold, REASON_SHOP, REASON_SHOP_REFUND
+from db.locks import lock_users
 
 
 async def buy_hourly_upgrade(user_id, amount):
+    async with lock_users(user_id):
+        return await _buy_hourly_upgrade(user_id, amount)
+
+
+async def _buy_hourly_upgrade(user_id, amount):
     if amount <= 0:
         return "Invalid amount."
     cost_per = 500
@@ -10,9 +16,11 @@ async def buy_hourly_upgrade(user_id, amount):
     current_gold = await get_user_balance(user_id)
     if current_gold < total_cost:
         return "You don't have enough gold."
-    resp = supabase.table("users").select("hourly_multiplier").eq("id", user_id).execute()
-    current_multi = resp.data[0]["hourly_multiplier"]
-    new_multi = current_multi + (0.1 * amount)
-    await update_user_gold(user_id, current_gold - total_cost)
-    supabase.table("users").update({"hourly_multiplier": new_multi}).eq("id", user_id).execute()
-    return f"Your hourly gold claim multiplier is now {new_multi:.2f}!"
+    if not await spend_gold(user_id, total_cost, REASON_SHOP):
+        return "You don't have enough gold."
+    updated = await increment_user_fields(user_id, {"hourly_multiplier": 0.1 * amount})
+    if updated is None:
+        # The gold is already spent; give it back rather than charge for nothing.
+        add_user_gold(user_id, total_cost, REASON_SHOP_REFUND)
+        return "An error occurred while applying your upgrade. Your gold has been refunded."
+    return f"Your hourly gold claim multiplier is now {updated['hourly_multiplier']:.2f}!"
@@ -0,0 +1,3 @@
+-- Unique keys that the bulk upserts in db/raid_db.py use as their on_conflict targets.
+create unique index if not exists raid_participants_raid_id_user_id_key on raid_participants (raid_id, user_id);
+create unique index if not exists boss_cooldowns_user_id_boss_key on boss_cooldowns (user_id, boss);
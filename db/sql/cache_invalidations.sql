@@ -0,0 +1,17 @@
+-- Channel for db/coherence.py's TablePollBus (CACHE_COHERENCE=table).
+-- Each bot process inserts the cache keys it changed and polls for rows from other processes.
+create table if not exists cache_invalidations (
+    id bigserial primary key,
+    channel text not null,
+    key text not null,
+    value jsonb,
+    origin text not null,
+    created_at timestamptz not null default now()
+);
+
+-- Readers poll by created_at with an overlap window (COHERENCE_POLL_OVERLAP) rather than by id: ids are
+-- assigned at insert but rows appear at commit, so a lower id can become visible after a higher one.
+-- Readers only ever look at recent rows; prune the rest periodically, e.g. from pg_cron:
+--   select cron.schedule('prune-cache-invalidations', '*/10 * * * *',
+--       $$delete from cache_invalidations where created_at < now() - interval '10 minutes'$$);
+create index if not exists cache_invalidations_created_at_idx on cache_invalidations (created_at);
@@ -0,0 +1,65 @@
+-- Append-only gold ledger used by db/gold_ledger.py.
+--
+-- Every change to a user's gold is a row with a signed delta and a reason code. users.gold is a snapshot:
+-- the sum of the user's compacted rows. Rows appended by add_user_gold start uncompacted, and
+-- compact_gold_ledger() below folds them into users.gold. transfer_gold (transfer_gold.sql) applies its
+-- change to users.gold directly, so its rows are written already compacted.
+--
+-- A balance can always be rebuilt from history:
+--   select sum(delta) from gold_ledger where user_id = '...';
+create table if not exists gold_ledger (
+    id bigserial primary key,
+    user_id text not null references users(id),
+    delta bigint not null,
+    reason text not null,
+    compacted boolean not null default false,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists gold_ledger_user_id_idx on gold_ledger (user_id);
+create index if not exists gold_ledger_uncompacted_idx on gold_ledger (user_id) where not compacted;
+
+-- Opening balances, so the ledger sums to users.gold for users that existed before it. Run once.
+insert into gold_ledger (user_id, delta, reason, compacted)
+select id, gold, 'opening_balance', true
+from users
+where gold <> 0
+    and not exists (select 1 from gold_ledger l where l.user_id = users.id and l.reason = 'opening_balance');
+
+-- Folds every uncompacted row into users.gold in one transaction.
+-- Returns {"cutoff": highest ledger id folded in, "users": [ids whose balance changed], "rows": n}.
+--
+-- Called from db/gold_ledger.py:compact_gold_ledger via supabase.rpc("compact_gold_ledger", {}).
+create or replace function compact_gold_ledger() returns jsonb
+language plpgsql
+as $$
+declare
+    v_cutoff bigint;
+    v_rows bigint;
+    v_users jsonb;
+begin
+    select max(id) into v_cutoff from gold_ledger where not compacted;
+    if v_cutoff is null then
+        select coalesce(max(id), 0) into v_cutoff from gold_ledger;
+        return jsonb_build_object('cutoff', v_cutoff, 'users', '[]'::jsonb, 'rows', 0);
+    end if;
+
+    with folded as (
+        update gold_ledger
+        set compacted = true
+        where not compacted and id <= v_cutoff
+        returning user_id, delta
+    ), sums as (
+        select user_id, sum(delta) as delta, count(*) as n from folded group by user_id
+    ), applied as (
+        update users u
+        set gold = u.gold + s.delta
+        from sums s
+        where u.id = s.user_id
+        returning u.id, s.n
+    )
+    select coalesce(jsonb_agg(id order by id), '[]'::jsonb), coalesce(sum(n), 0) into v_users, v_rows from applied;
+
+    return jsonb_build_object('cutoff', v_cutoff, 'users', v_users, 'rows', v_rows);
+end;
+$$;
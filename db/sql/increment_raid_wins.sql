@@ -0,0 +1,25 @@
+-- Adds one raid win to every user in p_ids with a single statement, so settling a won raid costs one
+-- round trip whatever the party size. The increment happens in the database, so wins credited by other
+-- processes at the same time are never lost.
+-- Returns a map of user id -> {"raid_wins": new count, "version": row version} for every user updated.
+--
+-- Called from db/user_db.py:increment_raid_wins via supabase.rpc("increment_raid_wins", ...).
+create or replace function increment_raid_wins(p_ids text[]) returns jsonb
+language plpgsql
+as $$
+declare
+    v_result jsonb;
+begin
+    -- Lock rows in id order so this and transfer_gold cannot deadlock over the same users.
+    perform 1 from users where id = any(p_ids) order by id for update;
+
+    with updated as (
+        update users set raid_wins = raid_wins + 1 where id = any(p_ids)
+        returning id, raid_wins, version
+    )
+    select coalesce(jsonb_object_agg(id, jsonb_build_object('raid_wins', raid_wins, 'version', version)), '{}'::jsonb)
+    into v_result
+    from updated;
+    return v_result;
+end;
+$$;
@@ -0,0 +1,27 @@
+-- Version columns for optimistic concurrency (db/cas.py) on users and factions.
+--
+-- cas_update writes `... set version = <read> + 1 where version = <read>`, and no row matches if the row
+-- changed since it was read. Every other update (bulk upserts from the users write-behind, transfer_gold,
+-- compact_gold_ledger, ...) must move the version too, so a trigger bumps it whenever a statement leaves
+-- it unchanged.
+alter table users add column if not exists version bigint not null default 0;
+alter table factions add column if not exists version bigint not null default 0;
+
+create or replace function bump_row_version() returns trigger
+language plpgsql
+as $$
+begin
+    if new.version is not distinct from old.version then
+        new.version := old.version + 1;
+    end if;
+    return new;
+end;
+$$;
+
+drop trigger if exists users_bump_version on users;
+create trigger users_bump_version before update on users
+    for each row execute function bump_row_version();
+
+drop trigger if exists factions_bump_version on factions;
+create trigger factions_bump_version before update on factions
+    for each row execute function bump_row_version();
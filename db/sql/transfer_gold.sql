@@ -0,0 +1,76 @@
+-- Moves gold between users, and optionally into a faction's resources, in one transaction.
+--
+-- p_debits and p_credits map user id -> amount (non-negative). Debits are checked against the
+-- balance before anything is applied: if any debited user is missing or short, or an amount is
+-- negative, or p_faction does not exist, nothing changes and the function returns null.
+-- Otherwise it returns {"users": {user id: {"gold": new balance, "version": row version}} for every user
+-- touched, "faction": {"resources": new resources, "version": row version} or null}. Callers running several
+-- transfers at once use the versions to tell which answer is newest.
+--
+-- A balance is users.gold plus the user's uncompacted gold_ledger rows (gold_ledger.sql). Each user's
+-- net change is applied to users.gold and recorded as an already-compacted ledger row with p_reason.
+--
+-- Called from db/user_db.py:transfer_gold via supabase.rpc("transfer_gold", ...).
+create or replace function transfer_gold(
+    p_debits jsonb default '{}'::jsonb,
+    p_credits jsonb default '{}'::jsonb,
+    p_faction text default null,
+    p_faction_credit bigint default 0,
+    p_reason text default 'transfer'
+) returns jsonb
+language plpgsql
+as $$
+declare
+    v_ids text[];
+    v_result jsonb;
+    v_faction jsonb;
+begin
+    if exists (select 1 from jsonb_each_text(p_debits) d where d.value::bigint < 0)
+        or exists (select 1 from jsonb_each_text(p_credits) c where c.value::bigint < 0)
+        or p_faction_credit < 0 then
+        return null;
+    end if;
+
+    select array_agg(k order by k) into v_ids
+    from (select jsonb_object_keys(p_debits) as k union select jsonb_object_keys(p_credits)) keys;
+
+    -- Lock rows in id order so two transfers over the same users cannot deadlock.
+    perform 1 from users where id = any(v_ids) order by id for update;
+
+    if exists (
+        select 1
+        from jsonb_each_text(p_debits) d
+        left join users u on u.id = d.key
+        where u.id is null
+            or u.gold + (select coalesce(sum(l.delta), 0) from gold_ledger l where l.user_id = u.id and not l.compacted)
+                < d.value::bigint
+    ) then
+        return null;
+    end if;
+
+    if p_faction is not null then
+        perform 1 from factions where name = p_faction for update;
+        if not found then
+            return null;
+        end if;
+        update factions set resources = resources + p_faction_credit where name = p_faction
+        returning jsonb_build_object('resources', resources, 'version', version) into v_faction;
+    end if;
+
+    update users u
+    set gold = u.gold - coalesce((p_debits ->> u.id)::bigint, 0) + coalesce((p_credits ->> u.id)::bigint, 0)
+    where u.id = any(v_ids);
+
+    insert into gold_ledger (user_id, delta, reason, compacted)
+    select k, coalesce((p_credits ->> k)::bigint, 0) - coalesce((p_debits ->> k)::bigint, 0), p_reason, true
+    from unnest(v_ids) k
+    where coalesce((p_credits ->> k)::bigint, 0) <> coalesce((p_debits ->> k)::bigint, 0);
+
+    select coalesce(jsonb_object_agg(u.id, jsonb_build_object(
+        'gold', u.gold + (select coalesce(sum(l.delta), 0) from gold_ledger l where l.user_id = u.id and not l.compacted),
+        'version', u.version
+    )), '{}'::jsonb) into v_result
+    from users u where u.id = any(v_ids);
+    return jsonb_build_object('users', v_result, 'faction', v_faction);
+end;
+$$;
@@ -0,0 +1,14 @@
+-- Foreign key from users.faction to factions.name.
+--
+-- PostgREST only embeds relations it can see as foreign keys, so the single-request snapshot in
+-- db/user_db.py (USER_SNAPSHOT_COLUMNS = "*, factions(...)") depends on this constraint.
+-- Users still pointing at a faction that no longer exists are detached first, or the constraint can't be added.
+update users set faction = null
+where faction is not null and not exists (select 1 from factions f where f.name = users.faction);
+
+alter table users drop constraint if exists users_faction_fkey;
+alter table users add constraint users_faction_fkey
+    foreign key (faction) references factions (name) on update cascade on delete set null;
+
+-- Postgres doesn't index the referencing column; members are looked up by faction (get_faction_members).
+create index if not exists users_faction_idx on users (faction);
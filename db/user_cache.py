@@ -0,0 +1,196 @@
+import os
+from db.client import supabase, execute, drop_inflight_reads
+from db.cache import TTLCache
+from db.batch_writer import BatchWriter
+from db.coherence import publish, subscribe
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+# Seconds a batch of users writes stays open for more updates before it is sent (see db/batch_writer.py).
+USER_FLUSH_INTERVAL = float(os.environ.get("USER_FLUSH_INTERVAL", "0.05"))
+
+# Every map here is keyed by str(user_id), as stored in users.id. Commands hold Discord ids as ints, and an
+# int key would be a second entry for the same user that writes to the str one never reach.
+_rows = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+# user_id -> sum of gold deltas this process appended to the ledger (db/gold_ledger.py) that are not yet
+# folded into users.gold. Cached rows already include them; rows fetched from Supabase get them added.
+_gold_pending = {}
+# Bumped on every local write or remote change to a user; a fetch that raced one is not cached.
+# Striped by user id like db/locks.py, so busy users elsewhere don't keep every fetch out of the cache.
+_generations = [0] * int(os.environ.get("USER_CACHE_GENERATION_STRIPES", "1024"))
+
+
+def _stripe(user_id):
+    return hash(str(user_id)) % len(_generations)
+
+
+def _bump_generation(user_id):
+    _generations[_stripe(user_id)] += 1
+
+
+def publish_user_change(user_ids):
+    """Tells other processes their cached rows for user_ids are stale (see db/coherence.py)."""
+    for user_id in user_ids:
+        publish("users", str(user_id))
+
+
+# Column updates not yet sent to Supabase.
+_writer = BatchWriter("users", window=USER_FLUSH_INTERVAL, on_flushed=publish_user_change)
+
+
+def _overlay(row):
+    """Applies this process's not-yet-stored changes to a row fresh from Supabase."""
+    row.update(_writer.pending(row["id"]))
+    pending = _gold_pending.get(row["id"])
+    if pending:
+        row["gold"] = (row.get("gold") or 0) + pending
+    return row
+
+
+def user_cache_generation(user_id):
+    """Take this before sending a query whose users row will go to put_user_row."""
+    return _generations[_stripe(user_id)]
+
+
+def put_user_row(row, generation):
+    """
+    Caches a full users row that was fetched by some other query, unless the cache changed since generation
+    (from user_cache_generation(user_id)) was taken: the row may then predate a write. Returns the row either way.
+    """
+    row = _overlay(dict(row))
+    row["id"] = str(row["id"])
+    if generation == user_cache_generation(row["id"]):
+        _rows.set(row["id"], row)
+    return row
+
+
+def get_cached_user_row(user_id):
+    """Returns the cached row for user_id, or None on a miss. Never touches the database."""
+    return _rows.get(str(user_id))
+
+
+async def get_user_row(user_id):
+    """
+    Returns the full users row for user_id, or None if the user does not exist.
+    Pending local writes are always reflected in the returned row.
+    """
+    user_id = str(user_id)
+    row = _rows.get(user_id)
+    if row is not None:
+        return row
+
+    generation = user_cache_generation(user_id)
+    response = await execute(supabase.table("users").select("*").eq("id", user_id))
+    if not response.data:
+        return None
+    return put_user_row(response.data[0], generation)
+
+
+async def get_user_rows(user_ids):
+    """
+    Returns {user_id: row} for every user in user_ids that exists.
+    Cached rows are reused and the rest are fetched together with a single in_() query.
+    """
+    rows = {}
+    missing = []
+    for user_id in dict.fromkeys(str(user_id) for user_id in user_ids):
+        row = _rows.get(user_id)
+        if row is not None:
+            rows[user_id] = row
+        else:
+            missing.append(user_id)
+    if missing:
+        generations = {user_id: user_cache_generation(user_id) for user_id in missing}
+        response = await execute(supabase.table("users").select("*").in_("id", missing))
+        for fetched in response.data or []:
+            rows[fetched["id"]] = put_user_row(fetched, generations[fetched["id"]])
+    return rows
+
+
+def update_user_row(user_id, fields):
+    """
+    Applies fields to the cached row immediately and queues them for the next batch.
+    Multiple updates to the same user within USER_FLUSH_INTERVAL are merged into one write.
+    """
+    user_id = str(user_id)
+    _bump_generation(user_id)
+    row = _rows.peek(user_id)
+    if row is not None:
+        row.update(fields)
+    _writer.write(user_id, fields)
+
+
+def add_pending_gold(user_id, delta):
+    """Records a gold delta appended to the ledger but not yet compacted into users.gold."""
+    user_id = str(user_id)
+    _bump_generation(user_id)
+    _gold_pending[user_id] = _gold_pending.get(user_id, 0) + delta
+    row = _rows.peek(user_id)
+    if row is not None:
+        row["gold"] = (row.get("gold") or 0) + delta
+
+
+def settle_pending_gold(user_id, delta):
+    """The delta is now part of users.gold. The cached row is dropped so the next read sees the compacted value."""
+    user_id = str(user_id)
+    _bump_generation(user_id)
+    remaining = _gold_pending.get(user_id, 0) - delta
+    if remaining:
+        _gold_pending[user_id] = remaining
+    else:
+        _gold_pending.pop(user_id, None)
+    _rows.invalidate(user_id)
+
+
+def clear_pending_gold():
+    _gold_pending.clear()
+
+
+def set_cached_user_fields(user_id, fields):
+    """
+    Records values that are already stored in Supabase (e.g. returned by an RPC) without queueing a write.
+    Concurrent requests can answer out of order, so fields with a version no newer than the cached row's
+    are older than what the cache already shows and are ignored.
+    """
+    row = _rows.peek(str(user_id))
+    if row is None:
+        return
+    if "version" in fields and fields["version"] <= row.get("version", -1):
+        return
+    row.update(fields)
+
+
+def invalidate_user(user_id):
+    _rows.invalidate(str(user_id))
+
+
+def _on_remote_user_change(user_id, _):
+    # A fetch already in flight may predate the remote write, so it must not be cached, or joined by the next read.
+    _bump_generation(user_id)
+    drop_inflight_reads("users")
+    _rows.invalidate(str(user_id))
+
+
+subscribe("users", _on_remote_user_change)
+
+
+def clear_user_cache():
+    """Drops every cached row. Pending writes are kept and still flushed."""
+    _rows.clear()
+
+
+async def flush_user_writes(user_ids=None):
+    """
+    Sends pending writes to Supabase now and returns once they, and any batch already in flight, are stored.
+    With user_ids, only those users' writes are waited on. Raises if a write failed; it stays queued.
+    """
+    await _writer.durable(None if user_ids is None else [str(user_id) for user_id in user_ids])
+
+
+async def close_user_cache():
+    """Writes out everything still pending. Call on shutdown."""
+    await _writer.close()
+
+
+def user_cache_stats():
+    return {**_rows.stats(), **_writer.stats()}
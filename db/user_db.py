@@ -1,17 +1,151 @@
-from datetime import datetime, timezone, timedelta
-from dateutil.parser import parse
-from db.client import supabase
-from data.classes import classes
-from db.faction_db import get_faction_upgrades, ensure_user_exists
+from dataclasses import dataclass, field
+from db.client import supabase, execute
+from db.leaderboard import update_leaderboard
+from db.user_cache import (
+    get_cached_user_row,
+    get_user_row,
+    get_user_rows,
+    put_user_row,
+    user_cache_generation,
+    update_user_row,
+    set_cached_user_fields,
+    flush_user_writes,
+    publish_user_change,
+)
+from data.classes import classes, attack_mod, ATTACK_ROLL, DEFENSE_ROLL
+from db.cooldowns import HOURLY_CLAIM, HEAL, split_remaining
+from db.locks import lock_users
+from db.cas import cas_update
+from db.gold_ledger import (
+    add_user_gold,
+    flush_gold_ledger,
+    REASON_HOURLY_CLAIM,
+    REASON_DEFEATED,
+    REASON_TRANSFER,
+    REASON_COINFLIP,
+    REASON_FACTION_DEPOSIT,
+)
+from db.faction_db import (
+    get_faction_upgrades,
+    get_many_faction_upgrades,
+    put_faction_upgrades,
+    ensure_user_exists,
+    ensure_users_exist,
+    FACTION_UPGRADE_COLUMNS,
+    default_faction_upgrades,
+)
 import random
 
+BASE_DEFENSE = 5
+USER_SNAPSHOT_COLUMNS = f"*, factions({FACTION_UPGRADE_COLUMNS})"
+
+
+@dataclass
+class UserSnapshot:
+    """
+    A user's row together with their faction's upgrades.
+    Everything a command needs to render or fight with, loaded in one query.
+    """
+
+    id: str
+    user_class: str = None
+    faction: str = None
+    gold: int = 0
+    health: int = 100
+    max_health: int = 100
+    power: int = 0
+    raid_wins: int = 0
+    hourly_multiplier: float = 1.0
+    upgrades: dict = field(default_factory=default_faction_upgrades)
+
+    @classmethod
+    def from_row(cls, row, upgrades=None):
+        if upgrades is None:
+            upgrades = row.get("factions") if row.get("faction") else None
+        return cls(
+            id=row["id"],
+            user_class=row.get("class"),
+            faction=row.get("faction"),
+            gold=row.get("gold", 0),
+            health=row.get("health", 100),
+            max_health=row.get("max_health", 100),
+            power=row.get("power", 0),
+            raid_wins=row.get("raid_wins", 0),
+            hourly_multiplier=row.get("hourly_multiplier", 1.0),
+            upgrades=upgrades or default_faction_upgrades(),
+        )
+
+
+async def get_user_snapshot(user_id):
+    """
+    Loads the user row and its faction upgrades (embedded through users.faction -> factions.name) in a single round trip.
+    A cached row only needs its faction's upgrades. Returns a default snapshot if the user does not exist.
+    Errors propagate: a made-up snapshot would let a fight write default health back over the real one.
+    """
+    row = get_cached_user_row(user_id)
+    if row is not None:
+        upgrades = await get_faction_upgrades(row["faction"]) if row.get("faction") else None
+        return UserSnapshot.from_row(row, upgrades)
+
+    generation = user_cache_generation(user_id)
+    try:
+        response = await execute(supabase.table("users").select(USER_SNAPSHOT_COLUMNS).eq("id", user_id))
+    except Exception as e:
+        # The embed needs the foreign key from db/sql/users_faction_fk.sql; load the two separately instead.
+        print(f"Error in get_user_snapshot, loading the faction separately: {e}")
+        row = await get_user_row(user_id)
+        if row is None:
+            return UserSnapshot(id=user_id)
+        upgrades = await get_faction_upgrades(row["faction"]) if row.get("faction") else None
+        return UserSnapshot.from_row(row, upgrades)
+
+    if not response.data:
+        return UserSnapshot(id=user_id)
+    row = dict(response.data[0])
+    upgrades = row.pop("factions", None) if row.get("faction") else None
+    if upgrades:
+        put_faction_upgrades(row["faction"], upgrades)
+    return UserSnapshot.from_row(put_user_row(row, generation), upgrades)
+
+
+async def get_user_snapshots(user_ids):
+    """
+    Bulk version of get_user_snapshot: returns {user_id: UserSnapshot} for every requested id.
+    Costs at most one users query and one factions query no matter how many users are asked for.
+    Errors propagate, as in get_user_snapshot.
+    """
+    rows = await get_user_rows(user_ids)
+    factions = {row["faction"] for row in rows.values() if row.get("faction")}
+    upgrades = await get_many_faction_upgrades(factions) if factions else {}
+    return {
+        user_id: UserSnapshot.from_row(rows[user_id], upgrades.get(rows[user_id].get("faction"))) if user_id in rows else UserSnapshot(id=user_id)
+        for user_id in user_ids
+    }
+
+
+def calc_final_power(snapshot):
+    return snapshot.power + snapshot.upgrades["power_bonus"]
+
+
+def calc_final_attack(snapshot):
+    base_attack = classes[snapshot.user_class]["attack"] if snapshot.user_class in classes else 0
+    return base_attack + calc_final_power(snapshot) + snapshot.upgrades["attack_bonus"]
+
+
+def calc_final_defense(snapshot):
+    return BASE_DEFENSE + snapshot.upgrades["defense_bonus"]
+
+
+def calc_hourly_multiplier(snapshot):
+    return snapshot.hourly_multiplier * (1 + snapshot.upgrades["hourly_bonus"])
+
 
 async def has_enough_gold(user_id, amount):
     try:
-        response = supabase.table("users").select("gold").eq("id", user_id).execute()
+        row = await get_user_row(user_id)
 
-        if response.data:
-            return response.data[0]["gold"] >= amount
+        if row:
+            return row["gold"] >= amount
         return False
     except Exception as e:
         print(f"Error in has_enough_gold: {e}")
@@ -20,9 +154,9 @@ async def has_enough_gold(user_id, amount):
 
 async def get_user_faction(user_id):
     try:
-        response = supabase.table("users").select("faction").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["faction"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["faction"]
         return None
     except Exception as e:
         print(f"Error in get_user_faction: {e}")
@@ -31,9 +165,9 @@ async def get_user_faction(user_id):
 
 async def get_user_class(user_id):
     try:
-        response = supabase.table("users").select("class").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["class"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["class"]
         return None
     except Exception as e:
         print(f"Error in get_user_class: {e}")
@@ -42,16 +176,16 @@ async def get_user_class(user_id):
 
 async def set_user_class(user_id, user_class):
     try:
-        response = supabase.table("users").update({"class": user_class}).eq("id", user_id).execute()
+        update_user_row(user_id, {"class": user_class})
     except Exception as e:
         print(f"Error in set_user_class: {e}")
 
 
 async def get_user_health(user_id):
     try:
-        response = supabase.table("users").select("health").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["health"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["health"]
         return 100
     except Exception as e:
         print(f"Error in get_user_health: {e}")
@@ -60,9 +194,9 @@ async def get_user_health(user_id):
 
 async def get_user_raid_wins(user_id):
     try:
-        response = supabase.table("users").select("raid_wins").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["raid_wins"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["raid_wins"]
         return 0
     except Exception as e:
         print(f"Error in get_user_raid_wins: {e}")
@@ -71,7 +205,7 @@ async def get_user_raid_wins(user_id):
 
 async def update_user_health(user_id, health):
     try:
-        response = supabase.table("users").update({"health": health}).eq("id", user_id).execute()
+        update_user_row(user_id, {"health": health})
     except Exception as e:
         print(f"Error in update_user_health: {e}")
 
@@ -86,7 +220,9 @@ async def reset_user_stats(user_id):
     """
     try:
         await ensure_user_exists(user_id)
-        supabase.table("users").update({"health": 100, "gold": 0}).eq("id", user_id).execute()
+        row = await get_user_row(user_id)
+        update_user_row(user_id, {"health": 100})
+        add_user_gold(user_id, -row["gold"], REASON_DEFEATED)
         print(f"User {user_id} stats reset due to 0 health.")
     except Exception as e:
         print(f"Error in reset_user_stats: {e}")
@@ -94,9 +230,9 @@ async def reset_user_stats(user_id):
 
 async def get_user_power(user_id):
     try:
-        response = supabase.table("users").select("power").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["power"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["power"]
         return 0
     except Exception as e:
         print(f"Error in get_user_power: {e}")
@@ -105,9 +241,9 @@ async def get_user_power(user_id):
 
 async def get_user_max_health(user_id):
     try:
-        response = supabase.table("users").select("max_health").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["max_health"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["max_health"]
         return 100
     except Exception as e:
         print(f"Error in get_user_max_health: {e}")
@@ -116,41 +252,41 @@ async def get_user_max_health(user_id):
 
 async def update_user_max_health(user_id, new_max_health):
     try:
-        supabase.table("users").update({"max_health": new_max_health}).eq("id", user_id).execute()
+        update_user_row(user_id, {"max_health": new_max_health})
     except Exception as e:
         print(f"Error in update_user_max_health: {e}")
 
 
 async def update_user_power(user_id, new_power):
     try:
-        supabase.table("users").update({"power": new_power}).eq("id", user_id).execute()
+        update_user_row(user_id, {"power": new_power})
     except Exception as e:
         print(f"Error in update_user_power: {e}")
 
 
 async def claim_hourly(user_id):
+    # Held across the cooldown check and the credit, so two claims at once can't both pass the check.
+    async with lock_users(user_id):
+        return await _claim_hourly(user_id)
+
+
+async def _claim_hourly(user_id):
     try:
-        await ensure_user_exists(user_id)
-        response = supabase.table("users").select("last_hourly_claim, gold, hourly_multiplier").eq("id", user_id).execute()
-        user_data = response.data[0]
-
-        last_claim_time = parse(user_data["last_hourly_claim"])
-        current_time = datetime.now(timezone.utc)
-        if last_claim_time and (current_time - last_claim_time) < timedelta(hours=1):
-            remaining_time = timedelta(hours=1) - (current_time - last_claim_time)
-            hours, remainder = divmod(remaining_time.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
+        # Repeat claims are turned away from memory, before any database work.
+        remaining = HOURLY_CLAIM.remaining(user_id)
+        if not remaining:
+            await ensure_user_exists(user_id)
+            user_data = await get_user_row(user_id)
+            remaining = HOURLY_CLAIM.load(user_id, user_data["last_hourly_claim"])
+        if remaining:
+            hours, minutes, seconds = split_remaining(remaining)
             return f"Please wait {hours}h {minutes}m {seconds}s before claiming again."
 
         base_reward = random.randint(50, 150)
         reward = int(base_reward * user_data["hourly_multiplier"])
 
-        supabase.table("users").update(
-            {
-                "gold": user_data["gold"] + reward,
-                "last_hourly_claim": current_time.isoformat(),
-            }
-        ).eq("id", user_id).execute()
+        update_user_row(user_id, {"last_hourly_claim": HOURLY_CLAIM.start(user_id)})
+        add_user_gold(user_id, reward, REASON_HOURLY_CLAIM)
 
         return f"You've claimed your hourly reward of {reward} gold!"
     except Exception as e:
@@ -159,93 +295,147 @@ async def claim_hourly(user_id):
 
 
 async def heal_user(user_id):
-    resp = supabase.table("users").select("last_heal, health, max_health").eq("id", user_id).execute()
-    if not resp.data:
-        return "User not found."
-    user_data = resp.data[0]
-
-    last_heal = user_data["last_heal"]
-    now = datetime.now(timezone.utc)
-    cooldown = timedelta(minutes=30)
-    if last_heal:
-        if (now - datetime.fromisoformat(last_heal)) < cooldown:
-            remaining = cooldown - (now - datetime.fromisoformat(last_heal))
-            m, s = divmod(remaining.seconds, 60)
-            return f"Please wait {m}m {s}s before healing again."
+    async with lock_users(user_id):
+        return await _heal_user(user_id)
+
+
+async def _heal_user(user_id):
+    remaining = HEAL.remaining(user_id)
+    if not remaining:
+        user_data = await get_user_row(user_id)
+        if not user_data:
+            return "User not found."
+        remaining = HEAL.load(user_id, user_data["last_heal"])
+    if remaining:
+        _, m, s = split_remaining(remaining)
+        return f"Please wait {m}m {s}s before healing again."
 
     current_health = user_data["health"]
     max_health = user_data["max_health"]
     heal_amount = int(max_health * 0.10)
     new_health = min(max_health, current_health + heal_amount)
-    supabase.table("users").update({"health": new_health, "last_heal": now.isoformat()}).eq("id", user_id).execute()
+    update_user_row(user_id, {"health": new_health, "last_heal": HEAL.start(user_id)})
     return f"You have healed {new_health - current_health} health! Current health: {new_health}/{max_health}"
 
 
 async def get_user_balance(user_id):
     try:
-        response = supabase.table("users").select("gold").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["gold"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["gold"]
         return 0
     except Exception as e:
         print(f"Error in get_user_balance: {e}")
         return 0
 
 
-async def update_user_gold(user_id, gold):
+async def increment_user_fields(user_id, increments):
+    """
+    Adds each amount in increments ({column: amount}) to the user's row with a compare-and-set write
+    (db/cas.py), so increments from other processes are never lost. Returns the new values, or None.
+    Gold is not allowed here; it moves through the ledger.
+    """
     try:
-        supabase.table("users").update({"gold": gold}).eq("id", user_id).execute()
+        # Buffered writes must land first, or the compare-and-set would start from stale values.
+        await flush_user_writes([user_id])
+        result = await cas_update(
+            "users", "id", user_id, lambda row: {column: row[column] + amount for column, amount in increments.items()}, ", ".join(increments)
+        )
+        if result is None:
+            return None
+        set_cached_user_fields(user_id, result.fields)
+        publish_user_change([user_id])
+        return result.fields
     except Exception as e:
-        print(f"Error in update_user_gold: {e}")
+        print(f"Error in increment_user_fields: {e}")
+        return None
+
+
+async def increment_raid_wins(user_ids):
+    """
+    Adds one raid win to every user in user_ids with one call to the increment_raid_wins Postgres function
+    (db/sql/increment_raid_wins.sql). Returns {user_id: {"raid_wins", "version"}} for the users that exist, or None.
+    """
+    try:
+        user_ids = [str(user_id) for user_id in user_ids]
+        response = await execute(supabase.rpc("increment_raid_wins", {"p_ids": user_ids}))
+        for user_id, fields in response.data.items():
+            set_cached_user_fields(user_id, fields)
+        publish_user_change(response.data)
+        return response.data
+    except Exception as e:
+        print(f"Error in increment_raid_wins: {e}")
+        return None
+
+
+async def spend_gold(user_id, amount, reason):
+    """Debits amount if the user can afford it. Returns False, with nothing spent, if they can't."""
+    return await transfer_gold(debits={user_id: amount}, reason=reason)
 
 
 async def get_user_power(user_id):
     try:
-        response = supabase.table("users").select("power").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["power"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["power"]
         return 0
     except Exception as e:
         print(f"Error in get_user_power: {e}")
         return 0
 
 
+async def transfer_gold(debits=None, credits=None, faction=None, faction_credit=0, reason=REASON_TRANSFER):
+    """
+    Atomically moves gold using the transfer_gold Postgres function (db/sql/transfer_gold.sql), which also
+    records each user's delta in the gold ledger under reason.
+    debits and credits map user_id -> amount; faction_credit is added to the faction's resources.
+    Returns True on success, or False with nothing changed if a debited user is short.
+    Credits that need no balance check are cheaper as db.gold_ledger.add_user_gold.
+    """
+    try:
+        debits = debits or {}
+        credits = credits or {}
+        # The function works on stored balances and ledger rows, so this process's buffered writes must land first.
+        user_ids = set(debits) | set(credits)
+        await flush_user_writes(user_ids)
+        await flush_gold_ledger(user_ids)
+        response = await execute(
+            supabase.rpc(
+                "transfer_gold",
+                {"p_debits": debits, "p_credits": credits, "p_faction": faction, "p_faction_credit": faction_credit, "p_reason": reason},
+            )
+        )
+        if response.data is None:
+            return False
+        for user_id, fields in response.data["users"].items():
+            set_cached_user_fields(user_id, fields)
+        publish_user_change(response.data["users"])
+        if response.data["faction"] is not None:
+            # The stored total, not this process's index plus the credit, which may be missing other shards' deposits.
+            update_leaderboard(faction, **response.data["faction"])
+        return True
+    except Exception as e:
+        print(f"Error in transfer_gold: {e}")
+        return False
+
+
 async def get_user_final_power(user_id):
-    user_power = await get_user_power(user_id)
-    faction_name = await get_user_faction(user_id)
-    faction_bonus = 0
-    if faction_name:
-        ups = await get_faction_upgrades(faction_name)
-        faction_bonus = ups["power_bonus"]
-    return user_power + faction_bonus
+    return calc_final_power(await get_user_snapshot(user_id))
 
 
 async def get_user_final_attack(user_id):
-    final_power = await get_user_final_power(user_id)
-    user_base_attack = classes[await get_user_class(user_id)]["attack"]
-    faction_name = await get_user_faction(user_id)
-    f_attack_bonus = 0
-    if faction_name:
-        ups = await get_faction_upgrades(faction_name)
-        f_attack_bonus = ups["attack_bonus"]
-    return user_base_attack + final_power + f_attack_bonus
+    return calc_final_attack(await get_user_snapshot(user_id))
 
 
 async def get_user_final_defense(user_id):
-    base_def = 5
-    faction_name = await get_user_faction(user_id)
-    f_def_bonus = 0
-    if faction_name:
-        ups = await get_faction_upgrades(faction_name)
-        f_def_bonus = ups["defense_bonus"]
-    return base_def + f_def_bonus
+    return calc_final_defense(await get_user_snapshot(user_id))
 
 
 async def get_user_max_health(user_id):
     try:
-        response = supabase.table("users").select("max_health").eq("id", user_id).execute()
-        if response.data:
-            return response.data[0]["max_health"]
+        row = await get_user_row(user_id)
+        if row:
+            return row["max_health"]
         return 100
     except Exception as e:
         print(f"Error in get_user_max_health: {e}")
@@ -254,24 +444,13 @@ async def get_user_max_health(user_id):
 
 async def update_user_max_health(user_id, new_max):
     try:
-        supabase.table("users").update({"max_health": new_max}).eq("id", user_id).execute()
+        update_user_row(user_id, {"max_health": new_max})
     except Exception as e:
         print(f"Error in update_user_max_health: {e}")
 
 
 async def get_user_hourly_multiplier(user_id):
-    try:
-        resp = supabase.table("users").select("hourly_multiplier").eq("id", user_id).execute()
-        user_multi = resp.data[0]["hourly_multiplier"] if resp.data else 1.0
-        faction_name = await get_user_faction(user_id)
-        f_multi = 0.0
-        if faction_name:
-            ups = await get_faction_upgrades(faction_name)
-            f_multi = ups["hourly_bonus"]
-        return user_multi * (1 + f_multi)
-    except Exception as e:
-        print(f"Error in get_user_hourly_multiplier: {e}")
-        return 1.0
+    return calc_hourly_multiplier(await get_user_snapshot(user_id))
 
 
 async def duel(user_id, opponent_id):
@@ -280,18 +459,27 @@ async def duel(user_id, opponent_id):
     Returns a tuple: (response_string, winner_id, loser_id)
     If there's no clear winner, winner_id and loser_id will be None.
     """
+    # Both health values are read, then written back; another fight involving either user must wait.
+    async with lock_users(user_id, opponent_id):
+        return await _duel(user_id, opponent_id)
+
+
+async def _duel(user_id, opponent_id):
     try:
         await ensure_user_exists(user_id)
         await ensure_user_exists(opponent_id)
 
-        user_cls_name = await get_user_class(user_id)
-        opponent_cls_name = await get_user_class(opponent_id)
+        user = await get_user_snapshot(user_id)
+        opponent = await get_user_snapshot(opponent_id)
+
+        user_cls_name = user.user_class
+        opponent_cls_name = opponent.user_class
 
         user_class = classes.get(user_cls_name)
         opponent_class = classes.get(opponent_cls_name)
 
-        user_health = await get_user_health(user_id)
-        opponent_health = await get_user_health(opponent_id)
+        user_health = user.health
+        opponent_health = opponent.health
 
         if not user_class or not opponent_class:
             return (
@@ -313,36 +501,22 @@ async def duel(user_id, opponent_id):
                 None,
             )
 
-        user_final_attack = await get_user_final_attack(user_id)
-        user_final_defense = await get_user_final_defense(user_id)
-        opponent_final_attack = await get_user_final_attack(opponent_id)
-        opponent_final_defense = await get_user_final_defense(opponent_id)
+        user_final_attack = calc_final_attack(user)
+        user_final_defense = calc_final_defense(user)
+        opponent_final_attack = calc_final_attack(opponent)
+        opponent_final_defense = calc_final_defense(opponent)
 
-        user_vulnerabilities = user_class.get("vulnerabilities", [])
-        user_resistances = user_class.get("resistances", [])
-        opponent_vulnerabilities = opponent_class.get("vulnerabilities", [])
-        opponent_resistances = opponent_class.get("resistances", [])
+        user_attack_mod = attack_mod(user_cls_name, opponent_cls_name)
+        opponent_attack_mod = attack_mod(opponent_cls_name, user_cls_name)
 
-        user_attack_mod = 1.0
-        opponent_attack_mod = 1.0
-
-        if user_cls_name in opponent_resistances:
-            user_attack_mod *= 0.5
-        if opponent_cls_name in user_resistances:
-            opponent_attack_mod *= 0.5
-        if user_cls_name in opponent_vulnerabilities:
-            opponent_attack_mod *= 1.5
-        if opponent_cls_name in user_vulnerabilities:
-            user_attack_mod *= 1.5
-
-        user_attack_roll = random.randint(1, 10)
-        opponent_attack_roll = random.randint(1, 10)
+        user_attack_roll = random.randint(*ATTACK_ROLL)
+        opponent_attack_roll = random.randint(*ATTACK_ROLL)
 
         user_effective_attack = (user_final_attack + user_attack_roll) * user_attack_mod
         opponent_effective_attack = (opponent_final_attack + opponent_attack_roll) * opponent_attack_mod
 
-        user_defense_roll = random.randint(1, 5)
-        opponent_defense_roll = random.randint(1, 5)
+        user_defense_roll = random.randint(*DEFENSE_ROLL)
+        opponent_defense_roll = random.randint(*DEFENSE_ROLL)
 
         user_effective_defense = user_final_defense + user_defense_roll
         opponent_effective_defense = opponent_final_defense + opponent_defense_roll
@@ -437,29 +611,25 @@ async def coinflip(challenger_id, opponent_id, amount):
     """
     Executes a coinflip between two users.
     """
+    async with lock_users(challenger_id, opponent_id):
+        return await _coinflip(challenger_id, opponent_id, amount)
+
+
+async def _coinflip(challenger_id, opponent_id, amount):
     try:
         await ensure_user_exists(challenger_id)
         await ensure_user_exists(opponent_id)
 
-        challenger_response = supabase.table("users").select("gold").eq("id", challenger_id).execute()
-        opponent_response = supabase.table("users").select("gold").eq("id", opponent_id).execute()
-
-        challenger_gold = challenger_response.data[0]["gold"]
-        opponent_gold = opponent_response.data[0]["gold"]
-
-        if challenger_gold < amount:
+        if await get_user_balance(challenger_id) < amount:
             return f"You don't have enough gold to bet {amount}."
-        if opponent_gold < amount:
+        if await get_user_balance(opponent_id) < amount:
             return f"Opponent doesn't have enough gold to bet {amount}."
 
-        supabase.table("users").update({"gold": challenger_gold - amount}).eq("id", challenger_id).execute()
-        supabase.table("users").update({"gold": opponent_gold - amount}).eq("id", opponent_id).execute()
-
         winner_id = challenger_id if random.choice([True, False]) else opponent_id
 
-        supabase.table("users").update(
-            {"gold": supabase.table("users").select("gold").eq("id", winner_id).execute().data[0]["gold"] + (amount * 2)}
-        ).eq("id", winner_id).execute()
+        # Both stakes are taken and the pot paid out in one call; it fails if either balance changed in the meantime.
+        if not await transfer_gold(debits={challenger_id: amount, opponent_id: amount}, credits={winner_id: amount * 2}, reason=REASON_COINFLIP):
+            return f"One of you no longer has enough gold to bet {amount}."
 
         return f"Coinflip result: {'You win!' if winner_id == challenger_id else 'You lose!'} {amount} gold goes to the winner."
     except Exception as e:
@@ -471,29 +641,23 @@ async def deposit_gold_to_faction(user_id, amount):
     """
     Deposits gold from a user to their faction.
     """
+    async with lock_users(user_id):
+        return await _deposit_gold_to_faction(user_id, amount)
+
 
+async def _deposit_gold_to_faction(user_id, amount):
     try:
         await ensure_user_exists(user_id)
         faction_name = await get_user_faction(user_id)
 
         if not faction_name:
             return False
+        if amount <= 0:
+            return "Invalid amount."
 
-        response = supabase.table("users").select("gold").eq("id", user_id).execute()
-        user_gold = response.data[0]["gold"]
-
-        response = supabase.table("factions").select("resources").eq("name", faction_name).execute()
-        faction_resources = response.data[0]["resources"]
-
-        if user_gold < amount:
+        if not await transfer_gold(debits={user_id: amount}, faction=faction_name, faction_credit=amount, reason=REASON_FACTION_DEPOSIT):
             return False
 
-        user_gold -= amount
-        faction_resources += amount
-
-        response = supabase.table("users").update({"gold": user_gold}).eq("id", user_id).execute()
-        response = supabase.table("factions").update({"resources": faction_resources}).eq("name", faction_name).execute()
-
         return "Gold deposited successfully."
     except Exception as e:
         print(f"Error in deposit_gold_to_faction: {e}")
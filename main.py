@@ -1,26 +1,80 @@
+import os
 import discord
 from env import token, alt_token
 from discord.ext import commands
 import asyncio
+from db.user_cache import close_user_cache
+from db.leaderboard import seed_leaderboard
+from db.faction_db import warm_known_users
+from db.coherence import start_coherence, close_coherence
+from db.gold_ledger import start_ledger_compaction, close_gold_ledger
+from core import perf, dispatch, ratelimit
+from core.startup import phase, timed, load_extensions
 
+# No message-content intent: confirmations are buttons (core/confirm.py), and prefix commands
+# still work when the bot is mentioned.
 intents = discord.Intents.default()
-intents.message_content = True
 
-bot = commands.Bot(command_prefix="what the sigma ", intents=intents)
+COMMAND_PREFIX = "what the sigma "
+
+EXTENSIONS = [
+    "commands.dev_commands",
+    "commands.stupid_commands",
+    "commands.faction_commands",
+    "commands.faction_management",
+    "commands.battle_commands",
+    "commands.user_commands",
+    "commands.shop_commands",
+    "commands.faction_shop_commands",
+    "commands.co_op_commands",
+]
+
+# Sharding: unset runs a plain Bot; "auto" lets Discord pick the shard count; a number fixes it.
+# SHARD_IDS ("0,1") runs only those shards in this process. Run the other shards in separate processes
+# with CACHE_COHERENCE=table so their caches stay consistent (see db/coherence.py).
+SHARD_COUNT = os.environ.get("SHARD_COUNT")
+SHARD_IDS = os.environ.get("SHARD_IDS")
+
+
+def make_bot():
+    options = {"command_prefix": commands.when_mentioned_or(COMMAND_PREFIX), "intents": intents}
+    if not SHARD_COUNT:
+        return commands.Bot(**options)
+    if SHARD_COUNT != "auto":
+        options["shard_count"] = int(SHARD_COUNT)
+    if SHARD_IDS:
+        options["shard_ids"] = [int(shard_id) for shard_id in SHARD_IDS.split(",")]
+    return commands.AutoShardedBot(**options)
+
+
+bot = make_bot()
+perf.install(bot)
+ratelimit.install(bot)
+dispatch.install(bot, COMMAND_PREFIX)
 
 
 async def main():
     async with bot:
-        await bot.load_extension("commands.dev_commands")
-        await bot.load_extension("commands.stupid_commands")
-        await bot.load_extension("commands.faction_commands")
-        await bot.load_extension("commands.faction_management")
-        await bot.load_extension("commands.battle_commands")
-        await bot.load_extension("commands.user_commands")
-        await bot.load_extension("commands.shop_commands")
-        await bot.load_extension("commands.faction_shop_commands")
-        await bot.load_extension("commands.co_op_commands")
-        await bot.start(token)
+        # The warm-up scans are DB round trips and extension loading is mostly imports; run them side by side.
+        with phase("startup"):
+            await asyncio.gather(
+                timed("seed leaderboard", seed_leaderboard()),
+                timed("warm known users", warm_known_users()),
+                load_extensions(bot, EXTENSIONS),
+                timed("start cache coherence", start_coherence()),
+            )
+        perf.start_perf_logger()
+        # One compaction job is enough; with shards split across processes, shard 0's process runs it.
+        shard_ids = getattr(bot, "shard_ids", None)
+        if shard_ids is None or 0 in shard_ids:
+            start_ledger_compaction()
+        try:
+            await bot.start(token)
+        finally:
+            # Users writes and gold deltas are buffered in memory; make sure none are lost on the way down.
+            await close_gold_ledger()
+            await close_user_cache()
+            await close_coherence()
 
 
 asyncio.run(main())
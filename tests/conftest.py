@@ -0,0 +1,67 @@
+"""
+The tests run the db/ layer against the in-memory backend (db/memory_backend.py), so they need no Supabase
+project. The environment has to be set before anything imports db.client.
+"""
+import asyncio
+import os
+
+os.environ.setdefault("DB_BACKEND", "memory")
+os.environ.setdefault("DB_MEMORY_LATENCY", "0")
+os.environ.setdefault("CAS_RETRY_DELAY", "0")
+os.environ.setdefault("BATCH_RETRY_DELAY", "0.01")
+os.environ.setdefault("BATCH_MAX_RETRIES", "3")
+os.environ.setdefault("LEDGER_COMPACT_INTERVAL", "0")
+
+import pytest
+from db.client import supabase
+from db.cooldowns import clear_cooldowns
+from db.faction_db import clear_faction_upgrades, clear_known_users
+from db.gold_ledger import clear_gold_ledger, close_gold_ledger
+from db.user_cache import clear_user_cache, close_user_cache
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    supabase.clear()
+    supabase.reset_stats()
+    supabase.latency = 0
+    clear_user_cache()
+    clear_gold_ledger()
+    clear_cooldowns()
+    clear_faction_upgrades()
+    clear_known_users()
+    yield
+
+
+@pytest.fixture
+def run():
+    """run(coro) runs it on a fresh loop and then writes out the shared write-behind buffers, as shutdown does."""
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await close_gold_ledger()
+                await close_user_cache()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def fail_queries(monkeypatch):
+    """fail_queries(predicate) makes every query for which predicate(query) is true raise, like a rejected request."""
+
+    def fail_queries(predicate):
+        original = supabase._run
+
+        def run(query):
+            if predicate(query):
+                raise ValueError(f"rejected {query._method} {query._table}")
+            return original(query)
+
+        monkeypatch.setattr(supabase, "_run", run)
+
+    return fail_queries
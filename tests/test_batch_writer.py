@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+from db.batch_writer import BatchWriter, BATCH_MAX_RETRIES
+from db.client import supabase
+
+
+def stored(user_id):
+    return next(row for row in supabase.rows("users") if row["id"] == user_id)
+
+
+def upserts():
+    return supabase.stats()["calls_by_table"].get("users", 0)
+
+
+@pytest.fixture
+def users():
+    supabase.seed("users", [{"id": str(i)} for i in range(1, 5)])
+    supabase.reset_stats()
+
+
+def test_writes_in_one_window_merge_into_one_upsert(run, users):
+    writer = BatchWriter("users", window=0.01)
+
+    async def scenario():
+        writer.write("1", {"power": 1})
+        writer.write("1", {"power": 2, "raid_wins": 1})
+        writer.write("2", {"power": 3, "raid_wins": 0})
+        await asyncio.sleep(0.05)
+
+    run(scenario())
+    assert upserts() == 1
+    assert writer.stats()["merged"] == 1
+    assert (stored("1")["power"], stored("1")["raid_wins"]) == (2, 1)
+    assert stored("2")["power"] == 3
+
+
+def test_durable_stores_before_the_window_ends(run, users):
+    writer = BatchWriter("users", window=60)
+
+    async def scenario():
+        writer.write("1", {"power": 7})
+        writer.write("2", {"power": 8})
+        await writer.durable(["1"])
+        return stored("1")["power"], stored("2")["power"]
+
+    assert run(scenario()) == (7, 0)
+    assert writer.pending("2") == {"power": 8}
+
+
+def test_failed_rows_are_requeued_and_retried(run, users, fail_queries):
+    writer = BatchWriter("users", window=0.01)
+    attempts = []
+
+    def first_upsert_fails(query):
+        if query._method != "POST":
+            return False
+        attempts.append(query)
+        return len(attempts) == 1
+
+    fail_queries(first_upsert_fails)
+
+    async def scenario():
+        writer.write("1", {"power": 7})
+        with pytest.raises(ValueError):
+            await writer.durable(["1"])
+        assert writer.pending("1") == {"power": 7}
+        # Backing off: durable fails at once instead of sending the row again.
+        with pytest.raises(ValueError):
+            await writer.durable(["1"])
+        assert len(attempts) == 1
+        writer.write("1", {"raid_wins": 2})
+        await asyncio.sleep(0.1)
+
+    run(scenario())
+    assert (stored("1")["power"], stored("1")["raid_wins"]) == (7, 2)
+    assert writer.stats()["failures"] == 1
+    assert writer.stats()["retrying"] == 0
+
+
+def test_a_rejected_row_is_isolated_and_dropped(run, users, fail_queries):
+    writer = BatchWriter("users", window=0.01)
+    fail_queries(lambda query: query._method == "POST" and any(row.get("power") == "bad" for row in query._payload))
+
+    async def scenario():
+        writer.write("1", {"power": 1})
+        writer.write("2", {"power": "bad"})
+        writer.write("3", {"power": 3})
+        await asyncio.sleep(0.5)
+
+    run(scenario())
+    assert stored("1")["power"] == 1
+    assert stored("3")["power"] == 3
+    assert stored("2")["power"] == 0
+    assert writer.stats()["dropped"] == 1
+    assert writer.stats()["failures"] == BATCH_MAX_RETRIES
+    assert not writer.has_pending()
+
+
+def test_one_upsert_per_row_in_flight(run, users):
+    writer = BatchWriter("users", window=60)
+    supabase.latency = 0.02
+
+    async def scenario():
+        writer.write("1", {"power": 1})
+        first = asyncio.ensure_future(writer.flush())
+        await asyncio.sleep(0)
+        writer.write("1", {"power": 2})
+        # Sending now could land before the first upsert; it has to wait for it.
+        await writer.flush()
+        assert writer.pending("1") == {"power": 2}
+        await writer.durable(["1"])
+        await first
+
+    run(scenario())
+    assert stored("1")["power"] == 2
+    assert upserts() == 2
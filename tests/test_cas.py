@@ -0,0 +1,62 @@
+import pytest
+from db.cas import cas_update, cas_stats, CasConflict, CAS_MAX_RETRIES
+from db.client import supabase
+
+
+def power(user_id="1"):
+    return next(row for row in supabase.rows("users") if row["id"] == user_id)
+
+
+def bump_power_behind_our_back():
+    supabase.table("users").update({"power": power()["power"] + 10}).eq("id", "1").execute()
+
+
+def test_applies_and_bumps_version(run):
+    supabase.seed("users", [{"id": "1", "power": 5}])
+    result = run(cas_update("users", "id", "1", lambda row: {"power": row["power"] + 1}, "power"))
+    assert result.applied
+    assert result.fields == {"power": 6, "version": 1}
+    assert power()["power"] == 6
+    assert power()["version"] == 1
+
+
+def test_retries_from_the_new_row_after_a_concurrent_write(run):
+    supabase.seed("users", [{"id": "1", "power": 5}])
+    calls = []
+
+    def compute(row):
+        calls.append(row["power"])
+        if len(calls) == 1:
+            bump_power_behind_our_back()
+        return {"power": row["power"] + 1}
+
+    retries = cas_stats().get("users", {}).get("retries", 0)
+    result = run(cas_update("users", "id", "1", compute, "power"))
+    assert calls == [5, 15]
+    assert result.new_row["power"] == 16
+    assert power()["power"] == 16
+    assert cas_stats()["users"]["retries"] == retries + 1
+
+
+def test_declined_leaves_the_row_alone(run):
+    supabase.seed("users", [{"id": "1", "power": 5}])
+    result = run(cas_update("users", "id", "1", lambda row: None, "power"))
+    assert not result.applied
+    assert result.row["power"] == 5
+    assert power()["version"] == 0
+
+
+def test_missing_row(run):
+    assert run(cas_update("users", "id", "nobody", lambda row: {"power": 1}, "power")) is None
+
+
+def test_gives_up_when_the_row_keeps_changing(run):
+    supabase.seed("users", [{"id": "1", "power": 5}])
+
+    def compute(row):
+        bump_power_behind_our_back()
+        return {"power": row["power"] + 1}
+
+    with pytest.raises(CasConflict):
+        run(cas_update("users", "id", "1", compute, "power"))
+    assert power()["power"] == 5 + 10 * (CAS_MAX_RETRIES + 1)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+import pytest
+from db.batch_writer import BATCH_MAX_RETRIES
+from db.client import supabase
+from db.gold_ledger import (
+    add_user_gold,
+    compact_gold_ledger,
+    flush_gold_ledger,
+    gold_ledger_stats,
+    rebuild_gold_balance,
+    REASON_DEFEATED,
+    REASON_HOURLY_CLAIM,
+    REASON_RAID_LOOT,
+)
+from db.user_db import get_user_balance, transfer_gold
+
+USERS = ["1", "2", "3"]
+
+
+def seed():
+    supabase.seed("users", [{"id": user_id, "gold": 1_000} for user_id in USERS])
+    supabase.seed("gold_ledger", [{"user_id": user_id, "delta": 1_000, "reason": "opening_balance", "compacted": True} for user_id in USERS])
+
+
+async def play():
+    add_user_gold("1", 120, REASON_HOURLY_CLAIM)
+    add_user_gold("2", 75, REASON_RAID_LOOT)
+    add_user_gold("2", -30, REASON_RAID_LOOT)
+    assert await transfer_gold(debits={"1": 500}, credits={"3": 500})
+    assert not await transfer_gold(debits={"3": 10_000}, credits={"1": 10_000})
+    add_user_gold("3", 1, REASON_HOURLY_CLAIM)
+    await flush_gold_ledger()
+
+
+def stored_gold():
+    return {row["id"]: row["gold"] for row in supabase.rows("users")}
+
+
+def test_balances_match_the_rebuilt_ledger_before_compaction(run):
+    seed()
+
+    async def scenario():
+        await play()
+        return {user_id: (await get_user_balance(user_id), await rebuild_gold_balance(user_id)) for user_id in USERS}
+
+    balances = run(scenario())
+    assert balances == {"1": (620, 620), "2": (1_045, 1_045), "3": (1_501, 1_501)}
+
+
+def test_compaction_folds_every_row_into_users_gold(run):
+    seed()
+
+    async def scenario():
+        await play()
+        await compact_gold_ledger()
+        return {user_id: await rebuild_gold_balance(user_id) for user_id in USERS}
+
+    rebuilt = run(scenario())
+    assert stored_gold() == rebuilt == {"1": 620, "2": 1_045, "3": 1_501}
+    assert all(row["compacted"] for row in supabase.rows("gold_ledger"))
+
+
+def test_compacting_twice_changes_nothing(run):
+    seed()
+
+    async def scenario():
+        await play()
+        await compact_gold_ledger()
+        await compact_gold_ledger()
+
+    run(scenario())
+    assert stored_gold() == {"1": 620, "2": 1_045, "3": 1_501}
+
+
+def test_a_transfer_waits_for_deltas_another_flush_has_in_flight(run, monkeypatch):
+    seed()
+    original = supabase._run
+
+    def slow_ledger_inserts(query):
+        if query._table == "gold_ledger" and query._method == "POST":
+            time.sleep(0.1)
+        return original(query)
+
+    monkeypatch.setattr(supabase, "_run", slow_ledger_inserts)
+
+    async def scenario():
+        add_user_gold("1", -1_000, REASON_DEFEATED)
+        # As the periodic flush would: the delta has left the buffer but isn't stored yet.
+        periodic = asyncio.ensure_future(flush_gold_ledger())
+        await asyncio.sleep(0.01)
+        approved = await transfer_gold(debits={"1": 1_000}, credits={"2": 1_000})
+        await periodic
+        return approved, await rebuild_gold_balance("1")
+
+    assert run(scenario()) == (False, 0)
+
+
+def test_a_rejected_delta_is_isolated_and_dropped(run, fail_queries):
+    seed()
+    fail_queries(lambda query: query._table == "gold_ledger" and query._method == "POST" and any(row["user_id"] == "ghost" for row in query._payload))
+
+    async def scenario():
+        add_user_gold("1", 5, REASON_HOURLY_CLAIM)
+        add_user_gold("ghost", 7, REASON_HOURLY_CLAIM)
+        add_user_gold("2", 3, REASON_HOURLY_CLAIM)
+        await flush_gold_ledger()
+        # The other users' deltas go out on their own and don't wait on the rejected one.
+        await asyncio.sleep(0.02)
+        await flush_gold_ledger(["1", "2"])
+        with pytest.raises(ValueError):
+            await flush_gold_ledger(["ghost"])
+        for _ in range(BATCH_MAX_RETRIES):
+            await asyncio.sleep(0.05)
+            await flush_gold_ledger()
+        return await rebuild_gold_balance("1"), await rebuild_gold_balance("2"), await get_user_balance("ghost")
+
+    assert run(scenario()) == (1_005, 1_003, 0)
+    stats = gold_ledger_stats()
+    assert (stats["dropped"], stats["retrying"], stats["buffered"]) == (1, 0, 0)
@@ -0,0 +1,43 @@
+from db.client import supabase
+from db.leaderboard import get_top_factions, seed_leaderboard, _on_remote_change
+from db.user_db import transfer_gold
+
+
+def seed():
+    supabase.seed("factions", [{"name": "Alpha", "leader_id": "1", "resources": 10_000}])
+    supabase.seed("users", [{"id": "1", "faction": "Alpha", "gold": 1_000}])
+
+
+def alpha(top):
+    return next(faction for faction in top if faction["name"] == "Alpha")
+
+
+def test_a_deposit_shows_the_stored_total(run):
+    seed()
+
+    async def scenario():
+        await seed_leaderboard()
+        # A deposit made by another process that this one hasn't heard about yet.
+        supabase.rpc("transfer_gold", {"p_faction": "Alpha", "p_faction_credit": 500}).execute()
+        assert await transfer_gold(debits={"1": 100}, faction="Alpha", faction_credit=100)
+        return alpha(await get_top_factions())
+
+    assert run(scenario())["resources"] == 10_600
+
+
+def test_out_of_order_updates_do_not_roll_a_column_back(run):
+    seed()
+
+    async def scenario():
+        await seed_leaderboard()
+        _on_remote_change("Alpha", {"resources": 10_200, "version": 3})
+        _on_remote_change("Alpha", {"resources": 10_100, "version": 2})
+        first = alpha(await get_top_factions())["resources"]
+        # A newer write to another column doesn't hide an older resources value that is still the latest one.
+        _on_remote_change("Alpha", {"power_bonus": 1, "version": 5})
+        _on_remote_change("Alpha", {"resources": 10_300, "version": 4})
+        return first, alpha(await get_top_factions())
+
+    first, faction = run(scenario())
+    assert first == 10_200
+    assert (faction["resources"], faction["power_bonus"]) == (10_300, 1)
@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from db.locks import StripedLocks
+
+
+def keys_on_distinct_stripes(locks, count):
+    keys, stripes = [], set()
+    for i in range(10_000):
+        stripe = locks._stripes([f"user-{i}"])[0]
+        if stripe not in stripes:
+            stripes.add(stripe)
+            keys.append(f"user-{i}")
+        if len(keys) == count:
+            return keys
+    raise AssertionError("not enough stripes")
+
+
+def test_stripes_are_taken_in_ascending_order():
+    locks = StripedLocks(64)
+    keys = keys_on_distinct_stripes(locks, 5)
+    assert locks._stripes(reversed(keys)) == sorted(locks._stripes([key])[0] for key in keys)
+
+
+def test_opposite_orders_do_not_deadlock():
+    locks = StripedLocks(64)
+    a, b = keys_on_distinct_stripes(locks, 2)
+    order = []
+
+    async def fight(first, second, name):
+        for _ in range(50):
+            async with locks.hold(first, second):
+                order.append(name)
+                await asyncio.sleep(0)
+
+    async def scenario():
+        await asyncio.wait_for(asyncio.gather(fight(a, b, "ab"), fight(b, a, "ba")), timeout=5)
+
+    asyncio.run(scenario())
+    assert len(order) == 100
+    assert locks.stats()["held"] == 0
+
+
+def test_keys_sharing_a_stripe_take_it_once():
+    # The locks aren't reentrant, so taking a shared stripe twice would wait on itself forever.
+    locks = StripedLocks(1)
+
+    async def scenario():
+        async with locks.hold("a", "b", "a"):
+            return locks.stats()["held"]
+
+    assert asyncio.run(asyncio.wait_for(scenario(), timeout=5)) == 1
+    assert locks.stats()["acquisitions"] == 1
+
+
+def test_released_when_the_body_raises():
+    locks = StripedLocks(8)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            async with locks.hold("a", "b"):
+                raise RuntimeError
+
+    asyncio.run(scenario())
+    assert locks.stats()["held"] == 0
@@ -0,0 +1,27 @@
+from db.client import supabase
+from db.memory_backend import serve_memory_backend, RemoteMemoryClient
+
+
+def test_int_user_ids_are_cast_to_text():
+    supabase.seed("users", [{"id": "5", "power": 1}])
+    supabase.table("users").upsert([{"id": 5, "power": 2}]).execute()
+    assert [(row["id"], row["power"]) for row in supabase.rows("users")] == [("5", 2)]
+    assert supabase.table("users").select("power").eq("id", 5).execute().data == [{"power": 2}]
+    assert supabase.table("users").select("id").in_("id", [5, 6]).execute().data == [{"id": "5"}]
+
+
+def test_rpc_parameters_arrive_as_json():
+    supabase.seed("users", [{"id": "5", "gold": 10}])
+    response = supabase.rpc("transfer_gold", {"p_debits": {5: 4}, "p_credits": {}}).execute()
+    assert response.data == {"users": {"5": {"gold": 6, "version": 1}}, "faction": None}
+
+
+def test_a_remote_client_shares_the_served_tables():
+    address, served = serve_memory_backend()
+    remote = RemoteMemoryClient(address)
+    remote.seed("users", [{"id": "5"}])
+    assert [row["id"] for row in served.rows("users")] == ["5"]
+    remote.table("users").update({"power": 2}).eq("id", 5).execute()
+    assert remote.table("users").select("power").eq("id", "5").execute().data == [{"power": 2}]
+    remote.clear()
+    assert served.rows("users") == remote.rows("users") == []
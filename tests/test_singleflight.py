@@ -0,0 +1,64 @@
+import asyncio
+import time
+import pytest
+from db.client import supabase, execute, drop_inflight_reads, singleflight_stats
+
+
+@pytest.fixture
+def slow_reads(monkeypatch):
+    """Reads take their snapshot, then take 50ms to come back, so a later write can land while one is in flight."""
+    original = supabase._run
+
+    def run(query):
+        response = original(query)
+        if query._method == "GET":
+            time.sleep(0.05)
+        return response
+
+    monkeypatch.setattr(supabase, "_run", run)
+
+
+def read():
+    return execute(supabase.table("users").select("power").eq("id", "1"))
+
+
+def test_identical_reads_in_flight_share_one_request(run, slow_reads):
+    supabase.seed("users", [{"id": "1", "power": 1}])
+    coalesced = singleflight_stats()["coalesced"]
+
+    async def scenario():
+        return await asyncio.gather(read(), read(), read())
+
+    responses = run(scenario())
+    assert [response.data for response in responses] == [[{"power": 1}]] * 3
+    assert supabase.stats()["calls_by_table"]["users"] == 1
+    assert singleflight_stats()["coalesced"] == coalesced + 2
+
+
+def test_a_read_after_a_write_does_not_join_an_older_read(run, slow_reads):
+    supabase.seed("users", [{"id": "1", "power": 1}])
+
+    async def scenario():
+        before = asyncio.ensure_future(read())
+        await asyncio.sleep(0.01)
+        await execute(supabase.table("users").update({"power": 2}).eq("id", "1"))
+        after = await read()
+        return (await before).data, after.data
+
+    assert run(scenario()) == ([{"power": 1}], [{"power": 2}])
+    assert supabase.stats()["calls_by_table"]["users"] == 3
+
+
+def test_a_remote_change_also_stops_reads_joining_older_ones(run, slow_reads):
+    supabase.seed("users", [{"id": "1", "power": 1}])
+
+    async def scenario():
+        before = asyncio.ensure_future(read())
+        await asyncio.sleep(0.01)
+        # Another process's write: it only shows up here as an invalidation.
+        supabase.table("users").update({"power": 2}).eq("id", "1").execute()
+        drop_inflight_reads("users")
+        after = await read()
+        return (await before).data, after.data
+
+    assert run(scenario()) == ([{"power": 1}], [{"power": 2}])
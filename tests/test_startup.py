@@ -0,0 +1,37 @@
+import asyncio
+import pytest
+from core import startup
+
+
+class FakeTree:
+    def __init__(self, failures):
+        self.failures = failures
+        self.syncs = 0
+
+    def get_commands(self):
+        return []
+
+    async def sync(self):
+        self.syncs += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("429 Too Many Requests")
+        return []
+
+
+class FakeBot:
+    def __init__(self, tree):
+        self.tree = tree
+
+
+def test_a_failed_sync_is_retried_on_the_next_ready(tmp_path, monkeypatch):
+    monkeypatch.setattr(startup, "TREE_HASH_PATH", str(tmp_path / "tree_hash"))
+    monkeypatch.setattr(startup, "_tree_checked", False)
+    bot = FakeBot(FakeTree(failures=1))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(startup.sync_tree_if_changed(bot))
+    assert asyncio.run(startup.sync_tree_if_changed(bot)) == 0
+    # Synced once, so later reconnects don't sync again.
+    assert asyncio.run(startup.sync_tree_if_changed(bot)) is None
+    assert bot.tree.syncs == 2
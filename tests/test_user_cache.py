@@ -0,0 +1,36 @@
+from db.client import supabase
+from db.faction_db import remove_member_from_faction
+from db.user_cache import get_cached_user_row, update_user_row, flush_user_writes
+from db.user_db import get_user_snapshot
+
+
+def seed():
+    supabase.seed("factions", [{"name": "Alpha", "leader_id": "1", "power_bonus": 5}])
+    supabase.seed("users", [{"id": "5", "faction": "Alpha"}])
+
+
+def test_int_and_str_ids_share_one_cache_entry(run):
+    seed()
+
+    async def scenario():
+        assert (await get_user_snapshot("5")).faction == "Alpha"
+        # Discord hands commands int ids; the snapshot path reads with the stored str id.
+        await remove_member_from_faction(5)
+        return await get_user_snapshot("5"), get_cached_user_row(5)
+
+    snapshot, cached = run(scenario())
+    assert snapshot.faction is None
+    assert snapshot.upgrades["power_bonus"] == 0
+    assert cached["faction"] is None
+
+
+def test_writes_with_int_ids_update_the_stored_row(run):
+    seed()
+
+    async def scenario():
+        update_user_row(5, {"power": 3})
+        update_user_row("5", {"health": 50})
+        await flush_user_writes([5])
+
+    run(scenario())
+    assert [(row["id"], row["power"], row["health"]) for row in supabase.rows("users")] == [("5", 3, 50)]